@@ -14,6 +14,20 @@ from ..schemas import schemas
 from ..core.database import get_db
 from .auth import get_current_admin  # 导入管理员鉴权依赖
 from .notifications import create_system_notification  # 导入通知创建函数
+from ..services.prompt_events import snapshot_prompt, publish_prompt_change
+from ..services.search_index import search_index
+from ..services.listing_counts import listing_counts
+from ..services.response_cache import listing_response_cache
+from ..services.view_counter import view_counter
+from ..services.tags import tag_resolver
+from ..services.tag_catalog import tag_catalog
+from ..services.principals import principal_cache
+from ..services.password_hasher import password_hasher
+from ..services.llm_providers import provider_stats
+from ..services.llm_scheduler import llm_scheduler
+from ..services.chat_sessions import chat_sessions
+from ..services.push import push_hub
+from ..services import unread_counters
 
 # 创建管理员路由
 admin_router = APIRouter()
@@ -25,6 +39,7 @@ async def reject_all_pending_prompts(
     current_admin: models.User = Depends(get_current_admin)
 ):
     """一键拒绝所有待审核的Prompt"""
+    # 待审核与已拒绝的Prompt都不会出现在市场中，检索索引和列表总数缓存无需更新
     query = select(models.Prompt).filter(models.Prompt.status == 0)
     result = await db.execute(query)
     pending_prompts = result.scalars().all()
@@ -33,6 +48,7 @@ async def reject_all_pending_prompts(
         return {"message": "没有待审核的Prompt", "count": 0}
 
     count = 0
+    notified_user_ids = set()
     for prompt in pending_prompts:
         # 保存必要信息用于发送通知
         user_id = prompt.user_id
@@ -52,10 +68,12 @@ async def reject_all_pending_prompts(
             notification_type="prompt_rejected",
             related_prompt_id=prompt_id
         )
+        notified_user_ids.add(user_id)
         
         count += 1
     
     await db.commit()
+    await push_hub.publish(notified_user_ids, {"type": "notification", "notification_type": "prompt_rejected"})
     return {"message": f"成功拒绝 {count} 个待审核的Prompt", "count": count}
 
 @admin_router.delete("/prompts/delete-all-rejected", response_model=dict)
@@ -191,6 +209,9 @@ async def update_prompt_content(
     if prompt is None:
         raise HTTPException(status_code=404, detail="Prompt not found")
     
+    # 记录修改前的状态，用于更新检索索引
+    before = snapshot_prompt(prompt)
+    
     # 更新prompt内容
     prompt.title = prompt_update.title
     prompt.content = prompt_update.content
@@ -201,25 +222,17 @@ async def update_prompt_content(
 
     # 处理标签更新
     if prompt_update.tags is not None:
-        # 清空现有标签
+        # 批量查找或创建新标签，替换现有标签
+        new_tags = await tag_resolver.resolve(db, prompt_update.tags)
         prompt.tags.clear()
-        await db.flush() # 确保清除操作被执行
-
-        # 添加新标签
-        for tag_name in prompt_update.tags:
-            if tag_name: # 确保标签名不为空
-                # 查找或创建标签
-                tag_result = await db.execute(select(models.Tag).filter(models.Tag.name == tag_name))
-                tag = tag_result.scalars().first()
-                if not tag:
-                    tag = models.Tag(name=tag_name)
-                    db.add(tag)
-                    await db.flush() # 确保新标签在添加到prompt前有ID
-                prompt.tags.append(tag)
+        prompt.tags.extend(new_tags)
     
+    after = snapshot_prompt(prompt)
     await db.commit()
     await db.refresh(prompt)
     
+    publish_prompt_change(before, after)
+    
     return prompt
 
 @admin_router.delete("/prompts/{prompt_id}")
@@ -229,8 +242,8 @@ async def delete_prompt(
     current_admin: models.User = Depends(get_current_admin)  # 添加管理员鉴权
 ):
     """删除一个prompt"""
-    # 查找prompt
-    query = select(models.Prompt).filter(models.Prompt.id == prompt_id)
+    # 查找prompt（预加载标签，用于更新检索索引）
+    query = select(models.Prompt).options(selectinload(models.Prompt.tags)).filter(models.Prompt.id == prompt_id)
     result = await db.execute(query)
     prompt = result.scalars().first()
     
@@ -238,22 +251,26 @@ async def delete_prompt(
         raise HTTPException(status_code=404, detail="Prompt not found")
     
     # 删除prompt
+    before = snapshot_prompt(prompt)
     await db.delete(prompt)
     await db.commit()
     
+    publish_prompt_change(before, None)
+    
     return {"message": f"Prompt {prompt_id} has been deleted", "status": "success"}
 
 async def update_prompt_status(prompt_id: int, status: int, db: AsyncSession, background_tasks: BackgroundTasks):
     """更新prompt的审核状态"""
-    # 先获取prompt基本信息，避免复杂的关系加载
-    query = select(models.Prompt).filter(models.Prompt.id == prompt_id)
+    # 先获取prompt基本信息，只预加载标签（用于更新检索索引）
+    query = select(models.Prompt).options(selectinload(models.Prompt.tags)).filter(models.Prompt.id == prompt_id)
     result = await db.execute(query)
     prompt = result.scalars().first()
     
     if prompt is None:
         raise HTTPException(status_code=404, detail="Prompt not found")
     
-    # 记录之前的状态和必要信息，用于发送通知
+    # 记录之前的状态和必要信息，用于发送通知和更新检索索引
+    before = snapshot_prompt(prompt)
     old_status = prompt.status
     user_id = prompt.user_id
     title = prompt.title
@@ -293,6 +310,14 @@ async def update_prompt_status(prompt_id: int, status: int, db: AsyncSession, ba
     
     await db.commit()
     
+    if old_status != status:
+        publish_prompt_change(before, before._replace(status=status))
+    if old_status != status and notification_title:
+        await push_hub.publish(
+            [user_id],
+            {"type": "notification", "notification_type": notification_type, "title": notification_title}
+        )
+    
     # 重新获取带关系的数据用于返回，使用joinedload而不是selectinload
     query_with_relations = select(models.Prompt).options(
         joinedload(models.Prompt.tags),
@@ -349,11 +374,13 @@ async def get_views_stats(
     today_stats = today_stats_result.scalar_one_or_none()
     
     daily_views = today_stats.views if today_stats else 0
+    # 加上内存中尚未写回的浏览量
+    daily_views += view_counter.pending_daily_views(today)
     
     # 获取累计浏览量
     total_views_query = select(func.sum(models.Prompt.views))
     total_views_result = await db.execute(total_views_query)
-    total_views = total_views_result.scalar() or 0
+    total_views = (total_views_result.scalar() or 0) + view_counter.pending_total()
     
     # 获取过去7天的浏览量趋势
     week_ago = today - timedelta(days=7)
@@ -378,6 +405,26 @@ async def get_views_stats(
         "weekly_trend": trend_data
     }
 
+@admin_router.get("/stats/cache", response_model=dict)
+async def get_cache_stats(
+    current_admin: models.User = Depends(get_current_admin)
+):
+    """获取列表缓存和检索索引的命中统计（仅统计当前进程）"""
+    return {
+        "listing_responses": listing_response_cache.stats(),
+        "listing_counts": {"entries": len(listing_counts)},
+        "view_counter": view_counter.stats(),
+        "search_index": {"ready": search_index.ready, "documents": len(search_index), "rebuilds": search_index.rebuilds},
+        "tags": tag_resolver.stats(),
+        "principals": principal_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "llm_providers": provider_stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "push": push_hub.stats(),
+        "tag_catalog": {"ready": tag_catalog.ready, "tags": len(tag_catalog), "version": tag_catalog.version, "rebuilds": tag_catalog.rebuilds},
+    }
+
 @admin_router.delete("/comments/{comment_id}", status_code=204)
 async def admin_delete_comment(
     comment_id: int, 
@@ -458,8 +505,18 @@ async def admin_send_notification(
         notifications.append(notification)
     
     db.add_all(notifications)
+    if notification_request.broadcast:
+        await unread_counters.add_for_all_users(db, unread_counters.notification_category("admin"))
+    else:
+        await unread_counters.add(db, target_user_ids, unread_counters.notification_category("admin"))
     await db.commit()
     
+    # 广播只发布一个事件，由每个进程分发给所有在线用户
+    await push_hub.publish(
+        None if notification_request.broadcast else target_user_ids,
+        {"type": "notification", "notification_type": "admin", "title": notification_request.title}
+    )
+    
     message = "广播通知发送成功" if notification_request.broadcast else f"成功发送通知给 {len(target_user_ids)} 个用户"
     
     return {
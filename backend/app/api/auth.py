@@ -4,7 +4,6 @@ from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 from pydantic import BaseModel
@@ -14,12 +13,14 @@ from ..schemas import schemas
 from ..core.database import get_db
 from ..core.github_auth import GitHubOAuth, get_or_create_github_user
 from ..core.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..services.principals import principal_cache
+from ..services.password_hasher import password_hasher
 
 # 创建路由
 auth_router = APIRouter()
 
-# 密码上下文，用于密码哈希和验证
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密码上下文，用于密码哈希和验证（async接口中请使用 password_hasher，避免阻塞事件循环）
+pwd_context = password_hasher.context
 
 # OAuth2 密码bearer令牌
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/auth/token", auto_error=False)
@@ -63,7 +64,7 @@ async def authenticate_user(username: str, password: str, db: AsyncSession):
         return False
     if not user.hashed_password:  # OAuth用户没有密码
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
@@ -78,10 +79,25 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+async def get_user_by_id(user_id: int, db: AsyncSession):
+    """根据用户ID获取用户（主键查询）"""
+    return await db.get(models.User, user_id)
+
 async def get_current_user(token: Optional[str] = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
-    """获取当前用户"""
+    """获取当前用户，优先使用登录用户缓存，命中时不解码令牌也不查询数据库"""
     if not token:
         return None
+    
+    # 已验证过的令牌：用户在缓存中直接返回，否则按主键重新加载
+    user_id = principal_cache.user_id_for_token(token)
+    if user_id is not None:
+        user = principal_cache.get_user(user_id)
+        if user is None:
+            user = await get_user_by_id(user_id, db)
+            if user is not None:
+                principal_cache.put_user(user)
+        if user is not None:
+            return user
         
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -96,9 +112,19 @@ async def get_current_user(token: Optional[str] = Depends(oauth2_scheme), db: As
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = await get_user(username=token_data.username, db=db)
+    
+    # 新令牌携带用户ID，可以按主键查询；旧令牌仍按用户名查询
+    token_user_id = payload.get("uid")
+    if isinstance(token_user_id, int):
+        user = await get_user_by_id(token_user_id, db)
+        if user is not None and user.username != token_data.username:
+            user = None
+    else:
+        user = await get_user(username=token_data.username, db=db)
     if user is None:
         raise credentials_exception
+    
+    principal_cache.put(token, float(payload.get("exp", 0)), user)
     return user
 
 async def get_current_admin(current_user: models.User = Depends(get_current_user)):
@@ -123,7 +149,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username, "is_admin": user.is_admin}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id, "is_admin": user.is_admin}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -141,7 +167,7 @@ async def create_admin_user(username: str, password: str, db: AsyncSession = Dep
         )
     
     # 创建新管理员用户
-    hashed_password = get_password_hash(password)
+    hashed_password = await password_hasher.hash(password)
     new_user = models.User(
         username=username,
         hashed_password=hashed_password,
@@ -154,6 +180,11 @@ async def create_admin_user(username: str, password: str, db: AsyncSession = Dep
     
     return {"message": f"Admin user {username} created successfully"}
 
+@auth_router.on_event("shutdown")
+async def on_shutdown():
+    # 关闭与GitHub的长连接
+    await GitHubOAuth.aclose()
+
 # GitHub OAuth登录路由
 @auth_router.get("/github/login")
 async def github_login(request: Request):
@@ -191,7 +222,7 @@ async def github_callback(code: str, state: Optional[str] = None, db: AsyncSessi
         # 生成JWT访问令牌
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.username, "is_admin": user.is_admin}, 
+            data={"sub": user.username, "uid": user.id, "is_admin": user.is_admin}, 
             expires_delta=access_token_expires
         )
           # 将用户重定向到前端并附带访问令牌
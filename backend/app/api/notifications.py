@@ -4,25 +4,36 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from sqlalchemy import func, desc
+from pydantic import TypeAdapter
 from typing import List, Optional
 
 from ..models import models
 from ..schemas import schemas
 from ..core.database import get_db
+from ..services import normalized as normalized_format, unread_counters
+from ..services.push import push_hub
 from . import auth
+from .private_messages import push_unread
 
 # 创建通知路由
 notification_router = APIRouter()
 
+# 预先构建规范化格式的序列化器
+_normalized_notifications_adapter = TypeAdapter(schemas.NormalizedNotificationResponse)
+
 @notification_router.get("/notifications", response_model=schemas.NotificationResponse)
 async def get_notifications(
     page: int = Query(1, ge=1),
     per_page: int = Query(20, ge=1, le=100),
     notification_type: Optional[str] = Query(None),
+    normalized: bool = False,
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """获取当前用户的通知列表"""
+    """
+    获取当前用户的通知列表
+    normalized=true 时返回 NormalizedNotificationResponse：发送者和关联Prompt的作者只以ID引用，用户信息在users中
+    """
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -50,16 +61,8 @@ async def get_notifications(
     total_result = await db.execute(count_query)
     total = total_result.scalar()
     
-    # 计算未读数量
-    unread_query = select(func.count(models.Notification.id)).filter(
-        models.Notification.user_id == current_user.id,
-        models.Notification.is_read == 0
-    )
-    if notification_type:
-        unread_query = unread_query.filter(models.Notification.notification_type == notification_type)
-    
-    unread_result = await db.execute(unread_query)
-    unread_count = unread_result.scalar()
+    # 未读数量从未读汇总中读取
+    unread_count = await unread_counters.notification_count(db, current_user.id, notification_type)
     
     # 获取分页数据
     query = query.order_by(desc(models.Notification.created_at))
@@ -68,6 +71,18 @@ async def get_notifications(
     result = await db.execute(query)
     notifications = result.scalars().all()
     
+    if normalized:
+        users = normalized_format.collect_users(
+            [notification.sender for notification in notifications] +
+            [notification.related_prompt.owner for notification in notifications if notification.related_prompt]
+        )
+        return normalized_format.render(_normalized_notifications_adapter, {
+            "notifications": notifications,
+            "users": users,
+            "total": total,
+            "unread_count": unread_count
+        })
+    
     # 转换为响应模型
     notification_list = []
     for notification in notifications:
@@ -150,11 +165,24 @@ async def mark_notification_read(
             detail="通知不存在"
         )
     
-    # 标记为已读
+    # 标记为已读，只有真正从未读变为已读时才减少未读数，重复请求不会重复扣减
     if notification.is_read == 0:
-        notification.is_read = 1
-        notification.read_at = func.now()
+        result = await db.execute(
+            models.Notification.__table__.update()
+            .where(
+                (models.Notification.id == notification_id) &
+                (models.Notification.is_read == 0)
+            )
+            .values(is_read=1, read_at=func.now())
+        )
+        if result.rowcount:
+            await unread_counters.add(
+                db, [current_user.id], unread_counters.notification_category(notification.notification_type), -1
+            )
+        # 提交会使会话中的用户对象过期，先取出ID
+        user_id = current_user.id
         await db.commit()
+        await push_unread(db, user_id)
     
     return {"message": "通知已标记为已读"}
 
@@ -172,24 +200,35 @@ async def mark_all_notifications_read(
         )
     
     # 构建更新条件
-    update_query = models.Notification.__table__.update().where(
+    unread_filter = (
         (models.Notification.user_id == current_user.id) &
         (models.Notification.is_read == 0)
     )
-    
     if notification_type:
-        update_query = update_query.where(
-            models.Notification.notification_type == notification_type
-        )
+        unread_filter = unread_filter & (models.Notification.notification_type == notification_type)
+    
+    # 锁定并按类型统计将被标记的通知，更新后从未读汇总中扣减相同的数量
+    count_result = await db.execute(
+        select(models.Notification.id, models.Notification.notification_type)
+        .filter(unread_filter)
+        .with_for_update()
+    )
+    counts_by_type = {}
+    for _, type_name in count_result.all():
+        counts_by_type[type_name] = counts_by_type.get(type_name, 0) + 1
     
     # 执行更新
     await db.execute(
-        update_query.values(
+        models.Notification.__table__.update().where(unread_filter).values(
             is_read=1,
             read_at=func.now()
         )
     )
+    for type_name, count in counts_by_type.items():
+        await unread_counters.add(db, [current_user.id], unread_counters.notification_category(type_name), -count)
+    user_id = current_user.id
     await db.commit()
+    await push_unread(db, user_id)
     
     return {"message": "所有通知已标记为已读"}
 
@@ -205,15 +244,8 @@ async def get_notification_unread_count(
             detail="请先登录"
         )
     
-    result = await db.execute(
-        select(func.count(models.Notification.id)).filter(
-            models.Notification.user_id == current_user.id,
-            models.Notification.is_read == 0
-        )
-    )
-    unread_count = result.scalar()
-    
-    return {"unread_count": unread_count}
+    # 从未读汇总中读取
+    return {"unread_count": await unread_counters.notification_count(db, current_user.id)}
 
 @notification_router.post("/admin/send-notification", response_model=dict)
 async def send_admin_notification(
@@ -263,8 +295,16 @@ async def send_admin_notification(
         notifications.append(notification)
     
     db.add_all(notifications)
+    await unread_counters.add(
+        db, notification_data.user_ids, unread_counters.notification_category(notification_data.notification_type)
+    )
     await db.commit()
     
+    await push_hub.publish(
+        notification_data.user_ids,
+        {"type": "notification", "notification_type": notification_data.notification_type, "title": notification_data.title}
+    )
+    
     return {
         "message": f"成功发送通知给 {len(notification_data.user_ids)} 个用户",
         "sent_count": len(notification_data.user_ids)
@@ -289,5 +329,6 @@ async def create_system_notification(
         is_read=0
     )
     db.add(notification)
+    await unread_counters.add(db, [user_id], unread_counters.notification_category(notification_type))
     await db.flush()  # 获取ID但不提交
     return notification
\ No newline at end of file
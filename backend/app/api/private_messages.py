@@ -1,18 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload, selectinload
-from sqlalchemy import or_, func
-from typing import List
+from sqlalchemy.orm import joinedload, lazyload, selectinload
+from sqlalchemy import func, case, union_all
+from pydantic import TypeAdapter
+from typing import List, Optional
 
 from ..models import models
 from ..schemas import schemas
 from ..core.database import get_db
+from ..services import normalized as normalized_format, pagination, unread_counters
+from ..services.push import push_hub
 from . import auth
 
 # 创建私信路由
 private_message_router = APIRouter()
 
+# 会话中保存的最后一条消息预览的长度
+PREVIEW_LENGTH = 100
+CONVERSATION_CURSOR = "conversations"
+
+# 预先构建规范化格式的序列化器
+_normalized_messages_adapter = TypeAdapter(schemas.NormalizedMessagesResponse)
+
+
+def _user_schema(user: models.User) -> schemas.User:
+    return schemas.User(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        is_admin=user.is_admin,
+        oauth_provider=user.oauth_provider,
+        avatar_url=user.avatar_url
+    )
+
+
+async def _get_or_create_thread(db: AsyncSession, user1_id: int, user2_id: int) -> int:
+    """获取两个用户之间的会话ID，不存在时创建；并发创建时以先写入的为准"""
+    thread_id = await db.scalar(
+        select(models.MessageThread.id).filter(
+            models.MessageThread.user1_id == user1_id,
+            models.MessageThread.user2_id == user2_id
+        )
+    )
+    if thread_id is not None:
+        return thread_id
+    try:
+        async with db.begin_nested():
+            thread = models.MessageThread(
+                user1_id=user1_id,
+                user2_id=user2_id,
+                user1_unread_count=0,
+                user2_unread_count=0
+            )
+            db.add(thread)
+        return thread.id
+    except IntegrityError:
+        return await db.scalar(
+            select(models.MessageThread.id).filter(
+                models.MessageThread.user1_id == user1_id,
+                models.MessageThread.user2_id == user2_id
+            )
+        )
+
 @private_message_router.post("/send", response_model=schemas.PrivateMessageWithUser, status_code=status.HTTP_201_CREATED)
 async def send_private_message(
     message_data: schemas.SendMessageRequest,
@@ -46,45 +97,40 @@ async def send_private_message(
     user1_id = min(current_user.id, message_data.receiver_id)
     user2_id = max(current_user.id, message_data.receiver_id)
     
-    # 查询是否已存在会话
-    thread_result = await db.execute(
-        select(models.MessageThread).filter(
-            models.MessageThread.user1_id == user1_id,
-            models.MessageThread.user2_id == user2_id
-        )
-    )
-    thread = thread_result.scalars().first()
+    thread_id = await _get_or_create_thread(db, user1_id, user2_id)
     
-    if not thread:
-        # 创建新会话
-        thread = models.MessageThread(
-            user1_id=user1_id,
-            user2_id=user2_id,
-            user1_unread_count=0,
-            user2_unread_count=0
-        )
-        db.add(thread)
-        await db.flush()  # 获取thread.id
-      # 创建私信
+    # 创建私信
     private_message = models.PrivateMessage(
         sender_id=current_user.id,
         receiver_id=message_data.receiver_id,
         content=message_data.content,
-        is_read=0
+        is_read=0,
+        thread_id=thread_id
     )
     db.add(private_message)
     
-    # 更新会话的未读计数和最后消息时间
-    thread.last_message_at = func.now()
-    if current_user.id == user1_id:
-        thread.user2_unread_count += 1
-    else:
-        thread.user1_unread_count += 1
-    
     # 刷新以获取ID，但不提交
     await db.flush()
     message_id = private_message.id
     
+    # 在同一事务中更新会话的最后消息和对方的未读计数；
+    # 未读数在数据库中自增，并发发送时不会丢失计数，最后消息时间与消息的创建时间一致
+    thread_table = models.MessageThread.__table__
+    unread_column = "user2_unread_count" if current_user.id == user1_id else "user1_unread_count"
+    await db.execute(
+        thread_table.update()
+        .where(thread_table.c.id == thread_id)
+        .values(
+            last_message_at=select(models.PrivateMessage.created_at)
+            .filter(models.PrivateMessage.id == message_id)
+            .scalar_subquery(),
+            last_message_id=message_id,
+            last_message_preview=message_data.content[:PREVIEW_LENGTH],
+            **{unread_column: thread_table.c[unread_column] + 1}
+        )
+    )
+    await unread_counters.add(db, [message_data.receiver_id], unread_counters.MESSAGE_CATEGORY)
+    
     await db.commit()
     
     # 重新查询消息以获取关联数据
@@ -120,84 +166,101 @@ async def send_private_message(
         )
     )
     
+    # 推送新消息给双方（发送者的其他标签页同样需要显示），并更新接收者的未读数
+    receiver_id = message_data.receiver_id
+    sender_id = private_message.sender_id
+    if push_hub.wants(sender_id) or push_hub.wants(receiver_id):
+        await push_hub.publish(
+            [sender_id, receiver_id],
+            {"type": "message", "thread_id": thread_id, "message": message_response.model_dump(mode="json")}
+        )
+    await push_unread(db, receiver_id)
+    
     return message_response
 
 @private_message_router.get("/conversations", response_model=List[schemas.ConversationResponse])
 async def get_conversations(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """获取当前用户的所有对话列表"""
+    """
+    获取当前用户的对话列表，按最后消息时间从新到旧排列
+    - 不传limit时返回全部对话
+    - 传入limit时分页返回，还有更多对话时响应头 X-Next-Cursor 给出下一页的游标
+    """
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="请先登录"
         )
-      # 查询当前用户参与的所有会话
-    result = await db.execute(
-        select(models.MessageThread)
-        .options(selectinload(models.MessageThread.user1), selectinload(models.MessageThread.user2))
-        .filter(
-            or_(
-                models.MessageThread.user1_id == current_user.id,
-                models.MessageThread.user2_id == current_user.id
-            )
+    
+    thread = models.MessageThread
+    # 当前用户作为user1和user2的会话分别走 (user1_id, last_message_at, id) 和 (user2_id, ...) 索引，
+    # 各自按顺序取出一页后合并，对方用户和最后消息在同一条查询中取得
+    branches = []
+    for user_column in (thread.user1_id, thread.user2_id):
+        branch = select(thread.id, thread.last_message_at).filter(user_column == current_user.id)
+        if cursor is not None:
+            last_at, last_id = pagination.decode_time_cursor(cursor, CONVERSATION_CURSOR)
+            branch = branch.filter(pagination.before_filter(thread.last_message_at, thread.id, last_at, last_id))
+        if limit is not None:
+            branch = branch.order_by(thread.last_message_at.desc(), thread.id.desc()).limit(limit + 1)
+        branches.append(select(branch.subquery()))
+    page = union_all(*branches).subquery()
+    
+    is_user1 = thread.user1_id == current_user.id
+    query = (
+        select(
+            thread.id,
+            thread.last_message_at,
+            thread.last_message_preview,
+            case((is_user1, thread.user1_unread_count), else_=thread.user2_unread_count),
+            models.User,
         )
-        .order_by(models.MessageThread.last_message_at.desc())
+        .join(page, page.c.id == thread.id)
+        .join(models.User, models.User.id == case((is_user1, thread.user2_id), else_=thread.user1_id))
+        .order_by(page.c.last_message_at.desc(), page.c.id.desc())
     )
-    threads = result.scalars().all()
-    conversations = []
-    for thread in threads:
-        # 确定对方用户
-        other_user = thread.user2 if thread.user1_id == current_user.id else thread.user1
-        
-        # 确定未读数量
-        unread_count = (
-            thread.user1_unread_count if thread.user1_id == current_user.id 
-            else thread.user2_unread_count
-        )
-        
-        # 获取最新消息
-        latest_msg_result = await db.execute(
-            select(models.PrivateMessage)
-            .filter(
-                or_(
-                    (models.PrivateMessage.sender_id == current_user.id) & 
-                    (models.PrivateMessage.receiver_id == other_user.id),
-                    (models.PrivateMessage.sender_id == other_user.id) & 
-                    (models.PrivateMessage.receiver_id == current_user.id)
-                )
-            )
-            .order_by(models.PrivateMessage.created_at.desc())
-            .limit(1)
-        )
-        latest_message = latest_msg_result.scalars().first()
-          # 构造对话响应数据
-        conversation = schemas.ConversationResponse(
-            thread_id=thread.id,
-            other_user=schemas.User(
-                id=other_user.id,
-                username=other_user.username,
-                email=other_user.email,
-                is_admin=other_user.is_admin,
-                oauth_provider=other_user.oauth_provider,
-                avatar_url=other_user.avatar_url
-            ),
-            last_message_at=thread.last_message_at,
-            unread_count=unread_count,
-            latest_message=latest_message.content if latest_message else None
-        )
-        conversations.append(conversation)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = pagination.time_cursor(CONVERSATION_CURSOR, last[1], last[0])
     
-    return conversations
+    return [
+        schemas.ConversationResponse(
+            thread_id=thread_id,
+            other_user=_user_schema(other_user),
+            last_message_at=last_message_at,
+            unread_count=unread_count or 0,
+            latest_message=preview
+        )
+        for thread_id, last_message_at, preview, unread_count, other_user in rows
+    ]
 
 @private_message_router.get("/conversation/{user_id}", response_model=List[schemas.PrivateMessageWithUser])
 async def get_conversation_messages(
     user_id: int,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[int] = None,
+    normalized: bool = False,
     db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    """获取与指定用户的对话消息"""
+    """
+    获取与指定用户的对话消息，按时间从早到晚排列
+    - 默认返回最新的limit条消息
+    - 传入before（消息ID）时返回该消息之前的limit条消息
+    还有更早的消息时，响应头 X-Next-Cursor 给出加载上一页使用的before参数
+    normalized=true 时返回 NormalizedMessagesResponse：消息不内嵌用户，双方的信息在users中各出现一次
+    """
     if not current_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -211,80 +274,137 @@ async def get_conversation_messages(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="用户不存在"
-        )    # 查询两人之间的所有消息
-    messages_result = await db.execute(
-        select(models.PrivateMessage)
-        .options(selectinload(models.PrivateMessage.sender), selectinload(models.PrivateMessage.receiver))
-        .filter(
-            or_(
-                (models.PrivateMessage.sender_id == current_user.id) & 
-                (models.PrivateMessage.receiver_id == user_id),
-                (models.PrivateMessage.sender_id == user_id) & 
-                (models.PrivateMessage.receiver_id == current_user.id)
-            )
         )
-        .order_by(models.PrivateMessage.created_at.asc())
-    )
-    messages = messages_result.scalars().all()
-      # 将ORM对象转换为Pydantic模型
-    message_list = []
-    for msg in messages:
-        message_data = schemas.PrivateMessageWithUser(
-            id=msg.id,
-            content=msg.content,
-            sender_id=msg.sender_id,
-            receiver_id=msg.receiver_id,
-            created_at=msg.created_at,
-            is_read=msg.is_read,
-            sender=schemas.User(
-                id=msg.sender.id,
-                username=msg.sender.username,
-                email=msg.sender.email,
-                is_admin=msg.sender.is_admin,
-                oauth_provider=msg.sender.oauth_provider,
-                avatar_url=msg.sender.avatar_url
-            ),
-            receiver=schemas.User(
-                id=msg.receiver.id,
-                username=msg.receiver.username,
-                email=msg.receiver.email,
-                is_admin=msg.receiver.is_admin,
-                oauth_provider=msg.receiver.oauth_provider,
-                avatar_url=msg.receiver.avatar_url
-            )
-        )
-        message_list.append(message_data)
-    
-    # 标记接收的消息为已读
-    await db.execute(
-        models.PrivateMessage.__table__.update()
-        .where(
-            (models.PrivateMessage.sender_id == user_id) &
-            (models.PrivateMessage.receiver_id == current_user.id) &
-            (models.PrivateMessage.is_read == 0)
-        )
-        .values(is_read=1)
-    )
     
-    # 更新会话的未读计数
     user1_id = min(current_user.id, user_id)
     user2_id = max(current_user.id, user_id)
-    
     thread_result = await db.execute(
-        select(models.MessageThread).filter(
+        select(
+            models.MessageThread.id,
+            models.MessageThread.user1_last_read_id,
+            models.MessageThread.user2_last_read_id
+        ).filter(
             models.MessageThread.user1_id == user1_id,
             models.MessageThread.user2_id == user2_id
         )
     )
-    thread = thread_result.scalars().first()
+    thread = thread_result.first()
+    if thread is None:
+        if normalized:
+            return normalized_format.render(_normalized_messages_adapter, {"messages": [], "users": {}})
+        return []
+    thread_id, user1_last_read_id, user2_last_read_id = thread
     
-    if thread:
-        if current_user.id == user1_id:
-            thread.user1_unread_count = 0
-        else:
-            thread.user2_unread_count = 0
+    # 按 (thread_id, created_at, id) 索引倒序取一页；发送者和接收者就是当前用户和对方，无需逐条加载
+    query = (
+        select(models.PrivateMessage)
+        .options(lazyload("*"))
+        .filter(models.PrivateMessage.thread_id == thread_id)
+    )
+    if before is not None:
+        anchor = select(models.PrivateMessage.created_at).filter(
+            models.PrivateMessage.id == before,
+            models.PrivateMessage.thread_id == thread_id
+        )
+        if await db.scalar(anchor) is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="无效的分页游标"
+            )
+        # 直接与数据库中锚点消息的时间比较，避免时间值经过Python往返后精度或格式不一致
+        query = query.filter(
+            pagination.before_filter(
+                models.PrivateMessage.created_at, models.PrivateMessage.id, anchor.scalar_subquery(), before
+            )
+        )
+    messages_result = await db.execute(
+        query.order_by(models.PrivateMessage.created_at.desc(), models.PrivateMessage.id.desc()).limit(limit + 1)
+    )
+    messages = list(messages_result.scalars().all())
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = str(messages[-1].id)
+    messages.reverse()
     
-    await db.commit()
+    last_read_ids = {user1_id: user1_last_read_id or 0, user2_id: user2_last_read_id or 0}
+    is_read = {msg.id: 1 if msg.is_read or msg.id <= last_read_ids[msg.receiver_id] else 0 for msg in messages}
+    if normalized:
+        # 在提交已读状态之前序列化，提交后ORM对象会过期
+        message_list = normalized_format.render(_normalized_messages_adapter, {
+            "messages": [
+                {
+                    "id": msg.id,
+                    "content": msg.content,
+                    "sender_id": msg.sender_id,
+                    "receiver_id": msg.receiver_id,
+                    "created_at": msg.created_at,
+                    "is_read": is_read[msg.id]
+                }
+                for msg in messages
+            ],
+            "users": normalized_format.collect_users([current_user, other_user])
+        })
+        # 直接返回的响应不会带上注入的response中设置的响应头
+        if "X-Next-Cursor" in response.headers:
+            message_list.headers["X-Next-Cursor"] = response.headers["X-Next-Cursor"]
+    else:
+        users = {current_user.id: _user_schema(current_user), other_user.id: _user_schema(other_user)}
+        message_list = [
+            schemas.PrivateMessageWithUser(
+                id=msg.id,
+                content=msg.content,
+                sender_id=msg.sender_id,
+                receiver_id=msg.receiver_id,
+                created_at=msg.created_at,
+                is_read=is_read[msg.id],
+                sender=users[msg.sender_id],
+                receiver=users[msg.receiver_id]
+            )
+            for msg in messages
+        ]
+    
+    # 把已读水位线推进到本页最新的一条消息，只更新会话这一行，不再逐条改写消息；
+    # 未读数按水位线之后收到的消息重新计算，期间新到的消息仍然计为未读
+    newest_id = messages[-1].id if messages else 0
+    if newest_id > last_read_ids[current_user.id]:
+        is_user1 = current_user.id == user1_id
+        read_column = "user1_last_read_id" if is_user1 else "user2_last_read_id"
+        unread_column = "user1_unread_count" if is_user1 else "user2_unread_count"
+        thread_table = models.MessageThread.__table__
+        remaining = (
+            select(func.count(models.PrivateMessage.id))
+            .filter(
+                models.PrivateMessage.thread_id == thread_id,
+                models.PrivateMessage.receiver_id == current_user.id,
+                models.PrivateMessage.id > newest_id
+            )
+            .scalar_subquery()
+        )
+        # 锁定会话行，读取更新前后的未读数，差值同步到用户的未读汇总
+        unread_before = await db.scalar(
+            select(thread_table.c[unread_column]).where(thread_table.c.id == thread_id).with_for_update()
+        )
+        # 显式保留最后消息时间，避免列上的onupdate把已读操作当成新消息，打乱对话列表的顺序和分页游标
+        await db.execute(
+            thread_table.update()
+            .where(
+                (thread_table.c.id == thread_id) &
+                (func.coalesce(thread_table.c[read_column], 0) < newest_id)
+            )
+            .values(**{
+                read_column: newest_id,
+                unread_column: remaining,
+                "last_message_at": thread_table.c.last_message_at,
+            })
+        )
+        unread_after = await db.scalar(select(thread_table.c[unread_column]).where(thread_table.c.id == thread_id))
+        await unread_counters.add(
+            db, [current_user.id], unread_counters.MESSAGE_CATEGORY, (unread_after or 0) - (unread_before or 0)
+        )
+        # 提交会使会话中的用户对象过期，先取出ID
+        reader_id = current_user.id
+        await db.commit()
+        await push_unread(db, reader_id)
     
     return message_list
 
@@ -300,26 +420,8 @@ async def get_unread_message_count(
             detail="请先登录"
         )
     
-    # 查询当前用户参与的所有会话并计算未读消息数
-    thread_result = await db.execute(
-        select(models.MessageThread)
-        .filter(
-            or_(
-                models.MessageThread.user1_id == current_user.id,
-                models.MessageThread.user2_id == current_user.id
-            )
-        )
-    )
-    threads = thread_result.scalars().all()
-    
-    user_unread_count = 0
-    for thread in threads:
-        if thread.user1_id == current_user.id:
-            user_unread_count += thread.user1_unread_count
-        else:
-            user_unread_count += thread.user2_unread_count
-    
-    return {"unread_count": user_unread_count}
+    # 从未读汇总中按主键读取
+    return {"unread_count": await unread_counters.message_count(db, current_user.id)}
 
 @private_message_router.get("/check-conversation/{user_id}")
 async def check_conversation_exists(
@@ -359,38 +461,24 @@ async def get_message_summary(
             detail="请先登录"
         )
     
-    # 计算私信未读数量
-    thread_result = await db.execute(
-        select(models.MessageThread)
-        .filter(
-            or_(
-                models.MessageThread.user1_id == current_user.id,
-                models.MessageThread.user2_id == current_user.id
-            )
-        )
-    )
-    threads = thread_result.scalars().all()
-    
-    private_message_count = 0
-    for thread in threads:
-        if thread.user1_id == current_user.id:
-            private_message_count += thread.user1_unread_count
-        else:
-            private_message_count += thread.user2_unread_count
-    
-    # 计算通知未读数量
-    notification_result = await db.execute(
-        select(func.count(models.Notification.id)).filter(
-            models.Notification.user_id == current_user.id,
-            models.Notification.is_read == 0
-        )
+    return await get_unread_summary(db, current_user.id)
+
+async def get_unread_summary(db: AsyncSession, user_id: int) -> schemas.MessageSummaryWithNotifications:
+    """从未读汇总中读取用户的私信和通知未读数量"""
+    private_message_count, notification_counts = unread_counters.split_counts(
+        await unread_counters.get_counts(db, user_id)
     )
-    notification_count = notification_result.scalar() or 0
-    
-    total_unread_count = private_message_count + notification_count
+    notification_count = sum(notification_counts.values())
     
     return schemas.MessageSummaryWithNotifications(
         private_message_count=private_message_count,
         notification_count=notification_count,
-        total_unread_count=total_unread_count
+        total_unread_count=private_message_count + notification_count,
+        notification_counts=notification_counts
     )
+
+async def push_unread(db: AsyncSession, user_id: int):
+    """把最新的未读数量推送给该用户的所有连接，例如在一个标签页中读过消息后同步其他标签页的徽标"""
+    if push_hub.wants(user_id):
+        summary = await get_unread_summary(db, user_id)
+        await push_hub.publish([user_id], {"type": "unread", **summary.model_dump()})
@@ -0,0 +1,61 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+
+from ..core.database import get_db_session
+from ..services.push import push_hub
+from . import auth
+
+# 创建推送路由
+push_router = APIRouter()
+
+@push_router.on_event("startup")
+async def on_startup():
+    # 启动推送事件的后台拉取（database后端）
+    push_hub.start()
+
+@push_router.on_event("shutdown")
+async def on_shutdown():
+    await push_hub.stop()
+
+@push_router.websocket("/ws")
+async def push_websocket(websocket: WebSocket, token: str = ""):
+    """
+    推送通道：新私信、未读数变化和新通知
+    浏览器的WebSocket无法设置请求头，令牌通过查询参数传入；服务端只发送事件，客户端发送的内容被忽略
+    """
+    try:
+        async with get_db_session() as db:
+            user = await auth.get_current_user(token or None, db)
+    except HTTPException:
+        user = None
+    # 先接受连接再关闭，浏览器才能收到1008关闭码并停止重连
+    await websocket.accept()
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    connection = push_hub.connect(user.id)
+
+    async def drain_client():
+        # 持续读取客户端消息，以便及时发现连接关闭
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    reader = asyncio.ensure_future(drain_client())
+    try:
+        while True:
+            event_task = asyncio.ensure_future(push_hub.next_event(connection))
+            done, _ = await asyncio.wait({event_task, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if reader in done:
+                event_task.cancel()
+                break
+            await websocket.send_json(event_task.result())
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        reader.cancel()
+        push_hub.disconnect(connection)
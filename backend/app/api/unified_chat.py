@@ -1,18 +1,21 @@
-import os
 import json
-import uuid
-import aiohttp
+import time
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any
 import logging
 from datetime import datetime
-import google.generativeai as genai
 
 from ..models import models
 from ..schemas import schemas
 from ..core.database import get_db
+from ..services.chat_context import context_budget, context_window, make_message, plan_trim
+from ..services.chat_sessions import chat_sessions
+from ..services.llm_providers import close_providers, gemini_provider, kimi_provider
+from ..services.llm_scheduler import llm_scheduler
 from .auth import get_current_user
 
 # 设置日志
@@ -22,141 +25,56 @@ logger = logging.getLogger(__name__)
 # 创建API路由
 unified_chat_router = APIRouter()
 
-# API配置
-KIMI_API_KEY = os.getenv("KIMI_API_KEY", "")
-KIMI_API_URL = "https://api.moonshot.cn/v1/chat/completions"
+@unified_chat_router.on_event("startup")
+async def on_startup():
+    # 启动聊天会话的后台写入
+    chat_sessions.start()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
-
-# 默认的最大消息数量
-MAX_MESSAGES = 15
-
-# 内存存储对话历史
-# 格式: {session_id: {"messages": [...], "prompt_id": int, "user_id": int, "model_type": str, "created_at": datetime}}
-memory_conversations: Dict[str, Dict[str, Any]] = {}
-
-def cleanup_old_conversations():
-    """清理超过24小时的对话"""
-    current_time = datetime.now()
-    old_sessions = []
-    
-    for session_id, conversation in memory_conversations.items():
-        created_at = conversation.get("created_at", current_time)
-        if (current_time - created_at).total_seconds() > 86400:  # 24小时
-            old_sessions.append(session_id)
-    
-    for session_id in old_sessions:
-        del memory_conversations[session_id]
-        logger.info(f"清理过期对话会话: {session_id}")
+@unified_chat_router.on_event("shutdown")
+async def on_shutdown():
+    # 保存尚未写入的聊天会话，关闭与大模型服务的长连接
+    await chat_sessions.stop()
+    await close_providers()
 
 async def call_kimi_api(messages: List[Dict[str, str]]) -> str:
     """调用Kimi API进行对话"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {KIMI_API_KEY}"
-            }
-            
-            payload = {
-                "model": "moonshot-v1-8k",
-                "messages": messages,
-                "temperature": 0.7,
-                "stream": False
-            }
-            
-            async with session.post(KIMI_API_URL, headers=headers, json=payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"Kimi API错误: {error_text}")
-                    raise HTTPException(
-                        status_code=status.HTTP_502_BAD_GATEWAY,
-                        detail="无法连接到Kimi AI服务"
-                    )
-                
-                result = await response.json()
-                return result["choices"][0]["message"]["content"]
-    except Exception as e:
-        logger.error(f"调用Kimi API出错: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-            detail=f"Kimi聊天处理失败: {str(e)}"
-        )
+    return await kimi_provider.complete(messages)
 
 async def call_gemini_api(messages: List[Dict[str, str]]) -> str:
     """调用Gemini API进行对话"""
-    try:
-        if not GEMINI_API_KEY:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Gemini API密钥未配置"
-            )
-        
-        # 配置Gemini API
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        
-        # 将消息格式转换为Gemini格式
-        gemini_messages = []
-        system_instruction = ""
-        
-        for msg in messages:
-            if msg["role"] == "system":
-                system_instruction = msg["content"]
-            elif msg["role"] == "user":
-                gemini_messages.append({
-                    "role": "user",
-                    "parts": [msg["content"]]
-                })
-            elif msg["role"] == "assistant":
-                gemini_messages.append({
-                    "role": "model",
-                    "parts": [msg["content"]]
-                })
-        
-        # 重新配置模型，如果有系统指令的话
-        if system_instruction:
-            model = genai.GenerativeModel(
-                model_name=GEMINI_MODEL,
-                system_instruction=system_instruction
-            )
-        
-        # 如果没有对话历史，直接发送消息
-        if len(gemini_messages) <= 1:
-            if gemini_messages:
-                response = model.generate_content(gemini_messages[0]["parts"][0])
-                return response.text
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="没有有效的消息内容"
-                )
-        
-        # 如果有对话历史，使用chat功能
-        # 获取历史消息（除了最后一条）
-        history = gemini_messages[:-1]
-        chat = model.start_chat(history=history)
-        
-        # 发送最后一条消息
-        last_message = gemini_messages[-1]["parts"][0]
-        response = chat.send_message(last_message)
-        return response.text
-    
-    except Exception as e:
-        logger.error(f"调用Gemini API出错: {str(e)}")
+    return await gemini_provider.complete(messages)
+
+def stream_kimi_api(messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+    """以流式方式调用Kimi API，逐段返回生成的文本"""
+    return kimi_provider.stream(messages)
+
+def stream_gemini_api(messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+    """以流式方式调用Gemini API，逐段返回生成的文本"""
+    return gemini_provider.stream(messages)
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _check_model_available(model_type: str):
+    """检查所选模型的API密钥是否已配置"""
+    if model_type == "kimi" and not kimi_provider.configured:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-            detail=f"Gemini聊天处理失败: {str(e)}"
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Kimi API密钥未配置"
+        )
+    if model_type == "gemini" and not gemini_provider.configured:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Gemini API密钥未配置"
         )
 
-@unified_chat_router.post("/unified-chat", response_model=schemas.ChatResponse)
-async def unified_chat(
-    chat_request: schemas.ChatRequest,
-    db: AsyncSession = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    """统一聊天接口，支持kimi和gemini模型选择"""
+async def _prepare_conversation(chat_request: schemas.ChatRequest, db: AsyncSession, current_user: models.User):
+    """
+    创建新会话或取出已有会话，并把用户消息追加到对话历史
+    返回 (session_id, 会话, 本次发送给模型的消息, 模型类型, 是否为新会话, 成功后需要删除的最早对话条数)
+    超出预算时只裁剪发送给模型的副本，存储的历史在本轮成功后再删除，失败撤回时不会丢失
+    """
     # 检查用户是否已登录
     if not current_user:
         raise HTTPException(
@@ -164,9 +82,6 @@ async def unified_chat(
             detail="请先登录后再使用聊天功能"
         )
     
-    # 清理过期对话
-    cleanup_old_conversations()
-    
     user_message = chat_request.message
     session_id = chat_request.session_id
     model_type = chat_request.model_type or "gemini"
@@ -199,103 +114,177 @@ async def unified_chat(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Prompt不存在"
             )
+        _check_model_available(model_type)
         
-        # 创建新会话ID
-        session_id = str(uuid.uuid4())
-        
-        # 初始化对话历史
+        # 初始化对话历史并创建新会话
         messages = [
-            {"role": "system", "content": prompt.content},
-            {"role": "user", "content": user_message}
+            make_message("system", prompt.content),
+            make_message("user", user_message)
         ]
-        
-        # 存储到内存
-        memory_conversations[session_id] = {
-            "messages": messages,
-            "prompt_id": prompt_id,
-            "user_id": current_user.id,
-            "model_type": model_type,
-            "created_at": datetime.now()
-        }
-        
-        # 调用相应的AI API
-        if model_type == "kimi":
-            if not KIMI_API_KEY:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Kimi API密钥未配置"
-                )
-            assistant_response = await call_kimi_api(messages)
-        else:  # gemini
-            assistant_response = await call_gemini_api(messages)
-        
-        # 添加助手回复到对话历史
-        memory_conversations[session_id]["messages"].append({
-            "role": "assistant", 
-            "content": assistant_response
-        })
-        
-        return {
-            "message": assistant_response,
-            "session_id": session_id,
-            "model_type": model_type
-        }
+        # Prompt加上第一条消息就超出上下文时直接拒绝
+        plan_trim(messages, context_budget(model_type))
+        session_id, conversation = await chat_sessions.create(current_user.id, prompt_id, model_type, messages)
+        return session_id, conversation, conversation["messages"], model_type, True, 0
+    
+    # 获取现有会话
+    conversation = await chat_sessions.get(session_id)
+    if conversation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="聊天会话不存在或已过期"
+        )
     
+    # 验证用户权限
+    if conversation["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权访问此聊天会话"
+        )
+    
+    # 获取当前会话的模型类型
+    session_model_type = conversation["model_type"]
+    _check_model_available(session_model_type)
+    
+    # 按模型的token预算计算需要跳过的最早对话（始终保留system消息），然后添加用户新消息
+    user_entry = make_message("user", user_message)
+    drop = plan_trim(conversation["messages"] + [user_entry], context_budget(session_model_type))
+    await chat_sessions.append_message(conversation, user_entry)
+    
+    return session_id, conversation, context_window(conversation["messages"], drop), session_model_type, False, drop
+
+async def _commit_turn(conversation: Dict[str, Any], assistant_response: str, drop: int):
+    """追加助手回复，并删除本轮发送时已经裁掉的最早对话"""
+    await chat_sessions.append_message(conversation, make_message("assistant", assistant_response))
+    if drop:
+        await chat_sessions.drop_oldest(conversation, drop)
+
+async def _rollback_turn(session_id: str, conversation: Dict[str, Any], user_entry: Dict[str, Any], is_new: bool):
+    """撤回本轮的用户消息，新建的会话整个删除"""
+    if is_new:
+        await chat_sessions.delete(session_id)
     else:
-        # 获取现有会话
-        if session_id not in memory_conversations:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="聊天会话不存在或已过期"
-            )
-        
-        conversation = memory_conversations[session_id]
-        
-        # 验证用户权限
-        if conversation["user_id"] != current_user.id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="无权访问此聊天会话"
-            )
-        
-        # 获取当前会话的模型类型
-        session_model_type = conversation["model_type"]
-        
-        # 添加用户新消息
-        conversation["messages"].append({"role": "user", "content": user_message})
-        
-        # 保持消息数量在限制内
-        messages = conversation["messages"]
-        if len(messages) > MAX_MESSAGES:
-            # 始终保留system消息
-            system_message = next((msg for msg in messages if msg["role"] == "system"), None)
-            messages = messages[-(MAX_MESSAGES-1):]  # 保留最近的MAX_MESSAGES-1条
-            if system_message:
-                messages.insert(0, system_message)
-            conversation["messages"] = messages
-        
-        # 调用相应的AI API
-        if session_model_type == "kimi":
-            if not KIMI_API_KEY:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Kimi API密钥未配置"
-                )
-            assistant_response = await call_kimi_api(messages)
-        else:  # gemini
-            assistant_response = await call_gemini_api(messages)
+        await chat_sessions.remove_last_message(conversation, user_entry)
+
+@unified_chat_router.post("/unified-chat", response_model=schemas.ChatResponse)
+async def unified_chat(
+    chat_request: schemas.ChatRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """统一聊天接口，支持kimi和gemini模型选择"""
+    session_id, conversation, messages, model_type, is_new, drop = await _prepare_conversation(chat_request, db, current_user)
+    user_entry = conversation["messages"][-1]
+    
+    try:
+        # 排队获取调用名额后调用相应的AI API
+        slot = await llm_scheduler.acquire(model_type, current_user.id)
+        try:
+            if model_type == "kimi":
+                assistant_response = await call_kimi_api(messages)
+            else:  # gemini
+                assistant_response = await call_gemini_api(messages)
+        finally:
+            slot.release()
+    except HTTPException:
+        # 排不上队或调用失败时撤回本次用户消息
+        await _rollback_turn(session_id, conversation, user_entry, is_new)
+        await chat_sessions.sync(session_id)
+        raise
+    
+    # 添加助手回复到对话历史
+    await _commit_turn(conversation, assistant_response, drop)
+    # 写入后再返回，下一轮请求落到其他进程时也能读到这一轮对话
+    await chat_sessions.sync(session_id)
+    
+    return {
+        "message": assistant_response,
+        "session_id": session_id,
+        "model_type": model_type
+    }
+
+@unified_chat_router.post("/unified-chat/stream")
+async def unified_chat_stream(
+    chat_request: schemas.ChatRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    统一聊天接口的流式版本，以Server-Sent Events逐段返回模型输出
+    事件顺序: meta(session_id, model_type) → 若干 delta(content) → done 或 error
+    完整的回复在生成结束后追加到对话历史；生成失败或客户端断开时撤回本次用户消息
+    排队失败时在开始推送之前直接返回429/503
+    """
+    session_id, conversation, messages, model_type, is_new, drop = await _prepare_conversation(chat_request, db, current_user)
+    stream_api = stream_kimi_api if model_type == "kimi" else stream_gemini_api
+    user_entry = conversation["messages"][-1]
+    
+    try:
+        slot = await llm_scheduler.acquire(model_type, current_user.id)
+    except HTTPException:
+        await _rollback_turn(session_id, conversation, user_entry, is_new)
+        await chat_sessions.sync(session_id)
+        raise
+    
+    # 本轮对话是否已经写入历史或撤回，生成器没有执行或被中途取消时由后台任务兜底撤回
+    turn = {"settled": False}
+    
+    async def event_stream():
+        started_at = time.perf_counter()
+        first_token_ms = None
+        parts: List[str] = []
+        completed = False
+        error_detail = None
         
-        # 添加助手回复到对话历史
-        conversation["messages"].append({
-            "role": "assistant", 
-            "content": assistant_response
-        })
+        yield _sse("meta", {"session_id": session_id, "model_type": model_type})
+        try:
+            async for delta in stream_api(messages):
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started_at) * 1000, 1)
+                parts.append(delta)
+                yield _sse("delta", {"content": delta})
+            completed = True
+        except HTTPException as e:
+            error_detail = e.detail
+        except Exception as e:
+            logger.error(f"流式调用{model_type.capitalize()} API出错: {str(e)}")
+            error_detail = f"{model_type.capitalize()}聊天处理失败: {str(e)}"
+        finally:
+            slot.release()
+            if completed:
+                await _commit_turn(conversation, "".join(parts), drop)
+            else:
+                await _rollback_turn(session_id, conversation, user_entry, is_new)
+            turn["settled"] = True
+            try:
+                await chat_sessions.sync(session_id)
+            except HTTPException as e:
+                # 本轮对话没能保存时不能报告完成
+                completed = False
+                error_detail = e.detail
         
-        return {
-            "message": assistant_response,
-            "session_id": session_id,
-            "model_type": session_model_type
-        }
+        if completed:
+            logger.info(f"{model_type} 流式回复完成，首字延迟 {first_token_ms} ms")
+            yield _sse("done", {"session_id": session_id, "first_token_ms": first_token_ms})
+        else:
+            yield _sse("error", {"detail": error_detail})
+    
+    async def finish_turn():
+        slot.release()
+        if not turn["settled"]:
+            await _rollback_turn(session_id, conversation, user_entry, is_new)
+            turn["settled"] = True
+        try:
+            await chat_sessions.sync(session_id)
+        except HTTPException as e:
+            logger.error(f"保存聊天会话 {session_id} 失败: {e.detail}")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 客户端在推送开始前就断开时生成器不会执行，由后台任务兜底归还名额并撤回用户消息
+        background=BackgroundTask(finish_turn)
+    )
 
 @unified_chat_router.get("/unified-chat/{session_id}/history", response_model=List[schemas.ChatMessage])
 async def get_unified_chat_history(
@@ -310,18 +299,14 @@ async def get_unified_chat_history(
             detail="请先登录后再查看聊天历史"
         )
     
-    # 清理过期对话
-    cleanup_old_conversations()
-    
     # 检查会话是否存在
-    if session_id not in memory_conversations:
+    conversation = await chat_sessions.get(session_id)
+    if conversation is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="聊天会话不存在或已过期"
         )
     
-    conversation = memory_conversations[session_id]
-    
     # 验证用户权限
     if conversation["user_id"] != current_user.id:
         raise HTTPException(
@@ -356,14 +341,13 @@ async def delete_unified_chat_session(
         )
     
     # 检查会话是否存在
-    if session_id not in memory_conversations:
+    conversation = await chat_sessions.get(session_id)
+    if conversation is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="聊天会话不存在或已过期"
         )
     
-    conversation = memory_conversations[session_id]
-    
     # 验证用户权限
     if conversation["user_id"] != current_user.id:
         raise HTTPException(
@@ -372,7 +356,7 @@ async def delete_unified_chat_session(
         )
     
     # 删除会话
-    del memory_conversations[session_id]
+    await chat_sessions.delete(session_id)
     
     return {"status": "success", "detail": "聊天会话已删除"}
 
@@ -381,17 +365,17 @@ async def get_available_models():
     """获取可用的聊天模型"""
     models = []
     
-    if KIMI_API_KEY:
+    if kimi_provider.configured:
         models.append({
             "type": "kimi",
-            "name": "Kimi (moonshot-v1-8k)",
+            "name": f"Kimi ({kimi_provider.model})",
             "description": "Moonshot AI 的 Kimi 模型"
         })
     
-    if GEMINI_API_KEY:
+    if gemini_provider.configured:
         models.append({
             "type": "gemini",
-            "name": f"Gemini ({GEMINI_MODEL})",
+            "name": f"Gemini ({gemini_provider.model})",
             "description": "Google 的 Gemini 模型"
         })
     
@@ -62,6 +62,36 @@ async def create_tables():
                 print("views列已成功添加")
             else:
                 print("views列已存在，无需修改")
+            
+            # 游标分页直接比较 created_at/views/likes，回填空值后改为不允许为空
+            for column_name, definition, backfill in (
+                ("created_at", "DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP", "COALESCE(`updated_at`, NOW())"),
+                ("views", "INTEGER NOT NULL DEFAULT 0", "0"),
+                ("likes", "INTEGER NOT NULL DEFAULT 0", "0"),
+            ):
+                result = await conn.execute(text(f"SHOW COLUMNS FROM `prompts` LIKE '{column_name}'"))
+                column = result.mappings().fetchone()
+                if column is not None and column["Null"] == "YES":
+                    print(f"正在将prompts.{column_name}改为不允许为空...")
+                    await conn.execute(text(
+                        f"UPDATE `prompts` SET `{column_name}` = {backfill} WHERE `{column_name}` IS NULL"
+                    ))
+                    await conn.execute(text(f"ALTER TABLE `prompts` MODIFY `{column_name}` {definition}"))
+                    print(f"prompts.{column_name}已改为不允许为空")
+            
+            # 检查Prompt列表游标分页使用的复合索引
+            for index_name, sort_column in (
+                ("idx_prompt_status_created", "created_at"),
+                ("idx_prompt_status_views", "views"),
+                ("idx_prompt_status_likes", "likes"),
+            ):
+                result = await conn.execute(text(f"SHOW INDEX FROM `prompts` WHERE Key_name = '{index_name}'"))
+                if result.fetchone() is None:
+                    print(f"正在创建{index_name}索引...")
+                    await conn.execute(text(
+                        f"CREATE INDEX `{index_name}` ON `prompts` (`status`, `{sort_column}`, `id`)"
+                    ))
+                    print(f"{index_name}索引已成功创建")
                 
             # 检查是否已存在 notifications 表
             result = await conn.execute(text("SHOW TABLES LIKE 'notifications'"))
@@ -96,6 +126,91 @@ async def create_tables():
             else:
                 print("message_threads表已存在，无需修改")
                 
+            # 检查 message_threads 表中是否已存在最后消息的冗余列
+            result = await conn.execute(text("SHOW COLUMNS FROM `message_threads` LIKE 'last_message_id'"))
+            last_message_column_exists = result.fetchone() is not None
+            
+            if not last_message_column_exists:
+                print("正在添加message_threads最后消息列...")
+                await conn.execute(text(
+                    "ALTER TABLE `message_threads` "
+                    "ADD COLUMN `last_message_id` INTEGER NULL, "
+                    "ADD COLUMN `last_message_preview` VARCHAR(200) NULL"
+                ))
+                # 用每个会话中最新的一条私信回填
+                print("正在回填会话的最后消息...")
+                await conn.execute(text(
+                    "UPDATE `message_threads` t "
+                    "JOIN (SELECT LEAST(`sender_id`, `receiver_id`) AS u1, GREATEST(`sender_id`, `receiver_id`) AS u2, "
+                    "MAX(`id`) AS mid FROM `private_messages` GROUP BY u1, u2) m "
+                    "ON m.u1 = t.`user1_id` AND m.u2 = t.`user2_id` "
+                    "JOIN `private_messages` p ON p.`id` = m.mid "
+                    "SET t.`last_message_id` = p.`id`, t.`last_message_preview` = LEFT(p.`content`, 100)"
+                ))
+                print("最后消息列已成功添加")
+            else:
+                print("最后消息列已存在，无需修改")
+            
+            # 检查 private_messages 表中是否已存在 thread_id 列
+            result = await conn.execute(text("SHOW COLUMNS FROM `private_messages` LIKE 'thread_id'"))
+            thread_id_column_exists = result.fetchone() is not None
+            
+            if not thread_id_column_exists:
+                print("正在添加private_messages.thread_id列...")
+                await conn.execute(text("ALTER TABLE `private_messages` ADD COLUMN `thread_id` INTEGER NULL"))
+                print("正在回填私信所属的会话...")
+                await conn.execute(text(
+                    "UPDATE `private_messages` p JOIN `message_threads` t "
+                    "ON t.`user1_id` = LEAST(p.`sender_id`, p.`receiver_id`) "
+                    "AND t.`user2_id` = GREATEST(p.`sender_id`, p.`receiver_id`) "
+                    "SET p.`thread_id` = t.`id`"
+                ))
+                print("thread_id列已成功添加")
+            else:
+                print("thread_id列已存在，无需修改")
+            
+            # 检查 message_threads 表中是否已存在已读水位线列
+            result = await conn.execute(text("SHOW COLUMNS FROM `message_threads` LIKE 'user1_last_read_id'"))
+            last_read_column_exists = result.fetchone() is not None
+            
+            if not last_read_column_exists:
+                print("正在添加已读水位线列...")
+                await conn.execute(text(
+                    "ALTER TABLE `message_threads` "
+                    "ADD COLUMN `user1_last_read_id` INTEGER NULL, "
+                    "ADD COLUMN `user2_last_read_id` INTEGER NULL"
+                ))
+                # 用各自已读的最后一条消息回填水位线
+                print("正在回填已读水位线...")
+                for user_column, read_column in (("user1_id", "user1_last_read_id"), ("user2_id", "user2_last_read_id")):
+                    await conn.execute(text(
+                        f"UPDATE `message_threads` t SET t.`{read_column}` = ("
+                        f"SELECT MAX(p.`id`) FROM `private_messages` p "
+                        f"WHERE p.`thread_id` = t.`id` AND p.`receiver_id` = t.`{user_column}` AND p.`is_read` = 1)"
+                    ))
+                print("已读水位线列已成功添加")
+            else:
+                print("已读水位线列已存在，无需修改")
+            
+            # 检查按会话分页加载消息使用的复合索引
+            result = await conn.execute(text("SHOW INDEX FROM `private_messages` WHERE Key_name = 'idx_thread_created'"))
+            if result.fetchone() is None:
+                print("正在创建idx_thread_created索引...")
+                await conn.execute(text(
+                    "CREATE INDEX `idx_thread_created` ON `private_messages` (`thread_id`, `created_at`, `id`)"
+                ))
+                print("idx_thread_created索引已成功创建")
+            
+            # 检查对话列表使用的复合索引
+            for index_name, user_column in (("idx_thread_user1_last", "user1_id"), ("idx_thread_user2_last", "user2_id")):
+                result = await conn.execute(text(f"SHOW INDEX FROM `message_threads` WHERE Key_name = '{index_name}'"))
+                if result.fetchone() is None:
+                    print(f"正在创建{index_name}索引...")
+                    await conn.execute(text(
+                        f"CREATE INDEX `{index_name}` ON `message_threads` (`{user_column}`, `last_message_at`, `id`)"
+                    ))
+                    print(f"{index_name}索引已成功创建")
+                
             # 检查是否已存在 site_announcements 表
             result = await conn.execute(text("SHOW TABLES LIKE 'site_announcements'"))
             site_announcements_table_exists = result.fetchone() is not None
@@ -1,11 +1,13 @@
 """
 GitHub OAuth 辅助函数和类
 """
+import asyncio
 import httpx
 from typing import Optional, Dict, Any
 from fastapi import HTTPException, status
 from ..models import models
 from . import config
+from ..services.principals import principal_cache
 from ..schemas import schemas
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -37,86 +39,112 @@ class GitHubOAuth:
         
         # 构建查询字符串
         query_string = '&'.join(f"{k}={v}" for k, v in params.items())
-        return f"https://github.com/login/oauth/authorize?{query_string}"
+        return f"{config.GITHUB_OAUTH_URL}/login/oauth/authorize?{query_string}"
     
-    @staticmethod
-    async def exchange_code(code: str) -> Dict[str, Any]:
+    # 应用生命周期内复用的HTTP客户端，保持与GitHub的长连接，避免每一步都重新进行TLS握手
+    _client: Optional[httpx.AsyncClient] = None
+    
+    # GET请求遇到这些状态码时重试
+    RETRY_STATUS_CODES = {502, 503, 504}
+    
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        """获取共享的HTTP客户端（首次使用时创建）"""
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(config.GITHUB_HTTP_TIMEOUT, connect=min(config.GITHUB_HTTP_TIMEOUT, 5.0)),
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=10, keepalive_expiry=60),
+                # 连接建立失败时由传输层重试，此时请求尚未发出，POST也可以安全重试
+                transport=httpx.AsyncHTTPTransport(retries=config.GITHUB_HTTP_RETRIES),
+                headers={'Accept': 'application/json'},
+            )
+        return cls._client
+    
+    @classmethod
+    async def aclose(cls):
+        """关闭共享的HTTP客户端，在应用关闭时调用"""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+    
+    @classmethod
+    async def _get(cls, url: str, access_token: str) -> httpx.Response:
+        """GET请求，遇到网关类错误时重试"""
+        client = cls.get_client()
+        for attempt in range(config.GITHUB_HTTP_RETRIES + 1):
+            response = await client.get(url, headers={'Authorization': f'token {access_token}'})
+            if response.status_code not in cls.RETRY_STATUS_CODES or attempt == config.GITHUB_HTTP_RETRIES:
+                return response
+            await asyncio.sleep(0.2 * (attempt + 1))
+        return response
+    
+    @classmethod
+    async def exchange_code(cls, code: str) -> Dict[str, Any]:
         """
         使用授权码获取访问令牌
         
         :param code: GitHub返回的授权码
         :return: 包含访问令牌的字典
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                'https://github.com/login/oauth/access_token',
-                data={
-                    'client_id': config.GITHUB_CLIENT_ID,
-                    'client_secret': config.GITHUB_CLIENT_SECRET,
-                    'code': code,
-                    'redirect_uri': config.GITHUB_REDIRECT_URI
-                },
-                headers={'Accept': 'application/json'}
+        # 授权码只能使用一次，请求发出后不再重试
+        response = await cls.get_client().post(
+            f'{config.GITHUB_OAUTH_URL}/login/oauth/access_token',
+            data={
+                'client_id': config.GITHUB_CLIENT_ID,
+                'client_secret': config.GITHUB_CLIENT_SECRET,
+                'code': code,
+                'redirect_uri': config.GITHUB_REDIRECT_URI
+            }
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, 
+                detail=f"GitHub token exchange failed: {response.text}"
             )
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, 
-                    detail=f"GitHub token exchange failed: {response.text}"
-                )
-                
-            return response.json()
+        return response.json()
     
-    @staticmethod
-    async def get_user_info(access_token: str) -> schemas.GitHubUser:
+    @classmethod
+    async def get_user_info(cls, access_token: str) -> schemas.GitHubUser:
         """
         使用访问令牌获取GitHub用户信息
+        用户基本信息和邮箱列表同时请求，邮箱列表只在基本信息中没有公开邮箱时使用
         
         :param access_token: GitHub访问令牌
         :return: GitHub用户信息
         """
-        async with httpx.AsyncClient() as client:
-            # 获取用户基本信息
-            response = await client.get(
-                'https://api.github.com/user',
-                headers={
-                    'Authorization': f'token {access_token}',
-                    'Accept': 'application/json'
-                }
+        response, email_response = await asyncio.gather(
+            cls._get(f'{config.GITHUB_API_URL}/user', access_token),
+            cls._get(f'{config.GITHUB_API_URL}/user/emails', access_token),
+            return_exceptions=True
+        )
+        
+        if isinstance(response, Exception):
+            raise response
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, 
+                detail=f"Failed to fetch GitHub user info: {response.text}"
             )
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, 
-                    detail=f"Failed to fetch GitHub user info: {response.text}"
-                )
-                
-            user_data = response.json()
-            
-            # 获取用户电子邮件地址(如果用户授权了email权限)
-            if 'email' not in user_data or not user_data['email']:
-                email_response = await client.get(
-                    'https://api.github.com/user/emails',
-                    headers={
-                        'Authorization': f'token {access_token}',
-                        'Accept': 'application/json'
-                    }
-                )
-                
-                if email_response.status_code == 200:
-                    emails = email_response.json()
-                    # 找到主要且已验证的邮箱
-                    primary_email = next((e for e in emails if e.get('primary') and e.get('verified')), None)
-                    if primary_email:
-                        user_data['email'] = primary_email['email']
-            
-            return schemas.GitHubUser(
-                id=user_data['id'],
-                login=user_data['login'],
-                avatar_url=user_data.get('avatar_url'),
-                name=user_data.get('name'),
-                email=user_data.get('email')
-            )
+        user_data = response.json()
+        
+        # 获取用户电子邮件地址(如果用户授权了email权限)，邮箱请求失败不影响登录
+        if not user_data.get('email') and isinstance(email_response, httpx.Response) and email_response.status_code == 200:
+            emails = email_response.json()
+            # 找到主要且已验证的邮箱
+            primary_email = next((e for e in emails if e.get('primary') and e.get('verified')), None)
+            if primary_email:
+                user_data['email'] = primary_email['email']
+        
+        return schemas.GitHubUser(
+            id=user_data['id'],
+            login=user_data['login'],
+            avatar_url=user_data.get('avatar_url'),
+            name=user_data.get('name'),
+            email=user_data.get('email')
+        )
 
 async def get_or_create_github_user(github_user: schemas.GitHubUser, db: AsyncSession) -> models.User:
     """
@@ -143,6 +171,7 @@ async def get_or_create_github_user(github_user: schemas.GitHubUser, db: AsyncSe
         
         await db.commit()
         await db.refresh(user)
+        principal_cache.invalidate_user(user.id)
         return user
     
     # 检查是否存在使用相同用户名的账户
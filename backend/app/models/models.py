@@ -76,11 +76,12 @@ class Prompt(Base):
     content = Column(Text, nullable=False) # Text 类型用于较长文本，并设为不可空
     description = Column(String(255)) # 明确长度
     user_id = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # 列表按 created_at/views/likes 游标分页，这三列不允许为空，比较时可以直接使用索引
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
-    likes = Column(Integer, default=0)
+    likes = Column(Integer, nullable=False, default=0, server_default="0")
     dislikes = Column(Integer, default=0)
-    views = Column(Integer, default=0) # 新增：浏览量计数
+    views = Column(Integer, nullable=False, default=0, server_default="0") # 新增：浏览量计数
     status = Column(Integer, default=0, index=True) # 审核状态: 0-待审核, 1-已通过, 2-已拒绝
     is_r18 = Column(Integer, default=0, index=True) # R18标识: 0-非R18, 1-R18
     
@@ -89,6 +90,15 @@ class Prompt(Base):
     tags = relationship("Tag", secondary=prompt_tag, back_populates="prompts")
     # 一对多关系，一个prompt可以有多个评论
     comments = relationship("Comment", back_populates="prompt", cascade="all, delete-orphan")
+    # 用户的点赞/点踩记录，删除prompt时由数据库级联删除
+    reactions = relationship("PromptReaction", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __table_args__ = (
+        # 已通过审核的Prompt按上传时间、浏览量、点赞数游标分页
+        sqlalchemy.Index('idx_prompt_status_created', 'status', 'created_at', 'id'),
+        sqlalchemy.Index('idx_prompt_status_views', 'status', 'views', 'id'),
+        sqlalchemy.Index('idx_prompt_status_likes', 'status', 'likes', 'id'),
+    )
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -104,6 +114,22 @@ class Comment(Base):
     # 与User的关系，使用joined策略预加载用户信息
     user = relationship("User", lazy="joined")
 
+class PromptReaction(Base):
+    """用户对Prompt的点赞/点踩记录，每个用户对每个Prompt最多一条"""
+    __tablename__ = "prompt_reactions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    prompt_id = Column(Integer, ForeignKey("prompts.id", ondelete="CASCADE"), nullable=False, index=True)
+    reaction = Column(Integer, nullable=False)  # 1-点赞, -1-点踩
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    # (user_id, prompt_id) 唯一约束同时作为按用户批量查询的索引
+    __table_args__ = (
+        sqlalchemy.UniqueConstraint('user_id', 'prompt_id', name='_user_prompt_reaction_uc'),
+    )
+
 class DailyViews(Base):
     __tablename__ = "daily_views"
     
@@ -125,7 +151,8 @@ class PrivateMessage(Base):
     receiver_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    is_read = Column(Integer, default=0, index=True)  # 0-未读, 1-已读
+    is_read = Column(Integer, default=0, index=True)  # 0-未读, 1-已读（旧数据；新的已读状态由会话的已读水位线决定）
+    thread_id = Column(Integer, ForeignKey("message_threads.id"), nullable=True)  # 所属会话
     
     # 建立与User的关系，使用joined策略预加载用户信息
     sender = relationship("User", foreign_keys=[sender_id], lazy="joined")
@@ -135,6 +162,8 @@ class PrivateMessage(Base):
     __table_args__ = (
         sqlalchemy.Index('idx_sender_receiver', 'sender_id', 'receiver_id'),
         sqlalchemy.Index('idx_receiver_created', 'receiver_id', 'created_at'),
+        # 按会话分页加载历史消息
+        sqlalchemy.Index('idx_thread_created', 'thread_id', 'created_at', 'id'),
     )
 
 class MessageThread(Base):
@@ -147,6 +176,12 @@ class MessageThread(Base):
     last_message_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     user1_unread_count = Column(Integer, default=0)  # user1的未读消息数量
     user2_unread_count = Column(Integer, default=0)  # user2的未读消息数量
+    # 最后一条消息的冗余信息，发送私信时与消息在同一事务中更新，对话列表无需再逐个查询最新消息
+    last_message_id = Column(Integer, nullable=True)
+    last_message_preview = Column(String(200), nullable=True)
+    # 已读水位线：各自已读到的最后一条消息ID，ID不超过水位线的消息视为已读
+    user1_last_read_id = Column(Integer, nullable=True)
+    user2_last_read_id = Column(Integer, nullable=True)
     
     # 建立与User的关系
     user1 = relationship("User", foreign_keys=[user1_id], lazy="joined")
@@ -156,6 +191,9 @@ class MessageThread(Base):
     __table_args__ = (
         sqlalchemy.UniqueConstraint('user1_id', 'user2_id', name='_user_thread_uc'),
         sqlalchemy.CheckConstraint('user1_id < user2_id', name='check_user_order'),
+        # 对话列表按参与者查询并按最后消息时间排序
+        sqlalchemy.Index('idx_thread_user1_last', 'user1_id', 'last_message_at', 'id'),
+        sqlalchemy.Index('idx_thread_user2_last', 'user2_id', 'last_message_at', 'id'),
     )
 
 class Notification(Base):
@@ -185,6 +223,52 @@ class Notification(Base):
         sqlalchemy.Index('idx_notification_type', 'notification_type'),
     )
 
+class ChatSession(Base):
+    """统一聊天会话，CHAT_SESSION_BACKEND=database 时使用"""
+    __tablename__ = "chat_sessions"
+    
+    id = Column(String(36), primary_key=True)  # UUID
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    prompt_id = Column(Integer, nullable=False)  # 会话创建时使用的Prompt，Prompt删除后会话仍可继续
+    model_type = Column(String(20), nullable=False)  # kimi, gemini
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    
+    __table_args__ = (
+        sqlalchemy.Index('idx_chat_session_user_created', 'user_id', 'created_at'),
+    )
+
+class ChatSessionMessage(Base):
+    """统一聊天会话中的消息，按自增ID排序即为对话顺序"""
+    __tablename__ = "chat_session_messages"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(36), ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
+    role = Column(String(20), nullable=False)  # system, user, assistant
+    content = Column(Text, nullable=False)
+    tokens = Column(Integer, nullable=True)  # 估算的token数，创建消息时计算一次
+    
+    __table_args__ = (
+        sqlalchemy.Index('idx_chat_message_session', 'session_id', 'id'),
+    )
+
+class UserUnreadCount(Base):
+    """用户的未读数量汇总，随发送私信、阅读、通知等操作在同一事务中增量更新"""
+    __tablename__ = "user_unread_counts"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    category = Column(String(64), primary_key=True)  # message 或 notification:<通知类型>
+    count = Column(Integer, nullable=False, default=0)
+
+class PushEvent(Base):
+    """待推送的事件，PUSH_BACKEND=database 时各进程按自增ID拉取新事件，推送给连接到本进程的用户"""
+    __tablename__ = "push_events"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=True)  # 接收者，为空表示所有在线用户
+    payload = Column(Text, nullable=False)  # JSON格式的事件内容
+    created_at = Column(DateTime, nullable=False, index=True)
+
 # 新增站公告模型
 class SiteAnnouncement(Base):
     """站公告模型"""
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 class TagBase(BaseModel):
@@ -15,6 +15,12 @@ class Tag(TagBase):
         from_attributes = True  # 替代已弃用的orm_mode
         orm_mode = True  # 保留向后兼容性
 
+class TagWithCounts(Tag):
+    """标签目录项，计数只包含已通过审核的Prompt"""
+    prompt_count: int = 0
+    non_r18_count: int = 0
+    r18_count: int = 0
+
 class UserBase(BaseModel):
     username: str
     email: Optional[str] = None
@@ -58,6 +64,11 @@ class CommentWithUser(CommentBase):
         from_attributes = True
         orm_mode = True
 
+class NormalizedCommentsResponse(BaseModel):
+    """规范化格式的评论列表，评论只包含user_id，评论者信息在users中只出现一次"""
+    comments: List[Comment]
+    users: Dict[int, User]
+
 class PromptBase(BaseModel):
     title: str
     content: str
@@ -85,6 +96,22 @@ class PromptList(PromptBase):
         from_attributes = True
         orm_mode = True
 
+class NormalizedPromptList(PromptBase):
+    """规范化格式中的Prompt列表项，作者只以user_id引用，用户信息见响应中的users"""
+    id: int
+    user_id: int
+    created_at: datetime
+    updated_at: datetime
+    likes: int = 0
+    dislikes: int = 0
+    views: int = 0
+    status: int = 0
+    is_r18: int = 0
+    tags: List[Tag] = []
+    
+    class Config:
+        from_attributes = True
+
 class PromptForEdit(PromptBase):
     """用于编辑的Prompt模型，不包含评论信息以提高性能"""
     id: int
@@ -121,6 +148,10 @@ class Prompt(PromptBase):
         from_attributes = True  # 替代已弃用的orm_mode
         orm_mode = True  # 保留向后兼容性
 
+class PromptViewBeacon(BaseModel):
+    """浏览量上报请求模型"""
+    prompt_ids: List[int]
+
 # OAuth相关模型
 class GitHubUser(BaseModel):
     """GitHub用户信息模型"""
@@ -216,10 +247,11 @@ class MessagesResponse(BaseModel):
 class PaginatedPromptsResponse(BaseModel):
     """分页Prompt响应模型"""
     prompts: List[PromptList]
-    total: int
+    total: Optional[int] = None  # 游标分页且with_total=false时不统计总数
     page: int
     per_page: int
     has_more: bool
+    next_cursor: Optional[str] = None  # 下一页的游标，没有更多数据时为空
     
     class Config:
         from_attributes = True
@@ -256,6 +288,11 @@ class PrivateMessageWithUser(PrivateMessageBase):
         from_attributes = True
         orm_mode = True
 
+class NormalizedMessagesResponse(BaseModel):
+    """规范化格式的对话消息，消息只包含发送者和接收者的ID，用户信息在users中只出现一次"""
+    messages: List[PrivateMessage]
+    users: Dict[int, User]
+
 class MessageThreadBase(BaseModel):
     pass
 
@@ -361,6 +398,20 @@ class NotificationResponse(BaseModel):
     total: int
     unread_count: int
 
+class NormalizedNotification(Notification):
+    """规范化格式的通知，发送者和关联Prompt的作者只以ID引用"""
+    related_prompt: Optional[NormalizedPromptList] = None
+    
+    class Config:
+        from_attributes = True
+
+class NormalizedNotificationResponse(BaseModel):
+    """规范化格式的通知响应，通知中引用的用户集中在users中"""
+    notifications: List[NormalizedNotification]
+    users: Dict[int, User]
+    total: int
+    unread_count: int
+
 class SendNotificationRequest(BaseModel):
     """发送通知请求模型"""
     user_ids: Optional[List[int]] = None  # 接收通知的用户ID列表（批量发送）
@@ -375,6 +426,7 @@ class MessageSummaryWithNotifications(BaseModel):
     private_message_count: int
     notification_count: int
     total_unread_count: int
+    notification_counts: Dict[str, int] = {}  # 各类型通知的未读数量
 
 # 站公告相关模型
 class SiteAnnouncementBase(BaseModel):
@@ -0,0 +1,86 @@
+"""
+聊天上下文管理模块
+原先按消息条数（15条）裁剪历史，不考虑长度：很长的system提示词加上几轮长对话就会超出
+moonshot-v1-8k 的上下文窗口导致调用失败，而简短的对话又白白浪费了上下文。
+这里按估算的token数裁剪：每条消息的token数在创建时计算一次并保存在消息上（数据库后端同样持久化），
+超出模型预算时从最早的对话开始删除，始终保留system提示词和最新的用户消息。
+裁剪先只作用于发送给模型的副本，本轮成功后才删除存储的历史，调用失败时历史保持原样
+"""
+
+from typing import Dict, List
+
+from fastapi import HTTPException, status
+
+from ..core.config import CHAT_REPLY_RESERVE_TOKENS
+from .llm_providers import providers
+
+# 每条消息除正文外的固定开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数：中日韩文字大约每字一个token，其他文字大约每4个字符一个token。
+    非ASCII字符按UTF-8的3字节计，借助一次编码在C层面完成统计，避免逐字符循环
+    """
+    chars = len(text)
+    wide = max((len(text.encode("utf-8")) - chars) // 2, 0)
+    return wide + (chars - wide + 3) // 4
+
+
+def make_message(role: str, content: str) -> Dict:
+    """创建一条对话消息，同时计算并保存其token数"""
+    return {"role": role, "content": content, "tokens": estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS}
+
+
+def message_tokens(message: Dict) -> int:
+    """消息的token数，旧消息没有保存时补算一次"""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = message["tokens"] = estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+    return tokens
+
+
+def context_budget(model_type: str) -> int:
+    """发送给模型的历史消息可以使用的token数，需要为回复预留一部分上下文"""
+    return providers[model_type].context_tokens - CHAT_REPLY_RESERVE_TOKENS
+
+
+def plan_trim(messages: List[Dict], budget: int) -> int:
+    """
+    计算需要从最早的对话开始删除多少条非system消息才能放进预算
+    总是保留最新的一条消息，并且删除后历史不以助手回复开头；
+    system提示词加最新消息仍超出预算时返回400
+    """
+    total = sum(message_tokens(message) for message in messages)
+    if total <= budget:
+        return 0
+
+    history = [message for message in messages if message["role"] != "system"]
+    drop = 0
+    while total > budget and drop < len(history) - 1:
+        total -= message_tokens(history[drop])
+        drop += 1
+    while drop < len(history) - 1 and history[drop]["role"] != "user":
+        total -= message_tokens(history[drop])
+        drop += 1
+
+    if total > budget:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"消息过长：Prompt和本条消息约{total}个token，超出了模型的上下文长度（{budget}）"
+        )
+    return drop
+
+
+def context_window(messages: List[Dict], drop: int) -> List[Dict]:
+    """发送给模型的消息：跳过最早的drop条非system消息，不修改原列表"""
+    if not drop:
+        return list(messages)
+    window = []
+    for message in messages:
+        if drop and message["role"] != "system":
+            drop -= 1
+            continue
+        window.append(message)
+    return window
@@ -0,0 +1,345 @@
+"""
+数据库聊天会话存储
+会话和消息保存在 chat_sessions / chat_session_messages 表中，任意进程都能读到，重启后也不会丢失。
+修改先按顺序记入内存中的操作队列（写后置），由后台任务定时合并成一个事务写入；
+接口在返回响应前调用 sync，把本进程积压的修改一并提交（组提交），
+因此下一轮对话无论落到哪个进程都能看到完整的历史。
+合并的事务写入失败时改为逐个会话写入，某个会话反复写入失败时只丢弃该会话的修改，
+并让该会话的 sync 抛出异常，不影响同一批次中其他会话的修改
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, String, Text, bindparam, delete, exists, insert
+from sqlalchemy.future import select
+
+from ..core.database import get_db_session
+from ..models import models
+from .chat_sessions import ChatSessionStore, _oldest_non_system
+
+logger = logging.getLogger(__name__)
+
+_sessions_table = models.ChatSession.__table__
+_messages_table = models.ChatSessionMessage.__table__
+
+# 只在会话仍然存在时插入消息，会话已被其他进程删除或清理时静默忽略
+_append_stmt = insert(_messages_table).from_select(
+    ["session_id", "role", "content", "tokens"],
+    select(
+        bindparam("sid", type_=String),
+        bindparam("role", type_=String),
+        bindparam("content", type_=Text),
+        bindparam("tokens", type_=Integer),
+    ).where(exists().where(_sessions_table.c.id == bindparam("sid"))),
+)
+
+
+class DatabaseChatSessionStore(ChatSessionStore):
+    """数据库聊天会话存储"""
+
+    backend = "database"
+    # 单个会话写入失败时的重试次数，超过后丢弃该会话的修改，避免一条坏数据阻塞后续写入
+    MAX_FLUSH_ATTEMPTS = 3
+
+    def __init__(self, ttl: float = 86400, max_per_user: int = 20,
+                 flush_interval: float = 0.2, purge_interval: float = 300):
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        # 待写入的操作，按发生顺序排列: (操作, 会话ID, 参数)
+        self._ops: List[Tuple[str, str, Any]] = []
+        # 会话ID → 该会话待写入的操作数
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._flush_lock = asyncio.Lock()
+        # 会话ID → 该会话连续写入失败的次数
+        self._attempts: Dict[str, int] = {}
+        # 修改已被丢弃、下次 sync 时需要报错的会话ID
+        self._failed: Set[str] = set()
+        self._loop_task: Optional[asyncio.Task] = None
+        self.flushed_ops = 0
+        self.failed_flushes = 0
+        self.dropped_ops = 0
+        self.purged = 0
+
+    def _enqueue(self, op: str, session_id: str, args: Any = None):
+        self._ops.append((op, session_id, args))
+        self._pending[session_id] += 1
+
+    def _forget(self, ops: List[Tuple[str, str, Any]]):
+        for _, session_id, _ in ops:
+            self._pending[session_id] -= 1
+            if self._pending[session_id] <= 0:
+                del self._pending[session_id]
+
+    async def create(self, user_id: int, prompt_id: int, model_type: str,
+                     messages: List[Dict[str, str]]) -> Tuple[str, Dict[str, Any]]:
+        session_id = str(uuid.uuid4())
+        created_at = datetime.now()
+        conversation = {
+            "session_id": session_id,
+            "messages": list(messages),
+            "prompt_id": prompt_id,
+            "user_id": user_id,
+            "model_type": model_type,
+            "created_at": created_at,
+            "expires_at": created_at.timestamp() + self.ttl,
+        }
+        self._enqueue("create", session_id, {
+            "id": session_id,
+            "user_id": user_id,
+            "prompt_id": prompt_id,
+            "model_type": model_type,
+            "created_at": created_at,
+            "expires_at": created_at + timedelta(seconds=self.ttl),
+        })
+        for message in conversation["messages"]:
+            self._enqueue("append", session_id, message)
+        return session_id, conversation
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        # 先提交本进程中该会话尚未写入的修改
+        if session_id in self._pending:
+            await self.flush()
+        async with get_db_session() as db:
+            result = await db.execute(
+                select(_sessions_table).where(
+                    _sessions_table.c.id == session_id,
+                    _sessions_table.c.expires_at > datetime.now(),
+                )
+            )
+            row = result.mappings().first()
+            if row is None:
+                return None
+            result = await db.execute(
+                select(_messages_table.c.role, _messages_table.c.content, _messages_table.c.tokens)
+                .where(_messages_table.c.session_id == session_id)
+                .order_by(_messages_table.c.id)
+            )
+            messages = [
+                {"role": role, "content": content, "tokens": tokens}
+                for role, content, tokens in result.all()
+            ]
+        return {
+            "session_id": row["id"],
+            "messages": messages,
+            "prompt_id": row["prompt_id"],
+            "user_id": row["user_id"],
+            "model_type": row["model_type"],
+            "created_at": row["created_at"],
+            "expires_at": row["expires_at"].timestamp(),
+        }
+
+    async def delete(self, session_id: str) -> bool:
+        self._enqueue("delete", session_id)
+        await self.flush()
+        return True
+
+    async def append_message(self, conversation: Dict[str, Any], message: Dict[str, str]):
+        conversation["messages"].append(message)
+        self._enqueue("append", conversation["session_id"], message)
+
+    async def remove_last_message(self, conversation: Dict[str, Any], message: Dict[str, str]) -> bool:
+        messages = conversation["messages"]
+        if not messages or messages[-1] is not message:
+            return False
+        messages.pop()
+        session_id = conversation["session_id"]
+        # 追加操作还没有写入时直接撤销
+        for index in range(len(self._ops) - 1, -1, -1):
+            op, op_session_id, args = self._ops[index]
+            if op_session_id != session_id:
+                continue
+            if op == "append" and args is message:
+                self._forget([self._ops.pop(index)])
+                return True
+            break
+        self._enqueue("pop", session_id)
+        return True
+
+    async def drop_oldest(self, conversation: Dict[str, Any], count: int):
+        messages = conversation["messages"]
+        dropped = set(_oldest_non_system(messages, count))
+        if not dropped:
+            return
+        messages[:] = [message for index, message in enumerate(messages) if index not in dropped]
+        self._enqueue("drop_oldest", conversation["session_id"], len(dropped))
+
+    async def sync(self, session_id: str):
+        if session_id in self._pending:
+            await self.flush()
+        if session_id in self._failed:
+            self._failed.discard(session_id)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="聊天记录保存失败，请稍后重试"
+            )
+
+    async def _apply(self, db, ops: List[Tuple[str, str, Any]]):
+        index = 0
+        while index < len(ops):
+            op, session_id, args = ops[index]
+            if op == "append":
+                # 连续的追加合并为一次批量插入
+                rows = []
+                while index < len(ops) and ops[index][0] == "append":
+                    _, sid, message = ops[index]
+                    rows.append({
+                        "sid": sid,
+                        "role": message["role"],
+                        "content": message["content"],
+                        "tokens": message.get("tokens"),
+                    })
+                    index += 1
+                await db.execute(_append_stmt, rows)
+                continue
+
+            if op == "create":
+                await db.execute(insert(_sessions_table).values(**args))
+                # 超出单个用户的会话数上限时删除该用户最早创建的会话
+                result = await db.execute(
+                    select(_sessions_table.c.id)
+                    .where(_sessions_table.c.user_id == args["user_id"])
+                    .order_by(_sessions_table.c.created_at.desc())
+                    .offset(self.max_per_user)
+                )
+                await self._delete_sessions(db, list(result.scalars().all()))
+            elif op == "delete":
+                await self._delete_sessions(db, [session_id])
+            elif op == "pop":
+                result = await db.execute(
+                    select(_messages_table.c.id)
+                    .where(_messages_table.c.session_id == session_id)
+                    .order_by(_messages_table.c.id.desc())
+                    .limit(1)
+                )
+                await self._delete_messages(db, list(result.scalars().all()))
+            elif op == "drop_oldest":
+                result = await db.execute(
+                    select(_messages_table.c.id)
+                    .where(_messages_table.c.session_id == session_id, _messages_table.c.role != "system")
+                    .order_by(_messages_table.c.id)
+                    .limit(args)
+                )
+                await self._delete_messages(db, list(result.scalars().all()))
+            index += 1
+
+    @staticmethod
+    async def _delete_messages(db, message_ids: List[int]):
+        if message_ids:
+            await db.execute(delete(_messages_table).where(_messages_table.c.id.in_(message_ids)))
+
+    @staticmethod
+    async def _delete_sessions(db, session_ids: List[str]):
+        if session_ids:
+            await db.execute(delete(_messages_table).where(_messages_table.c.session_id.in_(session_ids)))
+            await db.execute(delete(_sessions_table).where(_sessions_table.c.id.in_(session_ids)))
+
+    async def _write(self, ops: List[Tuple[str, str, Any]]):
+        async with get_db_session() as db:
+            await self._apply(db, ops)
+            await db.commit()
+        self.flushed_ops += len(ops)
+        self._forget(ops)
+        for _, session_id, _ in ops:
+            self._attempts.pop(session_id, None)
+
+    async def flush(self):
+        """把积压的修改合并为一个事务写入数据库，失败时逐个会话重试"""
+        async with self._flush_lock:
+            if not self._ops:
+                return
+            ops, self._ops = self._ops, []
+            try:
+                await self._write(ops)
+            except asyncio.CancelledError:
+                # 请求被取消（例如客户端断开）时交给后台任务写入
+                self._ops = ops + self._ops
+                raise
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"批量写入聊天会话失败，改为逐个会话写入: {e}")
+                await self._flush_by_session(ops)
+
+    async def _flush_by_session(self, ops: List[Tuple[str, str, Any]]):
+        """每个会话单独一个事务写入，写入失败的会话放回队列，超过重试次数后只丢弃该会话的修改"""
+        by_session: Dict[str, List[Tuple[str, str, Any]]] = defaultdict(list)
+        for op in ops:
+            by_session[op[1]].append(op)
+        settled: Set[str] = set()
+        try:
+            for session_id, session_ops in by_session.items():
+                try:
+                    await self._write(session_ops)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    attempts = self._attempts.get(session_id, 0) + 1
+                    if attempts < self.MAX_FLUSH_ATTEMPTS:
+                        self._attempts[session_id] = attempts
+                        logger.error(f"写入聊天会话 {session_id} 失败，将在下次重试: {e}")
+                        continue
+                    logger.error(f"写入聊天会话 {session_id} 失败，已重试{attempts}次，丢弃{len(session_ops)}个修改: {e}")
+                    self._attempts.pop(session_id, None)
+                    self.dropped_ops += len(session_ops)
+                    self._forget(session_ops)
+                    self._failed.add(session_id)
+                settled.add(session_id)
+        finally:
+            # 没有写入也没有丢弃的修改按原来的顺序放回队列
+            self._ops = [op for op in ops if op[1] not in settled] + self._ops
+
+    async def purge_expired(self) -> int:
+        """删除已过期的会话及其消息"""
+        async with get_db_session() as db:
+            expired = select(_sessions_table.c.id).where(_sessions_table.c.expires_at <= datetime.now())
+            await db.execute(delete(_messages_table).where(_messages_table.c.session_id.in_(expired)))
+            result = await db.execute(delete(_sessions_table).where(_sessions_table.c.expires_at <= datetime.now()))
+            await db.commit()
+        self.purged += result.rowcount or 0
+        return result.rowcount or 0
+
+    async def _run_periodically(self):
+        since_purge = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            since_purge += self.flush_interval
+            if since_purge >= self.purge_interval:
+                since_purge = 0.0
+                try:
+                    await self.purge_expired()
+                except Exception as e:
+                    logger.error(f"清理过期聊天会话失败: {e}")
+
+    def start(self):
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.get_running_loop().create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "pending_ops": len(self._ops),
+            "pending_sessions": len(self._pending),
+            "flushed_ops": self.flushed_ops,
+            "failed_flushes": self.failed_flushes,
+            "dropped_ops": self.dropped_ops,
+            "failed_sessions": len(self._failed),
+            "purged": self.purged,
+        }
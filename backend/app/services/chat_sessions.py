@@ -0,0 +1,281 @@
+"""
+聊天会话存储模块
+原先的会话保存在一个普通字典里，每次聊天和查看历史都要遍历全部会话清理过期项，
+除24小时的有效期外没有任何内存上限。这里改为：
+- 按过期时间组织的最小堆，每次只弹出已经过期的会话，清理代价与过期数量成正比
+- 按最近使用顺序排列的会话表，总会话数或消息总字节数超出预算时淘汰最久未使用的会话
+- 每个用户的会话数上限，超出时淘汰该用户最久未使用的会话
+会话中的消息只能通过存储的方法修改，以便准确统计内存占用，也便于持久化的实现记录每一次修改。
+
+存储后端由 CHAT_SESSION_BACKEND 选择：memory 只在当前进程内有效，
+database 把会话写入数据库（见 chat_session_db.py），多进程部署和重启后会话依然可用
+"""
+
+import heapq
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import (
+    CHAT_SESSION_BACKEND,
+    CHAT_SESSION_FLUSH_INTERVAL,
+    CHAT_SESSION_MAX_BYTES,
+    CHAT_SESSION_TTL,
+    CHAT_SESSIONS_MAX,
+    CHAT_SESSIONS_PER_USER,
+)
+
+logger = logging.getLogger(__name__)
+
+# 每条消息和每个会话的固定开销（字典、列表等对象本身），只用于估算内存占用
+_MESSAGE_OVERHEAD = 200
+_SESSION_OVERHEAD = 500
+
+
+def _message_size(message: Dict[str, str]) -> int:
+    return len(message["content"].encode("utf-8")) + _MESSAGE_OVERHEAD
+
+
+def _oldest_non_system(messages: List[Dict[str, str]], count: int) -> List[int]:
+    """最早的count条非system消息在列表中的下标"""
+    return [index for index, message in enumerate(messages) if message["role"] != "system"][:count]
+
+
+class ChatSessionStore(ABC):
+    """
+    聊天会话存储的接口
+    会话格式: {"session_id", "messages": [...], "prompt_id", "user_id", "model_type", "created_at", "expires_at"}
+    修改消息的方法直接修改传入的会话对象，并由具体实现负责记录或持久化
+    """
+
+    backend = ""
+
+    @abstractmethod
+    async def create(self, user_id: int, prompt_id: int, model_type: str,
+                     messages: List[Dict[str, str]]) -> Tuple[str, Dict[str, Any]]:
+        """创建新会话，返回 (会话ID, 会话)"""
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """获取会话，不存在或已过期时返回None"""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> bool:
+        """删除会话，返回会话是否存在"""
+
+    @abstractmethod
+    async def append_message(self, conversation: Dict[str, Any], message: Dict[str, str]):
+        """追加一条消息"""
+
+    @abstractmethod
+    async def remove_last_message(self, conversation: Dict[str, Any], message: Dict[str, str]) -> bool:
+        """最后一条消息是message时将其撤回"""
+
+    @abstractmethod
+    async def drop_oldest(self, conversation: Dict[str, Any], count: int):
+        """删除最早的count条非system消息，用于裁剪历史"""
+
+    async def sync(self, session_id: str):
+        """
+        确保该会话此前的修改已经落盘，返回响应前调用，下一轮请求落到其他进程时也能读到
+        该会话的修改因写入失败被丢弃时抛出HTTPException(503)
+        """
+
+    def start(self):
+        """启动后台任务，在应用启动时调用"""
+
+    async def stop(self):
+        """停止后台任务并保存剩余修改，在应用关闭时调用"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """运行状态，供管理后台查看"""
+
+
+class MemoryChatSessionStore(ChatSessionStore):
+    """内存中的聊天会话存储，只在当前进程内有效"""
+
+    backend = "memory"
+
+    def __init__(self, ttl: float = 86400, max_sessions: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, max_per_user: int = 20):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_per_user = max_per_user
+        # 会话ID → 会话，按最近使用顺序排列（最久未使用的在前）
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # (过期时间戳, 会话ID)；会话的过期时间从创建时起算且不会改变，每个会话只有一条记录，
+        # 被删除或淘汰的会话留在堆中，弹出时跳过
+        self._expiry: List[Tuple[float, str]] = []
+        # 用户ID → 该用户的会话ID，同样按最近使用顺序排列
+        self._by_user: Dict[int, "OrderedDict[str, None]"] = {}
+        self._sizes: Dict[str, int] = {}
+        self.bytes = 0
+        self.expired = 0
+        self.evictions = {"sessions": 0, "bytes": 0, "per_user": 0}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _remove(self, session_id: str) -> Optional[Dict[str, Any]]:
+        conversation = self._sessions.pop(session_id, None)
+        if conversation is None:
+            return None
+        self.bytes -= self._sizes.pop(session_id, 0)
+        user_sessions = self._by_user.get(conversation["user_id"])
+        if user_sessions is not None:
+            user_sessions.pop(session_id, None)
+            if not user_sessions:
+                del self._by_user[conversation["user_id"]]
+        return conversation
+
+    def _resize(self, session_id: str, delta: int):
+        if session_id in self._sizes:
+            self._sizes[session_id] += delta
+            self.bytes += delta
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """弹出所有已过期的会话，返回清理的数量"""
+        now = time.time() if now is None else now
+        purged = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, session_id = heapq.heappop(self._expiry)
+            if self._remove(session_id) is not None:
+                purged += 1
+                logger.info(f"清理过期对话会话: {session_id}")
+        self.expired += purged
+        return purged
+
+    def _evict(self, protect: str):
+        """超出总会话数或字节预算时淘汰最久未使用的会话，刚刚使用的会话不参与淘汰"""
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self.bytes > self.max_bytes
+        ):
+            session_id = next(iter(self._sessions))
+            if session_id == protect:
+                self._sessions.move_to_end(session_id)
+                session_id = next(iter(self._sessions))
+            reason = "sessions" if len(self._sessions) > self.max_sessions else "bytes"
+            self._remove(session_id)
+            self.evictions[reason] += 1
+
+    def _touch(self, session_id: str):
+        conversation = self._sessions.get(session_id)
+        if conversation is not None:
+            self._sessions.move_to_end(session_id)
+            self._by_user[conversation["user_id"]].move_to_end(session_id)
+
+    async def create(self, user_id: int, prompt_id: int, model_type: str,
+                     messages: List[Dict[str, str]]) -> Tuple[str, Dict[str, Any]]:
+        self.purge_expired()
+        session_id = str(uuid.uuid4())
+        created_at = datetime.now()
+        conversation = {
+            "session_id": session_id,
+            "messages": list(messages),
+            "prompt_id": prompt_id,
+            "user_id": user_id,
+            "model_type": model_type,
+            "created_at": created_at,
+            "expires_at": created_at.timestamp() + self.ttl,
+        }
+
+        # 超出单个用户的会话数上限时，先淘汰该用户最久未使用的会话
+        user_sessions = self._by_user.setdefault(user_id, OrderedDict())
+        while len(user_sessions) >= self.max_per_user:
+            self._remove(next(iter(user_sessions)))
+            self.evictions["per_user"] += 1
+            user_sessions = self._by_user.setdefault(user_id, OrderedDict())
+
+        size = _SESSION_OVERHEAD + sum(_message_size(message) for message in conversation["messages"])
+        self._sessions[session_id] = conversation
+        user_sessions[session_id] = None
+        self._sizes[session_id] = size
+        self.bytes += size
+        heapq.heappush(self._expiry, (conversation["expires_at"], session_id))
+        # 被删除或淘汰的会话在堆中积压过多时重建堆
+        if len(self._expiry) > 2 * len(self._sessions) + 1024:
+            self._expiry = [(c["expires_at"], sid) for sid, c in self._sessions.items()]
+            heapq.heapify(self._expiry)
+        self._evict(protect=session_id)
+        return session_id, conversation
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        self.purge_expired()
+        self._touch(session_id)
+        return self._sessions.get(session_id)
+
+    async def delete(self, session_id: str) -> bool:
+        return self._remove(session_id) is not None
+
+    async def append_message(self, conversation: Dict[str, Any], message: Dict[str, str]):
+        session_id = conversation["session_id"]
+        conversation["messages"].append(message)
+        # 会话已被淘汰时只修改传入的对象
+        self._resize(session_id, _message_size(message))
+        self._touch(session_id)
+        if session_id in self._sessions:
+            self._evict(protect=session_id)
+
+    async def remove_last_message(self, conversation: Dict[str, Any], message: Dict[str, str]) -> bool:
+        messages = conversation["messages"]
+        if not messages or messages[-1] is not message:
+            return False
+        messages.pop()
+        self._resize(conversation["session_id"], -_message_size(message))
+        return True
+
+    async def drop_oldest(self, conversation: Dict[str, Any], count: int):
+        messages = conversation["messages"]
+        dropped = set(_oldest_non_system(messages, count))
+        if not dropped:
+            return
+        self._resize(conversation["session_id"], -sum(_message_size(messages[index]) for index in dropped))
+        messages[:] = [message for index, message in enumerate(messages) if index not in dropped]
+
+    def clear(self):
+        self._sessions.clear()
+        self._expiry.clear()
+        self._by_user.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "live_sessions": len(self._sessions),
+            "users": len(self._by_user),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+            "evictions": dict(self.evictions),
+        }
+
+
+def create_chat_session_store(backend: str = "memory") -> ChatSessionStore:
+    """按配置创建会话存储"""
+    if backend == "database":
+        from .chat_session_db import DatabaseChatSessionStore
+
+        return DatabaseChatSessionStore(
+            ttl=CHAT_SESSION_TTL,
+            max_per_user=CHAT_SESSIONS_PER_USER,
+            flush_interval=CHAT_SESSION_FLUSH_INTERVAL,
+        )
+    if backend != "memory":
+        logger.warning(f"未知的聊天会话存储后端 {backend}，改用内存存储")
+    return MemoryChatSessionStore(
+        ttl=CHAT_SESSION_TTL,
+        max_sessions=CHAT_SESSIONS_MAX,
+        max_bytes=CHAT_SESSION_MAX_BYTES,
+        max_per_user=CHAT_SESSIONS_PER_USER,
+    )
+
+
+# 全局会话存储实例
+chat_sessions = create_chat_session_store(CHAT_SESSION_BACKEND)
@@ -1,19 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Response, Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import joinedload, noload, selectinload
 from sqlalchemy import or_, func
 from sqlalchemy.dialects.sqlite import insert
+from pydantic import TypeAdapter
 from typing import List, Optional
 import datetime
+import hashlib
 
 from ..models import models
 from ..schemas import schemas
 from ..core.database import get_db, create_tables
+from ..core.config import RESPONSE_CACHE_MAX_PAGE, SEARCH_SORT_CANDIDATES
 from ..api import auth
+from .search_index import SORT_NEWEST, SORT_OLDEST, SORT_RELEVANCE, search_index
+from .tags import tag_resolver
+from .tag_catalog import tag_catalog
+from . import normalized as normalized_format, pagination, reactions, unread_counters
+from .listing_counts import listing_counts, listing_key
+from .response_cache import listing_response_cache
+from .view_counter import view_counter
+from .password_hasher import password_hasher
+from .prompt_events import snapshot_prompt, publish_prompt_change
 
 router = APIRouter()
 
+# 单次浏览量上报最多包含的Prompt数量
+MAX_VIEW_BEACON_SIZE = 50
+
+# 单次查询表态最多包含的Prompt数量
+MAX_REACTION_QUERY_SIZE = 100
+
+# 标签自动补全最多返回的数量
+MAX_TAG_SUGGESTIONS = 20
+
+# 可以直接在检索索引中排序分页的排序方式，其余排序只在相关度最高的候选中由数据库排序
+_INDEX_SORTS = {
+    pagination.RELEVANCE_SORT: SORT_RELEVANCE,
+    "upload_time_desc": SORT_NEWEST,
+    "upload_time_asc": SORT_OLDEST,
+}
+
+# 预先构建列表序列化器，用于生成可缓存的响应字节
+_prompt_list_adapter = TypeAdapter(List[schemas.PromptList])
+_tag_list_adapter = TypeAdapter(List[schemas.TagWithCounts])
+_normalized_comments_adapter = TypeAdapter(schemas.NormalizedCommentsResponse)
+
 @router.on_event("startup")
 async def on_startup():
     await create_tables()
@@ -21,23 +54,43 @@ async def on_startup():
     # 创建默认用户（如果不存在）
     db_generator = get_db()
     try:
-        from ..api.auth import get_password_hash
         db = await db_generator.__anext__()
         
         result = await db.execute(select(models.User).filter(models.User.id == 1))
         default_user = result.scalars().first()
         if not default_user:
             # 为默认用户生成哈希密码
-            hashed_password = get_password_hash("default_password")
+            hashed_password = await password_hasher.hash("default_password")
             default_user = models.User(id=1, username="default_user", hashed_password=hashed_password)
             db.add(default_user)
             await db.commit()
+        
+        # 首次部署时统计一次未读数
+        await unread_counters.backfill_if_empty(db)
+        
+        # 构建Prompt检索索引和标签目录
+        await search_index.rebuild(db)
+        await tag_catalog.rebuild(db)
     finally:
         # 使用生成器正确关闭数据库连接
         try:
             await db_generator.aclose()
         except:
             pass
+    
+    # 启动浏览量定时写回
+    view_counter.start()
+    # 定时重建检索索引和标签目录，兜底其他进程的修改
+    search_index.start()
+    tag_catalog.start()
+
+@router.on_event("shutdown")
+async def on_shutdown():
+    # 写回内存中尚未落库的浏览量
+    await view_counter.stop()
+    await search_index.stop()
+    await tag_catalog.stop()
+    password_hasher.shutdown()
 
 @router.post("/prompts/", response_model=schemas.Prompt, status_code=status.HTTP_201_CREATED)
 async def create_prompt(
@@ -61,18 +114,8 @@ async def create_prompt(
     db_prompt = models.Prompt(**prompt_data, user_id=current_user.id, status=0)
     db.add(db_prompt)
     
-    # 处理标签（最多5个）
-    for tag_name in tags_data[:5]:  # 限制最多5个标签
-        if tag_name:  # 确保标签名不为空
-            # 查找或创建标签
-            result = await db.execute(select(models.Tag).filter(models.Tag.name == tag_name))
-            tag = result.scalars().first()
-            if not tag:
-                tag = models.Tag(name=tag_name)
-                db.add(tag)
-            
-            # 将标签添加到prompt
-            db_prompt.tags.append(tag)
+    # 处理标签（最多5个），批量查找或创建
+    db_prompt.tags.extend(await tag_resolver.resolve(db, tags_data[:5]))
     
     await db.commit()
     await db.refresh(db_prompt)
@@ -87,9 +130,38 @@ async def create_prompt(
     db_prompt = result.scalars().first()
     return db_prompt
 
+async def _legacy_search_filter(db: AsyncSession, search: str):
+    """在标题、描述以及标签中模糊查询（检索索引不可用时的回退方案）"""
+    search_pattern = f"%{search}%"  # 添加模糊匹配的百分号
+    # 首先获取包含与搜索关键词匹配的标签的prompt_id
+    tag_query = select(models.Prompt.id).join(models.Prompt.tags).filter(models.Tag.name.ilike(search_pattern))
+    tag_result = await db.execute(tag_query)
+    tag_prompt_ids = [id for id, in tag_result.fetchall()]
+    
+    # 标题或描述中包含关键词，或者prompt_id在tag_prompt_ids中
+    return or_(
+        models.Prompt.title.ilike(search_pattern),
+        models.Prompt.description.ilike(search_pattern),
+        models.Prompt.id.in_(tag_prompt_ids) if tag_prompt_ids else False
+    )
+
+def _order_by_rank(prompts, ranked_ids: List[int]):
+    """按检索索引给出的名次对查询结果重新排序"""
+    rank = {prompt_id: position for position, prompt_id in enumerate(ranked_ids)}
+    return sorted(prompts, key=lambda prompt: rank.get(prompt.id, len(rank)))
+
 @router.get("/prompts/", response_model=List[schemas.PromptList])
 async def read_prompts(skip: int = 0, limit: int = 10, search: Optional[str] = None, tag: Optional[str] = None, 
                      sort_by: Optional[str] = None, is_r18: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    # 默认排序、无搜索条件的前几页直接返回缓存的响应
+    cache_key = None
+    if not search and sort_by in (None, "upload_time_desc") and skip < RESPONSE_CACHE_MAX_PAGE * 16 and limit <= 100:
+        cache_key = ("list", skip, limit, is_r18, tag or None)
+        cached = listing_response_cache.get(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+        cache_generation = listing_response_cache.generation
+    
     # 使用joinedload预加载标签和用户信息，避免n+1查询问题
     # 只返回审核状态为1(已通过)的prompt
     # 注意：这里不加载评论关系，避免在列表页面触发大量评论加载
@@ -101,20 +173,21 @@ async def read_prompts(skip: int = 0, limit: int = 10, search: Optional[str] = N
     # 根据R18参数筛选
     if is_r18 is not None:
         query = query.filter(models.Prompt.is_r18 == is_r18)
-      # 如果提供了搜索关键词，使用标题、描述以及标签进行模糊查询
+    
+    # 如果提供了搜索关键词，优先使用内存检索索引（已按R18和标签过滤），索引不可用时回退到模糊查询
+    search_hits = None
+    index_sort = None
     if search:
-        search = f"%{search}%"  # 添加模糊匹配的百分号
-        # 首先获取包含与搜索关键词匹配的标签的prompt_id
-        tag_query = select(models.Prompt.id).join(models.Prompt.tags).filter(models.Tag.name.ilike(search))
-        tag_result = await db.execute(tag_query)
-        tag_prompt_ids = [id for id, in tag_result.fetchall()]
-        
-        # 然后创建复合查询：标题或描述中包含关键词，或者prompt_id在tag_prompt_ids中
-        query = query.filter(or_(
-            models.Prompt.title.ilike(search),
-            models.Prompt.description.ilike(search),
-            models.Prompt.id.in_(tag_prompt_ids)
-        ))
+        index_sort = _INDEX_SORTS.get(pagination.normalize_sort(sort_by))
+        if index_sort is not None:
+            # 按相关度或上传时间排序时直接在索引中排序分页，只按本页的ID查询数据库
+            search_hits = search_index.search(search, is_r18=is_r18, tag=tag, offset=skip, limit=limit, sort=index_sort)
+        else:
+            search_hits = search_index.search(search, is_r18=is_r18, tag=tag, limit=SEARCH_SORT_CANDIDATES)
+        if search_hits is None:
+            query = query.filter(await _legacy_search_filter(db, search))
+        else:
+            query = query.filter(models.Prompt.id.in_(search_hits.prompt_ids))
     
     # 如果提供了标签名称，根据标签过滤
     if tag:
@@ -129,14 +202,23 @@ async def read_prompts(skip: int = 0, limit: int = 10, search: Optional[str] = N
         query = query.order_by(models.Prompt.views.desc())
     elif sort_by == "likes_desc":
         query = query.order_by(models.Prompt.likes.desc())
-    else: # 默认为上传时间（新到老）
+    else: # 默认为上传时间（新到老），relevance排序在查询后按索引名次重排
         query = query.order_by(models.Prompt.created_at.desc())
 
+    if search_hits is not None and index_sort is not None:
+        result = await db.execute(query)
+        return _order_by_rank(result.scalars().unique().all(), search_hits.prompt_ids)
+
     # 应用分页
     query = query.offset(skip).limit(limit)
     
     result = await db.execute(query)
     prompts = result.scalars().unique().all()
+    
+    if cache_key is not None:
+        body = _prompt_list_adapter.dump_json(_prompt_list_adapter.validate_python(prompts, from_attributes=True))
+        listing_response_cache.put(cache_key, body, prompts, limit, cache_generation, is_r18=is_r18, tag=tag or None)
+        return Response(content=body, media_type="application/json")
     return prompts
 
 @router.get("/prompts/paginated", response_model=schemas.PaginatedPromptsResponse)
@@ -146,15 +228,32 @@ async def get_prompts_paginated(
     tag: Optional[str] = None, 
     sort_by: Optional[str] = "upload_time_desc", 
     is_r18: Optional[int] = None, 
+    cursor: Optional[str] = None,
+    with_total: bool = True,
     db: AsyncSession = Depends(get_db)
 ):
     """
     获取分页的Prompt列表 - 优化版本，每页固定16个
     专门为prompt市场设计，减少服务器压力
+    
+    支持两种分页方式：
+    - 页码分页：传入page
+    - 游标分页：传入上一次响应中的next_cursor，翻到第N页与第1页代价相同；
+      此时可以传with_total=false跳过总数统计
     """
     # 每页固定16个prompt
     per_page = 16
     skip = (page - 1) * per_page
+    sort_key = pagination.normalize_sort(sort_by)
+    
+    # 默认排序、无搜索条件的前几页直接返回缓存的响应
+    cache_key = None
+    if not search and cursor is None and with_total and sort_key == pagination.DEFAULT_SORT and 1 <= page <= RESPONSE_CACHE_MAX_PAGE:
+        cache_key = ("paginated", page, is_r18, tag or None)
+        cached = listing_response_cache.get(cache_key)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+        cache_generation = listing_response_cache.generation
     
     # 构建基础查询 - 只预加载必要的关系
     base_query = select(models.Prompt).options(
@@ -170,66 +269,143 @@ async def get_prompts_paginated(
         base_query = base_query.filter(models.Prompt.is_r18 == is_r18)
         count_query = count_query.filter(models.Prompt.is_r18 == is_r18)
     
-    # 搜索功能 - 在标题、描述和标签中搜索
+    # 搜索功能 - 在标题、描述和标签中搜索，优先使用内存检索索引
+    search_hits = None
+    index_sort = None
     if search:
-        search_pattern = f"%{search}%"
-        
-        # 获取匹配标签的prompt_id
-        tag_subquery = select(models.Prompt.id).join(models.Prompt.tags).filter(
-            models.Tag.name.ilike(search_pattern)
-        )
-        tag_result = await db.execute(tag_subquery)
-        tag_prompt_ids = [id for id, in tag_result.fetchall()]
-        
-        # 组合搜索条件
-        search_filter = or_(
-            models.Prompt.title.ilike(search_pattern),
-            models.Prompt.description.ilike(search_pattern),
-            models.Prompt.id.in_(tag_prompt_ids) if tag_prompt_ids else False
-        )
-        
-        base_query = base_query.filter(search_filter)
-        count_query = count_query.filter(search_filter)
+        index_sort = _INDEX_SORTS.get(sort_key)
+        if index_sort is not None:
+            # 按相关度或上传时间排序时直接在索引中排序分页，多取一条用于判断是否还有下一页
+            after = None
+            if cursor is not None:
+                payload = pagination.decode_cursor(cursor, sort_key)
+                if sort_key == pagination.RELEVANCE_SORT:
+                    skip = pagination.relevance_offset(payload)
+                else:
+                    after = pagination.keyset_position(payload, sort_key)
+                    skip = 0
+            search_hits = search_index.search(
+                search, is_r18=is_r18, tag=tag, offset=skip, limit=per_page + 1, sort=index_sort, after=after
+            )
+        else:
+            # 按浏览量、点赞数排序时只在相关度最高的候选中排序，避免把全部命中放进IN列表
+            search_hits = search_index.search(search, is_r18=is_r18, tag=tag, limit=SEARCH_SORT_CANDIDATES)
+        if search_hits is None:
+            search_filter = await _legacy_search_filter(db, search)
+            base_query = base_query.filter(search_filter)
+            count_query = count_query.filter(search_filter)
+        elif index_sort is None:
+            base_query = base_query.filter(models.Prompt.id.in_(search_hits.prompt_ids))
+    
+    # 没有可用的检索结果时，相关度排序退化为默认排序
+    if sort_key == pagination.RELEVANCE_SORT and search_hits is None:
+        sort_key = pagination.DEFAULT_SORT
     
     # 标签筛选
     if tag:
         base_query = base_query.join(models.Prompt.tags).filter(models.Tag.name == tag)
         count_query = count_query.join(models.prompt_tag, models.Prompt.id == models.prompt_tag.c.prompt_id).join(models.Tag, models.Tag.id == models.prompt_tag.c.tag_id).filter(models.Tag.name == tag)
     
-    # 排序
-    if sort_by == "upload_time_desc":
-        base_query = base_query.order_by(models.Prompt.created_at.desc())
-    elif sort_by == "upload_time_asc":
-        base_query = base_query.order_by(models.Prompt.created_at.asc())
-    elif sort_by == "views_desc":
-        base_query = base_query.order_by(models.Prompt.views.desc())
-    elif sort_by == "likes_desc":
-        base_query = base_query.order_by(models.Prompt.likes.desc())
+    # 总数：索引命中时直接取自索引，否则优先读取总数缓存；游标分页时可以不统计
+    total = None
+    if search_hits is not None:
+        # 在候选中排序时，能翻到的结果只有候选这么多
+        total = search_hits.total if index_sort is not None else len(search_hits.prompt_ids)
+    elif with_total or cursor is None:
+        count_key = listing_key(is_r18, tag, search)
+        total = listing_counts.get(count_key)
+        if total is None:
+            generation = listing_counts.generation
+            total_result = await db.execute(count_query)
+            total = total_result.scalar()
+            listing_counts.set(count_key, total, generation)
+    
+    if search_hits is not None and index_sort is not None:
+        # 检索索引已经排好序并分页，只按本页的ID查询
+        page_ids = search_hits.prompt_ids[:per_page]
+        result = await db.execute(base_query.filter(models.Prompt.id.in_(page_ids)))
+        prompts = _order_by_rank(result.scalars().unique().all(), page_ids)
+        has_more = len(search_hits.prompt_ids) > per_page
+        if not has_more or not prompts:
+            next_cursor = None
+        elif sort_key == pagination.RELEVANCE_SORT:
+            next_cursor = pagination.relevance_cursor(skip + len(page_ids))
+        else:
+            next_cursor = pagination.cursor_after(prompts[-1], sort_key)
     else:
-        base_query = base_query.order_by(models.Prompt.created_at.desc())
-    
-    # 获取总数和当前页数据
-    total_result = await db.execute(count_query)
-    total = total_result.scalar()
-    
-    # 应用分页
-    paginated_query = base_query.offset(skip).limit(per_page)
-    result = await db.execute(paginated_query)
-    prompts = result.scalars().unique().all()
-    
-    # 计算是否有更多页
-    has_more = (skip + len(prompts)) < total
-    
-    return schemas.PaginatedPromptsResponse(
+        base_query = base_query.order_by(*pagination.order_by_clauses(sort_key))
+        if cursor is not None:
+            # 游标分页：越过上一页最后一条记录，不使用OFFSET
+            base_query = base_query.filter(pagination.keyset_filter(pagination.decode_cursor(cursor, sort_key), sort_key))
+        else:
+            base_query = base_query.offset(skip)
+        
+        # 多取一条用于判断是否还有下一页
+        result = await db.execute(base_query.limit(per_page + 1))
+        prompts = result.scalars().unique().all()
+        has_more = len(prompts) > per_page
+        prompts = prompts[:per_page]
+        next_cursor = pagination.cursor_after(prompts[-1], sort_key) if has_more else None
+    
+    response = schemas.PaginatedPromptsResponse(
         prompts=prompts,
         total=total,
         page=page,
         per_page=per_page,
-        has_more=has_more
+        has_more=has_more,
+        next_cursor=next_cursor
     )
+    
+    if cache_key is not None:
+        body = response.model_dump_json().encode("utf-8")
+        listing_response_cache.put(cache_key, body, prompts, per_page, cache_generation, is_r18=is_r18, tag=tag or None, has_total=True)
+        return Response(content=body, media_type="application/json")
+    return response
+
+@router.post("/prompts/views", status_code=status.HTTP_202_ACCEPTED)
+async def record_prompt_views(beacon: schemas.PromptViewBeacon, db: AsyncSession = Depends(get_db)):
+    """
+    浏览量上报接口，前端把一段时间内打开过的Prompt批量上报
+    只统计已通过审核的Prompt，计数进入内存缓冲后由后台批量写回
+    """
+    prompt_ids = list(dict.fromkeys(beacon.prompt_ids))[:MAX_VIEW_BEACON_SIZE]
+    if not prompt_ids:
+        return {"recorded": 0}
+    
+    result = await db.execute(
+        select(models.Prompt.id).filter(models.Prompt.id.in_(prompt_ids), models.Prompt.status == 1)
+    )
+    approved_ids = [prompt_id for prompt_id, in result.fetchall()]
+    for prompt_id in approved_ids:
+        view_counter.record(prompt_id)
+    
+    return {"recorded": len(approved_ids)}
+
+@router.get("/prompts/reactions")
+async def read_prompt_reactions(
+    ids: str = "",
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    批量查询当前用户对一页Prompt的表态，ids为逗号分隔的Prompt ID
+    返回 {prompt_id: 1(点赞) / -1(点踩)}，未登录时返回空结果
+    """
+    try:
+        prompt_ids = list(dict.fromkeys(int(item) for item in ids.split(",") if item.strip()))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的Prompt ID列表")
+    if not current_user or not prompt_ids:
+        return {}
+    return await reactions.get_user_reactions(db, current_user.id, prompt_ids[:MAX_REACTION_QUERY_SIZE])
 
 @router.get("/prompts/{prompt_id}", response_model=schemas.Prompt)
-async def read_prompt(prompt_id: int, db: AsyncSession = Depends(get_db)):
+async def read_prompt(
+    prompt_id: int,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """获取Prompt详情 - 只读接口，浏览量通过 POST /prompts/views 上报，支持ETag协商缓存"""
     # 预加载标签、评论、评论的用户以及prompt的所有者
     query = select(models.Prompt).options(
         joinedload(models.Prompt.tags),
@@ -244,30 +420,16 @@ async def read_prompt(prompt_id: int, db: AsyncSession = Depends(get_db)):
     if db_prompt.status != 1:
         raise HTTPException(status_code=404, detail="Prompt not found or not approved")
     
-    # 增加浏览量
-    db_prompt.views += 1
-    
-    # 同时更新daily_views表中的今日浏览量
-    import datetime
-    today = datetime.date.today()
-    
-    # 查询今天的记录是否存在
-    daily_views_query = select(models.DailyViews).filter(models.DailyViews.date == today)
-    daily_views_result = await db.execute(daily_views_query)
-    daily_views = daily_views_result.scalar_one_or_none()
-    
-    if daily_views:
-        # 如果今天的记录已存在，增加浏览量
-        daily_views.views += 1
-    else:
-        # 如果今天的记录不存在，创建新记录
-        new_daily_views = models.DailyViews(date=today, views=1)
-        db.add(new_daily_views)
+    # 浏览量加上内存中尚未写回的部分
+    response = schemas.Prompt.model_validate(db_prompt)
+    response.views += view_counter.pending_views(prompt_id)
     
-    await db.commit()
-    await db.refresh(db_prompt)
-    
-    return db_prompt
+    body = response.model_dump_json().encode("utf-8")
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/prompts/{prompt_id}/edit", response_model=schemas.PromptForEdit)
 async def get_prompt_for_edit(
@@ -301,43 +463,84 @@ async def get_prompt_for_edit(
     
     return db_prompt
 
+async def _react(prompt_id: int, reaction: Optional[int], db: AsyncSession, current_user: Optional[models.User], action: str):
+    if not current_user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"需要登录才能{action}"
+        )
+    state = await reactions.set_reaction(db, current_user.id, prompt_id, reaction)
+    return {
+        "status": "success",
+        "id": prompt_id,
+        "likes": state.likes,
+        "dislikes": state.dislikes,
+        "reaction": state.reaction
+    }
+
 @router.put("/prompts/{prompt_id}/like")
-async def like_prompt(prompt_id: int, db: AsyncSession = Depends(get_db)):
-    # 使用joinedload预加载标签
-    query = select(models.Prompt).options(joinedload(models.Prompt.tags)).filter(models.Prompt.id == prompt_id)
-    result = await db.execute(query)
-    db_prompt = result.scalars().first()
-    if db_prompt is None:
-        raise HTTPException(status_code=404, detail="Prompt not found")
-    db_prompt.likes += 1
-    await db.commit()
-    await db.refresh(db_prompt)
-    
-    # 只返回状态和ID
-    return {"status": "success", "id": prompt_id, "likes": db_prompt.likes}
+async def like_prompt(
+    prompt_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """点赞 - 每个用户只计一次，已点踩时改为点赞"""
+    return await _react(prompt_id, reactions.LIKE, db, current_user, "点赞")
 
 @router.put("/prompts/{prompt_id}/dislike")
-async def dislike_prompt(prompt_id: int, db: AsyncSession = Depends(get_db)):
-    # 使用joinedload预加载标签
-    query = select(models.Prompt).options(joinedload(models.Prompt.tags)).filter(models.Prompt.id == prompt_id)
-    result = await db.execute(query)
-    db_prompt = result.scalars().first()
-    if db_prompt is None:
-        raise HTTPException(status_code=404, detail="Prompt not found")
-    db_prompt.dislikes += 1
-    await db.commit()
-    await db.refresh(db_prompt)
-    
-    # 只返回状态和ID
-    return {"status": "success", "id": prompt_id, "dislikes": db_prompt.dislikes}
+async def dislike_prompt(
+    prompt_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """点踩 - 每个用户只计一次，已点赞时改为点踩"""
+    return await _react(prompt_id, reactions.DISLIKE, db, current_user, "点踩")
 
-@router.get("/tags/", response_model=List[schemas.Tag])
-async def read_tags(db: AsyncSession = Depends(get_db)):
-    """获取所有标签列表"""
-    query = select(models.Tag)
-    result = await db.execute(query)
-    tags = result.scalars().all()
-    return tags
+@router.delete("/prompts/{prompt_id}/reaction")
+async def clear_prompt_reaction(
+    prompt_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """取消点赞/点踩"""
+    return await _react(prompt_id, None, db, current_user, "取消点赞")
+
+@router.get("/tags/", response_model=List[schemas.TagWithCounts])
+async def read_tags(
+    top: Optional[int] = None,
+    prefix: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取标签目录及每个标签下已通过审核的Prompt数量，直接从内存生成，支持ETag协商缓存
+    top: 只返回使用次数最多的前N个标签；prefix: 只返回以该前缀开头的标签
+    """
+    if top is not None and top < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="top必须为正整数")
+    if not tag_catalog.ready:
+        await tag_catalog.rebuild(db)
+    
+    body, etag = tag_catalog.render(
+        top, prefix,
+        lambda tags: _tag_list_adapter.dump_json(_tag_list_adapter.validate_python([stats._asdict() for stats in tags]))
+    )
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/tags/suggest", response_model=List[schemas.TagWithCounts])
+async def suggest_tags(
+    q: str,
+    limit: int = 10,
+    is_r18: Optional[int] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """标签自动补全：按使用次数返回以q开头的标签，中英文前缀均可，不区分大小写"""
+    if not tag_catalog.ready:
+        await tag_catalog.rebuild(db)
+    return [stats._asdict() for stats in tag_catalog.suggest(q, limit=min(max(limit, 1), MAX_TAG_SUGGESTIONS), is_r18=is_r18)]
 
 # 评论相关的API端点
 @router.post("/prompts/{prompt_id}/comments/", response_model=schemas.Comment)
@@ -378,9 +581,13 @@ async def read_comments(
     prompt_id: int, 
     skip: int = 0, 
     limit: int = 50, 
+    normalized: bool = False,
     db: AsyncSession = Depends(get_db)
 ):
-    """获取指定prompt的评论列表 - 不需要登录，包含用户信息"""
+    """
+    获取指定prompt的评论列表 - 不需要登录，包含用户信息
+    normalized=true 时返回 NormalizedCommentsResponse：评论只包含user_id，评论者信息去重后放在users中
+    """
     # 首先检查prompt是否存在且已通过审核
     prompt_query = select(models.Prompt).filter(models.Prompt.id == prompt_id, models.Prompt.status == 1)
     result = await db.execute(prompt_query)
@@ -388,17 +595,22 @@ async def read_comments(
     if db_prompt is None:
         raise HTTPException(status_code=404, detail="Prompt not found or not approved")
     
-    # 获取评论列表并预加载用户信息
-    from sqlalchemy.orm import joinedload
     query = (
         select(models.Comment)
-        .options(joinedload(models.Comment.user))
         .filter(models.Comment.prompt_id == prompt_id)
         .order_by(models.Comment.created_at.desc())
         .offset(skip)
         .limit(limit)
     )
-    result = await db.execute(query)
+    if normalized:
+        # Comment.user 默认连接加载，这里关闭它，评论者去重后单独查询一次
+        result = await db.execute(query.options(noload(models.Comment.user)))
+        comments = result.scalars().all()
+        users = await normalized_format.load_users(db, [comment.user_id for comment in comments])
+        return normalized_format.render(_normalized_comments_adapter, {"comments": comments, "users": users})
+    
+    # 获取评论列表并预加载用户信息
+    result = await db.execute(query.options(joinedload(models.Comment.user)))
     comments = result.scalars().unique().all()
     return comments
 
@@ -467,6 +679,9 @@ async def update_prompt(
             detail="只能编辑自己的Prompt"
         )
     
+    # 记录编辑前的状态，用于更新检索索引
+    before = snapshot_prompt(prompt)
+    
     # 提取标签数据
     prompt_data = prompt_update.model_dump()
     tags_data = prompt_data.pop("tags", [])
@@ -482,22 +697,15 @@ async def update_prompt(
     # 清除现有标签
     prompt.tags.clear()
     
-    # 添加新标签（最多5个）
-    for tag_name in tags_data[:5]:
-        if tag_name:
-            # 查找或创建标签
-            tag_result = await db.execute(select(models.Tag).filter(models.Tag.name == tag_name))
-            tag = tag_result.scalars().first()
-            if not tag:
-                tag = models.Tag(name=tag_name)
-                db.add(tag)
-            
-            # 将标签添加到prompt
-            prompt.tags.append(tag)
+    # 添加新标签（最多5个），批量查找或创建
+    prompt.tags.extend(await tag_resolver.resolve(db, tags_data[:5]))
     
+    after = snapshot_prompt(prompt)
     await db.commit()
     await db.refresh(prompt)
     
+    publish_prompt_change(before, after)
+    
     return prompt
 
 
@@ -514,8 +722,8 @@ async def delete_prompt(
             detail="需要登录才能删除Prompt"
         )
     
-    # 查找prompt
-    query = select(models.Prompt).filter(models.Prompt.id == prompt_id)
+    # 查找prompt（预加载标签，用于更新检索索引）
+    query = select(models.Prompt).options(selectinload(models.Prompt.tags)).filter(models.Prompt.id == prompt_id)
     result = await db.execute(query)
     prompt = result.scalars().first()
     
@@ -530,9 +738,12 @@ async def delete_prompt(
         )
     
     # 删除prompt
+    before = snapshot_prompt(prompt)
     await db.delete(prompt)
     await db.commit()
     
+    publish_prompt_change(before, None)
+    
     return {"status": "success"}
 
 # 站公告相关API（公开接口）
@@ -0,0 +1,98 @@
+"""
+Prompt市场列表总数缓存
+按规范化后的筛选条件 (is_r18, tag, search) 缓存已通过审核的Prompt数量，
+Prompt审核状态变化时按增量调整，避免无限滚动每翻一页都执行一次 count(*)
+"""
+
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from ..core.config import LISTING_COUNT_CACHE_SIZE, LISTING_COUNT_TTL
+from .prompt_events import PromptSnapshot, subscribe_prompt_changes
+
+
+class ListingKey(NamedTuple):
+    is_r18: Optional[int]
+    tag: Optional[str]
+    search: Optional[str]
+
+
+def listing_key(is_r18: Optional[int], tag: Optional[str], search: Optional[str]) -> ListingKey:
+    """规范化筛选条件：空字符串与未传参数视为相同，搜索词不区分大小写"""
+    search = search.lower() if search else None
+    return ListingKey(is_r18=is_r18, tag=tag or None, search=search or None)
+
+
+def _matches(snapshot: Optional[PromptSnapshot], key: ListingKey) -> bool:
+    """不带搜索条件的key是否会统计到该Prompt"""
+    if snapshot is None or not snapshot.is_public:
+        return False
+    if key.is_r18 is not None and snapshot.is_r18 != key.is_r18:
+        return False
+    if key.tag is not None and key.tag not in snapshot.tags:
+        return False
+    return True
+
+
+class ListingCountCache:
+    """带TTL的LRU总数缓存，TTL用于兜底多进程部署下的误差"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[ListingKey, tuple]" = OrderedDict()
+        # 每次数据变化都会递增，用于丢弃在变化之前开始、之后才写回的统计结果
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: ListingKey) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        total, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return total
+
+    def set(self, key: ListingKey, total: int, generation: int):
+        """
+        写入统计结果
+        generation应为开始统计前读取的值，期间如有数据变化则放弃写入
+        """
+        if generation != self.generation:
+            return
+        self._entries[key] = (total, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def apply_change(self, before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+        """根据Prompt变更调整已缓存的总数"""
+        self.generation += 1
+        for key in list(self._entries):
+            if key.search is not None:
+                # 搜索结果无法按增量计算，直接失效
+                del self._entries[key]
+                continue
+            delta = int(_matches(after, key)) - int(_matches(before, key))
+            if delta:
+                total, expires_at = self._entries[key]
+                self._entries[key] = (max(total + delta, 0), expires_at)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+
+# 全局缓存实例
+listing_counts = ListingCountCache(max_entries=LISTING_COUNT_CACHE_SIZE, ttl=LISTING_COUNT_TTL)
+
+
+@subscribe_prompt_changes
+def _adjust_listing_counts(before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+    listing_counts.apply_change(before, after)
@@ -0,0 +1,424 @@
+"""
+大模型服务提供方模块
+统一封装Kimi（OpenAI兼容接口）和Gemini的调用：每个上游在应用生命周期内复用一个带连接池的客户端，
+避免每轮对话都重新建立TCP/TLS连接；同时按提供方记录调用次数、错误、超时和延迟分布，
+供 /admin/stats/cache 查看。测试和压测时可以把 KIMI_API_URL 指向 scripts/mock_openai_server.py
+"""
+
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+import aiohttp
+import google.generativeai as genai
+from fastapi import HTTPException, status
+
+from ..core.config import (
+    GEMINI_API_KEY,
+    GEMINI_CONTEXT_TOKENS,
+    GEMINI_MODEL,
+    GEMINI_TIMEOUT,
+    KIMI_API_KEY,
+    KIMI_API_URL,
+    KIMI_CONTEXT_TOKENS,
+    KIMI_HTTP_TIMEOUT,
+    KIMI_KEEPALIVE_TIMEOUT,
+    KIMI_MAX_CONNECTIONS,
+    KIMI_MODEL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderMetrics:
+    """单个提供方的调用统计，延迟分位数按最近若干次调用计算"""
+
+    def __init__(self, window: int = 512):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.in_flight = 0
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._first_token: Deque[float] = deque(maxlen=window)
+
+    def started(self):
+        self.requests += 1
+        self.in_flight += 1
+
+    def finished(self, elapsed: float, error: Optional[BaseException] = None):
+        self.in_flight -= 1
+        if error is None:
+            self._latencies.append(elapsed)
+        elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            self.cancelled += 1
+        else:
+            self.errors += 1
+            if isinstance(error, HTTPException) and error.status_code == status.HTTP_504_GATEWAY_TIMEOUT:
+                self.timeouts += 1
+
+    def first_token(self, elapsed: float):
+        self._first_token.append(elapsed)
+
+    @staticmethod
+    def _percentile(values: List[float], ratio: float) -> float:
+        if not values:
+            return 0.0
+        return round(values[min(int(len(values) * ratio), len(values) - 1)] * 1000, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        first_token = sorted(self._first_token)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "in_flight": self.in_flight,
+            "p50_ms": self._percentile(latencies, 0.5),
+            "p95_ms": self._percentile(latencies, 0.95),
+            "first_token_p50_ms": self._percentile(first_token, 0.5),
+            "first_token_p95_ms": self._percentile(first_token, 0.95),
+        }
+
+
+class LLMProvider(ABC):
+    """
+    提供方基类，子类实现 _complete 和 _stream
+    complete/stream 负责统一的指标记录，以及把未预期的异常转换为HTTP错误
+    """
+
+    def __init__(self, name: str, label: str, model: str, timeout: float, context_tokens: int):
+        self.name = name
+        # 错误信息中使用的显示名称
+        self.label = label
+        self.model = model
+        self.timeout = timeout
+        # 模型的上下文窗口大小（token数），用于裁剪对话历史
+        self.context_tokens = context_tokens
+        self.metrics = ProviderMetrics()
+
+    @property
+    @abstractmethod
+    def configured(self) -> bool:
+        """API密钥等配置是否齐全"""
+
+    def _timeout_error(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"{self.label}响应超时（超过{self.timeout:g}秒）"
+        )
+
+    def _failure(self, e: Exception) -> HTTPException:
+        if isinstance(e, HTTPException):
+            return e
+        if isinstance(e, asyncio.TimeoutError):
+            logger.error(f"调用{self.label} API超时")
+            return self._timeout_error()
+        logger.error(f"调用{self.label} API出错: {str(e)}")
+        return HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"{self.label}聊天处理失败: {str(e)}"
+        )
+
+    @abstractmethod
+    async def _complete(self, messages: List[Dict[str, str]]) -> str:
+        """调用API并返回完整回复"""
+
+    @abstractmethod
+    def _stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """调用API并逐段返回生成的文本"""
+
+    async def complete(self, messages: List[Dict[str, str]]) -> str:
+        """一次性返回完整回复"""
+        started_at = time.perf_counter()
+        self.metrics.started()
+        error: Optional[BaseException] = None
+        try:
+            return await self._complete(messages)
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            error = self._failure(e)
+            raise error
+        finally:
+            self.metrics.finished(time.perf_counter() - started_at, error)
+
+    async def stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """逐段返回生成的文本"""
+        started_at = time.perf_counter()
+        self.metrics.started()
+        error: Optional[BaseException] = None
+        first = True
+        try:
+            # 提前结束时立即关闭内部生成器，把连接归还连接池
+            async with aclosing(self._stream(messages)) as deltas:
+                async for delta in deltas:
+                    if first:
+                        self.metrics.first_token(time.perf_counter() - started_at)
+                        first = False
+                    yield delta
+        except (asyncio.CancelledError, GeneratorExit) as e:
+            # 客户端断开时生成器被关闭
+            error = e
+            raise
+        except Exception as e:
+            error = self._failure(e)
+            raise error
+        finally:
+            self.metrics.finished(time.perf_counter() - started_at, error)
+
+    async def aclose(self):
+        """释放连接等资源，在应用关闭时调用"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "configured": self.configured,
+            "context_tokens": self.context_tokens,
+            **self.metrics.stats(),
+        }
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """OpenAI兼容的 /chat/completions 接口（Kimi），共享一个aiohttp连接池"""
+
+    def __init__(self, name: str, label: str, api_url: str, api_key: str, model: str,
+                 timeout: float = 60.0, context_tokens: int = 8192, max_connections: int = 100,
+                 keepalive_timeout: float = 60.0, temperature: float = 0.7):
+        super().__init__(name, label, model, timeout, context_tokens)
+        self.api_url = api_url
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.temperature = temperature
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的HTTP会话（首次使用时创建）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}"
+                },
+            )
+        return self._session
+
+    def _payload(self, messages: List[Dict[str, str]], stream: bool) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            # 存储的消息上还有token数等附加字段，只发送接口需要的部分
+            "messages": [{"role": message["role"], "content": message["content"]} for message in messages],
+            "temperature": self.temperature,
+            "stream": stream
+        }
+
+    async def _raise_for_status(self, response: aiohttp.ClientResponse):
+        if response.status != 200:
+            error_text = await response.text()
+            logger.error(f"{self.label} API错误: {error_text}")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail=f"无法连接到{self.label} AI服务"
+            )
+
+    async def _complete(self, messages: List[Dict[str, str]]) -> str:
+        # 非流式调用限制整体耗时
+        timeout = aiohttp.ClientTimeout(total=self.timeout, connect=min(self.timeout, 10.0))
+        async with self._get_session().post(
+            self.api_url, json=self._payload(messages, False), timeout=timeout
+        ) as response:
+            await self._raise_for_status(response)
+            result = await response.json()
+            return result["choices"][0]["message"]["content"]
+
+    async def _stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        # 流式调用不限制整体耗时，只限制相邻两次读取之间的间隔
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=min(self.timeout, 10.0), sock_read=self.timeout)
+        async with self._get_session().post(
+            self.api_url, json=self._payload(messages, True), timeout=timeout
+        ) as response:
+            await self._raise_for_status(response)
+
+            # OpenAI兼容的SSE格式：每行 "data: {...}"，以 "data: [DONE]" 结束
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                choices = chunk.get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        # aiohttp没有公开的连接池统计接口，这里读取连接器内部的空闲连接表
+        idle = getattr(connector, "_conns", {}) if connector is not None else {}
+        stats["pool"] = {
+            "limit": self.max_connections,
+            "idle_connections": sum(len(conns) for conns in idle.values()),
+        }
+        return stats
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini，使用SDK的异步接口；SDK内部维护自己的gRPC/HTTP连接"""
+
+    # 按系统指令缓存的模型对象数量上限
+    MAX_CACHED_MODELS = 128
+
+    def __init__(self, api_key: str, model: str, timeout: float = 60.0, context_tokens: int = 32768):
+        super().__init__("gemini", "Gemini", model, timeout, context_tokens)
+        self.api_key = api_key
+        self._configured_sdk = False
+        # 系统指令 -> 模型对象（LRU），放在实例上，随实例一起释放
+        self._models: "OrderedDict[str, genai.GenerativeModel]" = OrderedDict()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _get_model(self, system_instruction: str) -> "genai.GenerativeModel":
+        """
+        获取Gemini模型对象，API密钥只配置一次，同一系统指令（即同一个Prompt）的模型对象复用
+        """
+        model = self._models.get(system_instruction)
+        if model is not None:
+            self._models.move_to_end(system_instruction)
+            return model
+        if not self._configured_sdk:
+            genai.configure(api_key=self.api_key)
+            self._configured_sdk = True
+        if system_instruction:
+            model = genai.GenerativeModel(
+                model_name=self.model,
+                system_instruction=system_instruction
+            )
+        else:
+            model = genai.GenerativeModel(self.model)
+        self._models[system_instruction] = model
+        if len(self._models) > self.MAX_CACHED_MODELS:
+            self._models.popitem(last=False)
+        return model
+
+    def _prepare(self, messages: List[Dict[str, str]]):
+        """把消息转换为Gemini格式，返回 (模型, 历史消息, 最后一条用户消息)"""
+        if not self.api_key:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Gemini API密钥未配置"
+            )
+
+        # 将消息格式转换为Gemini格式
+        gemini_messages = []
+        system_instruction = ""
+
+        for msg in messages:
+            if msg["role"] == "system":
+                system_instruction = msg["content"]
+            elif msg["role"] == "user":
+                gemini_messages.append({
+                    "role": "user",
+                    "parts": [msg["content"]]
+                })
+            elif msg["role"] == "assistant":
+                gemini_messages.append({
+                    "role": "model",
+                    "parts": [msg["content"]]
+                })
+
+        if not gemini_messages:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="没有有效的消息内容"
+            )
+
+        # 除最后一条以外的消息作为历史
+        return self._get_model(system_instruction), gemini_messages[:-1], gemini_messages[-1]["parts"][0]
+
+    def _send(self, messages: List[Dict[str, str]], stream: bool):
+        model, history, last_message = self._prepare(messages)
+        request_options = {"timeout": self.timeout}
+        if not history:
+            # 如果没有对话历史，直接发送消息
+            return model.generate_content_async(last_message, stream=stream, request_options=request_options)
+        # 如果有对话历史，使用chat功能
+        chat = model.start_chat(history=history)
+        return chat.send_message_async(last_message, stream=stream, request_options=request_options)
+
+    async def _complete(self, messages: List[Dict[str, str]]) -> str:
+        # 超时或请求被取消时一并取消上游调用
+        response = await asyncio.wait_for(self._send(messages, False), timeout=self.timeout)
+        return response.text
+
+    async def _stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        response = await asyncio.wait_for(self._send(messages, True), timeout=self.timeout)
+
+        # 相邻两段输出之间同样受超时限制
+        chunks = response.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+            except StopAsyncIteration:
+                break
+            # 被安全策略拦截等情况下分片没有文本
+            if chunk.parts:
+                yield chunk.text
+
+
+# 全局提供方实例
+kimi_provider = OpenAICompatibleProvider(
+    "kimi", "Kimi",
+    api_url=KIMI_API_URL,
+    api_key=KIMI_API_KEY,
+    model=KIMI_MODEL,
+    timeout=KIMI_HTTP_TIMEOUT,
+    context_tokens=KIMI_CONTEXT_TOKENS,
+    max_connections=KIMI_MAX_CONNECTIONS,
+    keepalive_timeout=KIMI_KEEPALIVE_TIMEOUT,
+)
+gemini_provider = GeminiProvider(
+    GEMINI_API_KEY, GEMINI_MODEL, timeout=GEMINI_TIMEOUT, context_tokens=GEMINI_CONTEXT_TOKENS
+)
+
+providers: Dict[str, LLMProvider] = {
+    kimi_provider.name: kimi_provider,
+    gemini_provider.name: gemini_provider,
+}
+
+
+async def close_providers():
+    """关闭所有提供方的连接池，在应用关闭时调用"""
+    for provider in providers.values():
+        await provider.aclose()
+
+
+def provider_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: provider.stats() for name, provider in providers.items()}
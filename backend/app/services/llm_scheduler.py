@@ -0,0 +1,200 @@
+"""
+大模型调用调度模块
+原先 /unified-chat 的并发不受任何限制，一波突发请求会同时向上游发起几百个调用，触发服务商限流。
+这里在每个提供方前面加一道闸门：
+- 同时进行的调用数不超过该提供方的并发上限，超出的请求排队等待
+- 排队按用户轮转（公平队列），同一用户连发多条不会挤占其他用户
+- 队列已满、单个用户排队过多或排队超时时尽早返回 503/429，而不是让请求一直挂着
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import HTTPException, status
+
+from ..core.config import (
+    GEMINI_MAX_CONCURRENCY,
+    KIMI_MAX_CONCURRENCY,
+    LLM_QUEUE_PER_USER,
+    LLM_QUEUE_SIZE,
+    LLM_QUEUE_TIMEOUT,
+)
+
+
+class Slot:
+    """一个调用名额，release 可以重复调用"""
+
+    def __init__(self, queue: "ProviderQueue"):
+        self._queue = queue
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._queue._release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class ProviderQueue:
+    """单个提供方的并发闸门和按用户轮转的等待队列"""
+
+    def __init__(self, name: str, max_concurrency: int = 16, max_queue: int = 64,
+                 max_queue_per_user: int = 2, queue_timeout: float = 10.0):
+        self.name = name
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        # 用户ID → 该用户等待中的请求；字典的顺序即轮转顺序
+        self._waiting: "OrderedDict[Any, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected_full = 0
+        self.rejected_user = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _grant(self, waited: float) -> Slot:
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return Slot(self)
+
+    def _remove_waiter(self, user_id: Any, future: asyncio.Future):
+        waiters = self._waiting.get(user_id)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        self._queued -= 1
+        if not waiters:
+            del self._waiting[user_id]
+
+    def _expire(self, user_id: Any, future: asyncio.Future):
+        if not future.done():
+            self._remove_waiter(user_id, future)
+            future.set_exception(asyncio.TimeoutError())
+
+    def _release(self):
+        """归还名额：有人排队时按用户轮转直接转交给下一个请求，否则空出名额"""
+        while self._waiting:
+            user_id, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            self._queued -= 1
+            if waiters:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    async def acquire(self, user_id: Any) -> Slot:
+        """获取调用名额，需要排队时等待；无法排队或排队超时时抛出HTTP错误"""
+        if self.active < self.max_concurrency and not self._waiting:
+            self.active += 1
+            return self._grant(0.0)
+
+        if self._queued >= self.max_queue:
+            self.rejected_full += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI服务繁忙，请稍后重试",
+                headers={"Retry-After": "5"},
+            )
+        waiters = self._waiting.get(user_id)
+        if waiters is not None and len(waiters) >= self.max_queue_per_user:
+            self.rejected_user += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="请求过于频繁，请等待之前的回复完成",
+                headers={"Retry-After": "2"},
+            )
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        self._queued += 1
+        self.queued_total += 1
+        self.max_queued = max(self.max_queued, self._queued)
+        timer = loop.call_later(self.queue_timeout, self._expire, user_id, future)
+        started_at = time.perf_counter()
+        try:
+            await future
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="AI服务繁忙，排队超时，请稍后重试",
+                headers={"Retry-After": "5"},
+            )
+        except asyncio.CancelledError:
+            # 请求在排队时被取消；如果名额恰好已经转交过来，需要归还
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release()
+            else:
+                self._remove_waiter(user_id, future)
+            raise
+        finally:
+            timer.cancel()
+        return self._grant(time.perf_counter() - started_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queue_depth": self._queued,
+            "max_queue_depth": self.max_queued,
+            "waiting_users": len(self._waiting),
+            "admitted": self.admitted,
+            "queued": self.queued_total,
+            "rejected_full": self.rejected_full,
+            "rejected_user": self.rejected_user,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+        }
+
+
+class LLMScheduler:
+    """按提供方分别调度"""
+
+    def __init__(self, queues: Dict[str, ProviderQueue]):
+        self._queues = queues
+
+    def queue(self, model_type: str) -> Optional[ProviderQueue]:
+        return self._queues.get(model_type)
+
+    async def acquire(self, model_type: str, user_id: Any) -> Slot:
+        return await self._queues[model_type].acquire(user_id)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: queue.stats() for name, queue in self._queues.items()}
+
+
+def _queue(name: str, max_concurrency: int) -> ProviderQueue:
+    return ProviderQueue(
+        name,
+        max_concurrency=max_concurrency,
+        max_queue=LLM_QUEUE_SIZE,
+        max_queue_per_user=LLM_QUEUE_PER_USER,
+        queue_timeout=LLM_QUEUE_TIMEOUT,
+    )
+
+
+# 全局调度器实例
+llm_scheduler = LLMScheduler({
+    "kimi": _queue("kimi", KIMI_MAX_CONCURRENCY),
+    "gemini": _queue("gemini", GEMINI_MAX_CONCURRENCY),
+})
@@ -0,0 +1,35 @@
+"""
+规范化响应格式
+对话消息、通知和评论列表的每一项原先都内嵌完整的用户信息，一个500条消息的对话会把同样的两个用户序列化1000次。
+传入 normalized=true 时，列表项只保留用户ID，引用到的用户去重后放在响应的 users 中（键为用户ID）。
+响应使用模块级预先构建的 TypeAdapter 直接从ORM对象校验并序列化为JSON字节，不再逐字段手工构造模型
+"""
+
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi import Response
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..models import models
+
+
+def collect_users(users: Iterable[Optional[models.User]]) -> Dict[int, models.User]:
+    """按ID去重已加载的用户"""
+    return {user.id: user for user in users if user is not None}
+
+
+async def load_users(db: AsyncSession, user_ids: Iterable[int]) -> Dict[int, models.User]:
+    """一次查询加载引用到的用户"""
+    ids = sorted(set(user_ids))
+    if not ids:
+        return {}
+    result = await db.execute(select(models.User).filter(models.User.id.in_(ids)))
+    return collect_users(result.scalars().all())
+
+
+def render(adapter: TypeAdapter, payload: Dict[str, Any]) -> Response:
+    """用预先构建的序列化器生成JSON响应，payload中可以直接包含ORM对象"""
+    body = adapter.dump_json(adapter.validate_python(payload, from_attributes=True))
+    return Response(content=body, media_type="application/json")
@@ -0,0 +1,138 @@
+"""
+Prompt列表的游标（keyset）分页
+游标对客户端不透明，内部记录排序方式以及上一页最后一条记录的排序键和ID，
+下一页用 WHERE (排序键, id) 越过上一页，代价与页码无关。
+排序列都不允许为空，排序和越过上一页都直接比较原始列，可以使用 (status, 排序列, id) 复合索引。
+私信的对话列表同样按 (时间, id) 倒序分页，共用游标的编解码
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+from ..models import models
+
+DEFAULT_SORT = "upload_time_desc"
+RELEVANCE_SORT = "relevance"
+
+
+class SortSpec(NamedTuple):
+    """排序方式：排序列、是否降序，以及游标中该列值的编解码方式"""
+    column: Any
+    descending: bool
+    is_datetime: bool = False
+
+
+PROMPT_SORTS: Dict[str, SortSpec] = {
+    "upload_time_desc": SortSpec(models.Prompt.created_at, True, is_datetime=True),
+    "upload_time_asc": SortSpec(models.Prompt.created_at, False, is_datetime=True),
+    "views_desc": SortSpec(models.Prompt.views, True),
+    "likes_desc": SortSpec(models.Prompt.likes, True),
+}
+
+
+def normalize_sort(sort_by: Optional[str]) -> str:
+    """未知的排序方式按默认排序（上传时间新到老）处理"""
+    if sort_by == RELEVANCE_SORT or sort_by in PROMPT_SORTS:
+        return sort_by
+    return DEFAULT_SORT
+
+
+def order_by_clauses(sort_by: str):
+    """排序子句，以id作为次级排序保证顺序稳定"""
+    spec = PROMPT_SORTS[sort_by]
+    if spec.descending:
+        return spec.column.desc(), models.Prompt.id.desc()
+    return spec.column.asc(), models.Prompt.id.asc()
+
+
+def encode_cursor(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str) -> Dict[str, Any]:
+    """解析游标并校验它与当前排序方式一致"""
+    invalid = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标")
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise invalid
+    if not isinstance(payload, dict) or payload.get("s") != sort_by:
+        raise invalid
+    return payload
+
+
+def cursor_after(prompt, sort_by: str) -> str:
+    """生成指向某条记录之后的游标"""
+    spec = PROMPT_SORTS[sort_by]
+    value = getattr(prompt, spec.column.key)
+    if spec.is_datetime:
+        value = value.isoformat()
+    return encode_cursor({"s": sort_by, "v": value, "i": prompt.id})
+
+
+def relevance_cursor(offset: int) -> str:
+    """相关度排序的结果来自检索索引，游标直接记录偏移量"""
+    return encode_cursor({"s": RELEVANCE_SORT, "o": offset})
+
+
+def relevance_offset(payload: Dict[str, Any]) -> int:
+    offset = payload.get("o")
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标")
+    return offset
+
+
+def keyset_position(payload: Dict[str, Any], sort_by: str) -> Tuple[Any, int]:
+    """游标中上一页最后一条记录的 (排序键, id)"""
+    spec = PROMPT_SORTS[sort_by]
+    value = payload.get("v")
+    last_id = payload.get("i")
+    try:
+        if spec.is_datetime:
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, int):
+            raise ValueError
+        if not isinstance(last_id, int):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标")
+    return value, last_id
+
+
+def keyset_filter(payload: Dict[str, Any], sort_by: str):
+    """把游标转换为越过上一页的过滤条件"""
+    spec = PROMPT_SORTS[sort_by]
+    value, last_id = keyset_position(payload, sort_by)
+    if spec.descending:
+        return or_(spec.column < value, and_(spec.column == value, models.Prompt.id < last_id))
+    return or_(spec.column > value, and_(spec.column == value, models.Prompt.id > last_id))
+
+
+def time_cursor(kind: str, value: datetime, row_id: int) -> str:
+    """按 (时间, id) 倒序分页的游标，kind 区分游标的用途"""
+    return encode_cursor({"s": kind, "v": value.isoformat(), "i": row_id})
+
+
+def decode_time_cursor(cursor: str, kind: str) -> Tuple[datetime, int]:
+    payload = decode_cursor(cursor, kind)
+    try:
+        value = datetime.fromisoformat(payload.get("v"))
+        row_id = payload.get("i")
+        if not isinstance(row_id, int):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="无效的分页游标")
+    return value, row_id
+
+
+def before_filter(time_column, id_column, value, row_id: int):
+    """倒序分页中越过上一页的过滤条件，value可以是时间值或返回时间的子查询"""
+    return or_(time_column < value, and_(time_column == value, id_column < row_id))
@@ -0,0 +1,107 @@
+"""
+密码哈希线程池
+bcrypt每次计算需要几十毫秒，直接在async接口中调用会阻塞整个事件循环。
+这里把哈希和校验放到有上限的线程池中执行（bcrypt计算期间会释放GIL），
+排队的任务过多时直接拒绝，避免登录洪峰拖垮其他请求
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from ..core.config import PASSWORD_HASH_MAX_QUEUE, PASSWORD_HASH_WORKERS
+
+
+class PasswordHasher:
+    """在线程池中执行bcrypt的密码哈希器"""
+
+    def __init__(self, context: CryptContext, workers: int = 4, max_queue: int = 64):
+        self.context = context
+        self.workers = max(workers, 1)
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 已提交但还没有开始执行的任务数，以及正在执行的任务数
+        self._queued = 0
+        self._running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def _on_start(self, waited: float):
+        self._queued -= 1
+        self._running += 1
+        self.total_wait += waited
+
+    def _on_finish(self, elapsed: float):
+        self._running -= 1
+        self.completed += 1
+        self.total_run += elapsed
+
+    async def _run(self, func: Callable, *args) -> Any:
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="服务器繁忙，请稍后重试",
+                headers={"Retry-After": "1"},
+            )
+        loop = asyncio.get_running_loop()
+        submitted_at = time.perf_counter()
+
+        def job():
+            # 计数只在事件循环线程中修改；请求被取消时任务仍会执行完，计数依然准确
+            started_at = time.perf_counter()
+            loop.call_soon_threadsafe(self._on_start, started_at - submitted_at)
+            try:
+                return func(*args)
+            finally:
+                loop.call_soon_threadsafe(self._on_finish, time.perf_counter() - started_at)
+
+        self._queued += 1
+        self.max_queued = max(self.max_queued, self._queued)
+        return await loop.run_in_executor(self._get_executor(), job)
+
+    async def hash(self, password: str) -> str:
+        """计算密码哈希"""
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """校验密码"""
+        return await self._run(self.context.verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        """关闭线程池，在应用关闭时调用"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": self._running,
+            "queue_depth": self._queued,
+            "max_queue_depth": self.max_queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.completed * 1000, 2) if self.completed else 0.0,
+            "avg_run_ms": round(self.total_run / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+
+# 全局哈希器实例
+password_hasher = PasswordHasher(
+    CryptContext(schemes=["bcrypt"], deprecated="auto"),
+    workers=PASSWORD_HASH_WORKERS,
+    max_queue=PASSWORD_HASH_MAX_QUEUE,
+)
@@ -0,0 +1,99 @@
+"""
+登录用户缓存模块
+get_current_user 几乎被所有路由依赖，每次请求都要解码JWT并按用户名查询用户。
+这里缓存两层映射：令牌 → 用户ID（令牌签名只校验一次，缓存到令牌过期为止），
+以及 用户ID → 用户字段（TTL + LRU），命中时既不解码也不查库。
+用户的管理员标记或资料变化时需要调用 invalidate_user 让缓存失效
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from ..core.config import PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL
+from ..models import models
+
+_user_columns = [column.key for column in models.User.__table__.columns]
+
+
+class PrincipalCache:
+    """登录用户缓存"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # 令牌 → (用户ID, 令牌过期时间戳)
+        self._tokens: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        # 用户ID → (用户字段, 缓存过期时间)
+        self._users: "OrderedDict[int, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def user_id_for_token(self, token: str) -> Optional[int]:
+        """已验证过的令牌直接返回用户ID，未知或已过期的令牌返回None"""
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+        user_id, token_expires_at = entry
+        if token_expires_at <= time.time():
+            del self._tokens[token]
+            return None
+        self._tokens.move_to_end(token)
+        return user_id
+
+    def get_user(self, user_id: int) -> Optional[models.User]:
+        """
+        返回缓存的用户，每次都构造一个新的已脱离会话的User对象，
+        请求之间不共享可变状态，也不会被误当作新对象插入数据库
+        """
+        entry = self._users.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._users[user_id]
+            self.misses += 1
+            return None
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        user = models.User(**entry[0])
+        make_transient_to_detached(user)
+        return user
+
+    def put(self, token: str, token_expires_at: float, user: models.User):
+        """记录已验证的令牌及其对应的用户"""
+        self._tokens[token] = (user.id, token_expires_at)
+        self._tokens.move_to_end(token)
+        while len(self._tokens) > self.max_entries:
+            self._tokens.popitem(last=False)
+        self.put_user(user)
+
+    def put_user(self, user: models.User):
+        """缓存从数据库加载的用户字段"""
+        values = {key: getattr(user, key) for key in _user_columns}
+        self._users[user.id] = (values, time.monotonic() + self.ttl)
+        self._users.move_to_end(user.id)
+        while len(self._users) > self.max_entries:
+            self._users.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        """用户信息（管理员标记、头像、邮箱等）变化后调用，下次请求按主键重新加载"""
+        self._users.pop(user_id, None)
+
+    def clear(self):
+        self._tokens.clear()
+        self._users.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "tokens": len(self._tokens),
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# 全局缓存实例
+principal_cache = PrincipalCache(max_entries=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
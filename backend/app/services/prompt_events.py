@@ -0,0 +1,71 @@
+"""
+Prompt变更事件分发模块
+审核、编辑、撤回、删除Prompt后，把变更前后的快照广播给各个内存索引/缓存，
+让它们增量更新，而不是每次都回数据库全量重建
+"""
+
+import logging
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PromptSnapshot(NamedTuple):
+    """Prompt在某一时刻的只读快照，只包含内存索引关心的字段"""
+    id: int
+    status: int
+    is_r18: int
+    title: str
+    description: Optional[str]
+    content: str
+    tags: Tuple[str, ...]
+    created_at: Optional[object] = None
+
+    @property
+    def is_public(self) -> bool:
+        """是否在市场中可见（已通过审核）"""
+        return self.status == 1
+
+
+def snapshot_prompt(prompt) -> PromptSnapshot:
+    """
+    从ORM对象生成快照
+    调用前需要确保prompt.tags已经加载，避免在异步会话中触发懒加载
+    """
+    return PromptSnapshot(
+        id=prompt.id,
+        status=prompt.status or 0,
+        is_r18=prompt.is_r18 or 0,
+        title=prompt.title or "",
+        description=prompt.description,
+        content=prompt.content or "",
+        tags=tuple(tag.name for tag in prompt.tags),
+        created_at=prompt.created_at,
+    )
+
+
+PromptChangeListener = Callable[[Optional[PromptSnapshot], Optional[PromptSnapshot]], None]
+
+_change_listeners: List[PromptChangeListener] = []
+
+
+def subscribe_prompt_changes(listener: PromptChangeListener) -> PromptChangeListener:
+    """注册Prompt变更监听器，可作为装饰器使用"""
+    _change_listeners.append(listener)
+    return listener
+
+
+def publish_prompt_change(before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+    """
+    广播Prompt变更，应在数据库提交成功之后调用
+    before为None表示新建，after为None表示删除
+    """
+    if before is None and after is None:
+        return
+    for listener in _change_listeners:
+        try:
+            listener(before, after)
+        except Exception as e:
+            # 监听器失败不能影响主业务流程
+            prompt_id = (after or before).id
+            logger.error(f"处理Prompt变更事件失败 (prompt_id={prompt_id}): {e}")
@@ -0,0 +1,185 @@
+"""
+消息推送模块
+原先前端每个打开的标签页每30秒轮询一次未读数，私信页面还要反复拉取对话列表和摘要，
+后台负载随在线人数增长而与实际的消息量无关。这里改为由服务端通过WebSocket推送：
+- 每个连接对应一个有界队列，PushHub 按用户ID把事件放入该用户所有连接的队列（进程内扇出）
+- 事件先发布到 pub/sub 后端，再由后端交给每个进程的 PushHub 分发：
+  memory 后端只在当前进程内传递，database 后端经由 push_events 表在多个进程之间传递（见 push_db.py）
+- 连接空闲时定时发送心跳，及时发现已经断开的连接，也避免反向代理因空闲关闭连接
+
+事件格式: {"type": "message" | "unread" | "notification" | "ping", ...}
+"""
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from ..core.config import (
+    PUSH_BACKEND,
+    PUSH_EVENT_RETENTION,
+    PUSH_HEARTBEAT_INTERVAL,
+    PUSH_POLL_INTERVAL,
+    PUSH_QUEUE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# 分发函数: (接收者ID列表，None表示所有在线用户, 事件)
+Deliver = Callable[[Optional[List[int]], Dict[str, Any]], None]
+
+
+class PubSubBackend(ABC):
+    """pub/sub 后端的接口：publish 发布的事件最终交给每个进程通过 bind 注册的分发函数"""
+
+    backend = ""
+    # 事件是否会传递到其他进程；为False时只需要关心连接到本进程的用户
+    cross_process = False
+
+    def __init__(self):
+        self._deliver: Deliver = lambda user_ids, event: None
+
+    def bind(self, deliver: Deliver):
+        self._deliver = deliver
+
+    @abstractmethod
+    async def publish(self, user_ids: Optional[List[int]], event: Dict[str, Any]):
+        """发布事件，user_ids为None表示所有在线用户"""
+
+    def start(self):
+        """启动后台任务，在应用启动时调用"""
+
+    async def stop(self):
+        """停止后台任务，在应用关闭时调用"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend}
+
+
+class MemoryPubSub(PubSubBackend):
+    """进程内的 pub/sub，发布即分发"""
+
+    backend = "memory"
+
+    async def publish(self, user_ids: Optional[List[int]], event: Dict[str, Any]):
+        self._deliver(user_ids, event)
+
+
+class PushConnection:
+    """一个推送连接的事件队列，积压过多时丢弃最早的事件，慢速客户端不会拖住发布方"""
+
+    def __init__(self, user_id: int, queue_size: int = 100):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max(queue_size, 1))
+        self.dropped = 0
+
+    def put(self, event: Dict[str, Any]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class PushHub:
+    """进程内的推送中心，维护用户ID到连接的映射"""
+
+    def __init__(self, backend: PubSubBackend, queue_size: int = 100, heartbeat_interval: float = 25.0):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.heartbeat_interval = heartbeat_interval
+        self._connections: Dict[int, Set[PushConnection]] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.total_connections = 0
+        backend.bind(self._deliver)
+
+    def connect(self, user_id: int) -> PushConnection:
+        connection = PushConnection(user_id, self.queue_size)
+        self._connections.setdefault(user_id, set()).add(connection)
+        self.total_connections += 1
+        return connection
+
+    def disconnect(self, connection: PushConnection):
+        self.dropped += connection.dropped
+        connections = self._connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self._connections[connection.user_id]
+
+    def wants(self, user_id: int) -> bool:
+        """事件可能被该用户收到时返回True，用于在没有人接收时省去准备事件的开销"""
+        return self.backend.cross_process or user_id in self._connections
+
+    def _deliver(self, user_ids: Optional[List[int]], event: Dict[str, Any]):
+        if user_ids is None:
+            targets = [connection for connections in self._connections.values() for connection in connections]
+        else:
+            targets = [
+                connection
+                for user_id in user_ids
+                for connection in self._connections.get(user_id, ())
+            ]
+        for connection in targets:
+            connection.put(event)
+        self.delivered += len(targets)
+
+    async def publish(self, user_ids: Optional[Iterable[int]], event: Dict[str, Any]):
+        """
+        向指定用户推送事件，user_ids为None时推送给所有在线用户
+        应在数据库提交成功之后调用；推送只是提示，失败时记录日志，不影响业务请求
+        """
+        self.published += 1
+        try:
+            await self.backend.publish(None if user_ids is None else list(user_ids), event)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"推送事件失败: {e}")
+
+    async def next_event(self, connection: PushConnection) -> Dict[str, Any]:
+        """等待下一个事件，空闲超过心跳间隔时返回心跳"""
+        try:
+            return await asyncio.wait_for(connection.queue.get(), self.heartbeat_interval)
+        except asyncio.TimeoutError:
+            return {"type": "ping"}
+
+    def start(self):
+        self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.backend.stats(),
+            "online_users": len(self._connections),
+            "connections": sum(len(connections) for connections in self._connections.values()),
+            "total_connections": self.total_connections,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped + sum(
+                connection.dropped for connections in self._connections.values() for connection in connections
+            ),
+            "failed": self.failed,
+        }
+
+
+def create_pubsub(backend: str = "memory") -> PubSubBackend:
+    """按配置创建 pub/sub 后端"""
+    if backend == "database":
+        from .push_db import DatabasePubSub
+
+        return DatabasePubSub(poll_interval=PUSH_POLL_INTERVAL, retention=PUSH_EVENT_RETENTION)
+    if backend != "memory":
+        logger.warning(f"未知的推送后端 {backend}，改用进程内推送")
+    return MemoryPubSub()
+
+
+# 全局推送中心实例
+push_hub = PushHub(
+    create_pubsub(PUSH_BACKEND),
+    queue_size=PUSH_QUEUE_SIZE,
+    heartbeat_interval=PUSH_HEARTBEAT_INTERVAL,
+)
@@ -0,0 +1,185 @@
+"""
+数据库 pub/sub 后端
+发布事件时写入 push_events 表（发给所有在线用户的事件只写一行），
+每个进程的后台任务按自增ID定时拉取新事件，交给本进程的 PushHub 分发。
+多个进程并发写入时自增ID不一定按顺序提交，拉取时跳过的ID会作为空洞记录下来，
+在一段时间内每轮补查，晚提交的事件因此不会被漏掉。
+轮询的代价是每个进程每个间隔一次主键范围查询，与在线人数无关；已分发的事件保留一段时间后清理
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.future import select
+
+from ..core.database import get_db_session
+from ..models import models
+from .push import PubSubBackend
+
+logger = logging.getLogger(__name__)
+
+_events_table = models.PushEvent.__table__
+
+
+class DatabasePubSub(PubSubBackend):
+    """经由 push_events 表在多个进程之间传递事件"""
+
+    backend = "database"
+    cross_process = True
+    # 每次最多拉取的事件数，积压更多时在下一轮继续拉取
+    BATCH_SIZE = 500
+    # 空洞ID的补查时长（秒），超过后视为回滚或已清理的ID不再等待
+    GAP_TIMEOUT = 10.0
+    # 最多同时跟踪的空洞ID数，超出时放弃最早的空洞
+    MAX_GAPS = 5000
+
+    def __init__(self, poll_interval: float = 0.5, retention: float = 300, purge_interval: float = 60):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.purge_interval = purge_interval
+        # 本进程已经分发到的事件ID，启动后第一次拉取时从当前最大ID开始
+        self._last_id: Optional[int] = None
+        # 空洞ID → 发现时间，这些ID小于 _last_id 但还没有读到
+        self._gaps: Dict[int, float] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.polled = 0
+        self.failed_polls = 0
+        self.purged = 0
+        self.late_events = 0
+        self.abandoned_gaps = 0
+
+    async def publish(self, user_ids: Optional[List[int]], event: Dict[str, Any]):
+        payload = json.dumps(event, ensure_ascii=False, default=str)
+        now = datetime.now()
+        if user_ids is None:
+            rows = [{"user_id": None, "payload": payload, "created_at": now}]
+        else:
+            rows = [{"user_id": user_id, "payload": payload, "created_at": now} for user_id in user_ids]
+        if not rows:
+            return
+        async with get_db_session() as db:
+            await db.execute(insert(_events_table), rows)
+            await db.commit()
+        self.written += len(rows)
+
+    async def poll(self) -> int:
+        """拉取并分发新事件（包括之前跳过的空洞ID中晚提交的事件），返回分发的事件数"""
+        self._expire_gaps()
+        async with get_db_session() as db:
+            if self._last_id is None:
+                self._last_id = await db.scalar(select(func.max(_events_table.c.id))) or 0
+                return 0
+            late_rows = []
+            if self._gaps:
+                result = await db.execute(
+                    select(_events_table.c.id, _events_table.c.user_id, _events_table.c.payload)
+                    .where(_events_table.c.id.in_(list(self._gaps)))
+                    .order_by(_events_table.c.id)
+                )
+                late_rows = result.all()
+            result = await db.execute(
+                select(_events_table.c.id, _events_table.c.user_id, _events_table.c.payload)
+                .where(_events_table.c.id > self._last_id)
+                .order_by(_events_table.c.id)
+                .limit(self.BATCH_SIZE)
+            )
+            rows = result.all()
+        for event_id, _, _ in late_rows:
+            self._gaps.pop(event_id, None)
+        self.late_events += len(late_rows)
+        now = time.monotonic()
+        for event_id, _, _ in rows:
+            first_missing = max(self._last_id + 1, event_id - self.MAX_GAPS)
+            self.abandoned_gaps += first_missing - self._last_id - 1
+            for missing_id in range(first_missing, event_id):
+                self._gaps[missing_id] = now
+            self._last_id = event_id
+        self._trim_gaps()
+        for _, user_id, payload in list(late_rows) + list(rows):
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                continue
+            self._deliver(None if user_id is None else [user_id], event)
+        self.polled += len(late_rows) + len(rows)
+        return len(rows)
+
+    def _expire_gaps(self):
+        deadline = time.monotonic() - self.GAP_TIMEOUT
+        expired = [event_id for event_id, noticed_at in self._gaps.items() if noticed_at < deadline]
+        for event_id in expired:
+            del self._gaps[event_id]
+        self.abandoned_gaps += len(expired)
+
+    def _trim_gaps(self):
+        if len(self._gaps) <= self.MAX_GAPS:
+            return
+        # 字典按插入顺序保存，最早插入的就是最早发现的空洞
+        overflow = len(self._gaps) - self.MAX_GAPS
+        for event_id in list(self._gaps)[:overflow]:
+            del self._gaps[event_id]
+        self.abandoned_gaps += overflow
+
+    async def purge_expired(self) -> int:
+        """删除超过保留时长的事件"""
+        async with get_db_session() as db:
+            result = await db.execute(
+                delete(_events_table).where(
+                    _events_table.c.created_at < datetime.now() - timedelta(seconds=self.retention)
+                )
+            )
+            await db.commit()
+        self.purged += result.rowcount or 0
+        return result.rowcount or 0
+
+    async def _run_periodically(self):
+        since_purge = 0.0
+        while True:
+            try:
+                # 积压较多时不等待，直接拉取下一批
+                if await self.poll() < self.BATCH_SIZE:
+                    await asyncio.sleep(self.poll_interval)
+            except Exception as e:
+                self.failed_polls += 1
+                logger.error(f"拉取推送事件失败: {e}")
+                await asyncio.sleep(self.poll_interval)
+            since_purge += self.poll_interval
+            if since_purge >= self.purge_interval:
+                since_purge = 0.0
+                try:
+                    await self.purge_expired()
+                except Exception as e:
+                    logger.error(f"清理推送事件失败: {e}")
+
+    def start(self):
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.get_running_loop().create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "last_event_id": self._last_id,
+            "pending_gaps": len(self._gaps),
+            "late_events": self.late_events,
+            "abandoned_gaps": self.abandoned_gaps,
+            "written": self.written,
+            "polled": self.polled,
+            "failed_polls": self.failed_polls,
+            "purged": self.purged,
+        }
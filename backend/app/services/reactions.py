@@ -0,0 +1,135 @@
+"""
+Prompt点赞/点踩模块
+每个用户对每个Prompt只保留一条记录（点赞或点踩），重复操作不会重复计数；
+prompts表上的 likes/dislikes 计数用SQL原子自增维护，避免并发下丢失更新。
+表态记录的修改带上读到的旧表态作为条件，只有修改成功时才调整计数，
+同一用户的并发请求中只有一个会生效
+"""
+
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..models import models
+from .response_cache import listing_response_cache
+
+LIKE = 1
+DISLIKE = -1
+
+
+class ReactionState(NamedTuple):
+    """操作后的计数和当前用户的表态"""
+    likes: int
+    dislikes: int
+    reaction: Optional[int]
+
+
+def _counter_delta(old: Optional[int], new: Optional[int]) -> Dict[str, int]:
+    """表态从old变为new时likes/dislikes需要的增量"""
+    delta = {"likes": 0, "dislikes": 0}
+    for value, sign in ((old, -1), (new, 1)):
+        if value == LIKE:
+            delta["likes"] += sign
+        elif value == DISLIKE:
+            delta["dislikes"] += sign
+    return delta
+
+
+async def _current_reaction(db: AsyncSession, user_id: int, prompt_id: int) -> Optional[models.PromptReaction]:
+    result = await db.execute(
+        select(models.PromptReaction).filter(
+            models.PromptReaction.user_id == user_id,
+            models.PromptReaction.prompt_id == prompt_id
+        )
+    )
+    return result.scalars().first()
+
+
+async def _read_state(db: AsyncSession, prompt_id: int, reaction: Optional[int]) -> ReactionState:
+    result = await db.execute(
+        select(models.Prompt.likes, models.Prompt.dislikes).filter(models.Prompt.id == prompt_id)
+    )
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Prompt not found")
+    return ReactionState(likes=row.likes or 0, dislikes=row.dislikes or 0, reaction=reaction)
+
+
+async def _state_after_conflict(db: AsyncSession, user_id: int, prompt_id: int) -> ReactionState:
+    """同一用户的并发请求先修改了表态：放弃本次修改，返回当前的状态"""
+    await db.rollback()
+    existing = await _current_reaction(db, user_id, prompt_id)
+    return await _read_state(db, prompt_id, existing.reaction if existing else None)
+
+
+async def set_reaction(db: AsyncSession, user_id: int, prompt_id: int, reaction: Optional[int]) -> ReactionState:
+    """
+    设置用户对Prompt的表态，reaction为None表示取消
+    只能对已通过审核的Prompt表态；与当前表态相同时不做任何修改
+    """
+    existing = await _current_reaction(db, user_id, prompt_id)
+    old = existing.reaction if existing else None
+    if old == reaction:
+        return await _read_state(db, prompt_id, reaction)
+
+    # 先修改表态记录，以读到的旧表态为条件：受影响行数为0说明并发请求已经修改过，计数不能再调整
+    reactions_table = models.PromptReaction.__table__
+    matches_old = (
+        (reactions_table.c.user_id == user_id) &
+        (reactions_table.c.prompt_id == prompt_id) &
+        (reactions_table.c.reaction == old)
+    )
+    if existing is None:
+        try:
+            await db.execute(insert(reactions_table).values(user_id=user_id, prompt_id=prompt_id, reaction=reaction))
+        except IntegrityError:
+            return await _state_after_conflict(db, user_id, prompt_id)
+    else:
+        if reaction is None:
+            result = await db.execute(delete(reactions_table).where(matches_old))
+        else:
+            result = await db.execute(update(reactions_table).where(matches_old).values(reaction=reaction))
+        if result.rowcount != 1:
+            return await _state_after_conflict(db, user_id, prompt_id)
+
+    # 再原子更新计数，受影响行数为0说明prompt不存在或未通过审核
+    delta = _counter_delta(old, reaction)
+    result = await db.execute(
+        update(models.Prompt)
+        .where(models.Prompt.id == prompt_id, models.Prompt.status == 1)
+        .values(
+            likes=models.Prompt.likes + delta["likes"],
+            dislikes=models.Prompt.dislikes + delta["dislikes"]
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Prompt not found or not approved")
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        # 同一用户的并发请求已经写入了表态，本次计数变更随事务一起回滚
+        return await _state_after_conflict(db, user_id, prompt_id)
+
+    listing_response_cache.invalidate_prompt(prompt_id)
+    return await _read_state(db, prompt_id, reaction)
+
+
+async def get_user_reactions(db: AsyncSession, user_id: int, prompt_ids: Iterable[int]) -> Dict[int, int]:
+    """一次查询获取用户对一组Prompt的表态，没有表态的Prompt不出现在结果中"""
+    prompt_ids = list(prompt_ids)
+    if not prompt_ids:
+        return {}
+    result = await db.execute(
+        select(models.PromptReaction.prompt_id, models.PromptReaction.reaction).filter(
+            models.PromptReaction.user_id == user_id,
+            models.PromptReaction.prompt_id.in_(prompt_ids)
+        )
+    )
+    return {prompt_id: reaction for prompt_id, reaction in result.fetchall()}
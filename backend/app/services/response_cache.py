@@ -0,0 +1,157 @@
+"""
+热门公开列表页的响应缓存
+缓存默认排序、无搜索条件的前几页列表序列化后的响应字节，命中时跳过查询和Pydantic序列化。
+缓存项记录了页面中包含的prompt_id和页尾位置，Prompt变更或点赞时只让受影响的页面失效
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, NamedTuple, Optional, Tuple
+
+from ..core.config import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL
+from .prompt_events import PromptSnapshot, subscribe_prompt_changes
+
+
+class _CachedPage(NamedTuple):
+    body: bytes
+    expires_at: float
+    is_r18: Optional[int]
+    tag: Optional[str]
+    prompt_ids: frozenset
+    # 页尾记录的 (created_at, id)；页面未满时为None，表示该筛选条件下的任何新增/移除都会影响它
+    boundary: Optional[Tuple[Any, int]]
+    # 响应中是否包含总数，包含时该筛选条件下的任何新增/移除都会影响它
+    has_total: bool
+
+
+def _visible_in(snapshot: Optional[PromptSnapshot], is_r18: Optional[int], tag: Optional[str]) -> bool:
+    if snapshot is None or not snapshot.is_public:
+        return False
+    if is_r18 is not None and snapshot.is_r18 != is_r18:
+        return False
+    if tag is not None and tag not in snapshot.tags:
+        return False
+    return True
+
+
+class ListingResponseCache:
+    """按上传时间倒序排列的列表页响应缓存（TTL + LRU）"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, _CachedPage]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        # 每次失效都会递增，用于丢弃在失效之前开始查询、之后才写回的响应
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.body
+
+    def put(
+        self,
+        key: Hashable,
+        body: bytes,
+        prompts: Iterable,
+        page_size: int,
+        generation: int,
+        is_r18: Optional[int] = None,
+        tag: Optional[str] = None,
+        has_total: bool = False,
+    ):
+        """
+        缓存一页响应，prompts为该页按顺序排列的ORM对象
+        generation应为开始查询前读取的值，期间如有数据变化则放弃写入
+        """
+        if generation != self.generation:
+            return
+        prompts = list(prompts)
+        boundary = None
+        if len(prompts) >= page_size and prompts[-1].created_at is not None:
+            boundary = (prompts[-1].created_at, prompts[-1].id)
+        self._entries[key] = _CachedPage(
+            body=body,
+            expires_at=time.monotonic() + self.ttl,
+            is_r18=is_r18,
+            tag=tag,
+            prompt_ids=frozenset(prompt.id for prompt in prompts),
+            boundary=boundary,
+            has_total=has_total,
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _drop(self, key: Hashable):
+        del self._entries[key]
+        self.invalidations += 1
+
+    def invalidate_prompt(self, prompt_id: int):
+        """点赞等只影响单个Prompt展示内容的变化：只让包含该Prompt的页面失效"""
+        self.generation += 1
+        for key, entry in list(self._entries.items()):
+            if prompt_id in entry.prompt_ids:
+                self._drop(key)
+
+    @staticmethod
+    def _shifts(entry: _CachedPage, snapshot: PromptSnapshot) -> bool:
+        """新增/移除该Prompt是否会让页面内容发生位移"""
+        if entry.has_total or entry.boundary is None or snapshot.created_at is None:
+            return True
+        # 排在页尾之前（或就是页尾）的记录变化会让本页内容整体移动
+        return (snapshot.created_at, snapshot.id) >= entry.boundary
+
+    def apply_change(self, before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+        """根据Prompt变更让受影响的页面失效"""
+        self.generation += 1
+        prompt_id = (after or before).id
+        for key, entry in list(self._entries.items()):
+            if prompt_id in entry.prompt_ids:
+                self._drop(key)
+                continue
+            was_visible = _visible_in(before, entry.is_r18, entry.tag)
+            is_visible = _visible_in(after, entry.is_r18, entry.tag)
+            if was_visible == is_visible:
+                # 不在本页且可见性没有变化，不会影响本页
+                continue
+            if self._shifts(entry, after if is_visible else before):
+                self._drop(key)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
+
+
+# 全局缓存实例
+listing_response_cache = ListingResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL,
+)
+
+
+@subscribe_prompt_changes
+def _invalidate_listing_pages(before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+    listing_response_cache.apply_change(before, after)
@@ -0,0 +1,371 @@
+"""
+Prompt全文检索模块
+在内存中维护已通过审核的Prompt的倒排索引（标题、描述、标签，可选正文），
+替代 ilike '%q%' 的全表扫描。中文等CJK文本按单字+二元组切分，英文按单词切分；
+英文查询词除前缀外也匹配单词中间的子串（例如 gpt 命中 chatgpt），与原先的模糊查询一致，
+子串命中的得分低于前缀命中
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from ..core.config import SEARCH_INDEX_CONTENT, SEARCH_INDEX_REFRESH_INTERVAL
+from ..core.database import get_db_session
+from ..models import models
+from .prompt_events import PromptSnapshot, snapshot_prompt, subscribe_prompt_changes
+
+logger = logging.getLogger(__name__)
+
+# 各字段的权重：标题命中最重要，正文最弱
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "tags": 2.5,
+    "description": 1.5,
+    "content": 0.5,
+}
+
+# 索引内支持的排序方式：相关度、上传时间新到老、上传时间老到新
+SORT_RELEVANCE = "relevance"
+SORT_NEWEST = "newest"
+SORT_OLDEST = "oldest"
+
+# 英文查询词至少这么长时才匹配单词中间的子串，更短的词只做前缀匹配
+MIN_INFIX_LENGTH = 2
+# 子串命中（不是前缀）时的得分系数
+INFIX_MATCH_WEIGHT = 0.5
+
+# CJK统一表意文字、日文假名、韩文音节
+_CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(f"([{_CJK_RANGES}]+)|([a-z0-9]+)")
+
+
+def _normalize(text: str) -> str:
+    """全角转半角并转为小写"""
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    建索引时使用的分词
+    CJK连续片段输出单字和相邻二元组，英文/数字输出整词
+    """
+    tokens = []
+    for cjk, word in _TOKEN_PATTERN.findall(_normalize(text)):
+        if cjk:
+            tokens.extend(cjk)
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def tokenize_query(text: str) -> List[str]:
+    """
+    查询时使用的分词
+    CJK片段只取二元组（单字片段取单字），所有二元组同时命中近似于子串匹配
+    """
+    tokens = []
+    for cjk, word in _TOKEN_PATTERN.findall(_normalize(text)):
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    # 去重但保持顺序
+    return list(dict.fromkeys(tokens))
+
+
+def _is_latin(token: str) -> bool:
+    return token.isascii()
+
+
+class SearchResult(NamedTuple):
+    """检索结果：排好序的prompt_id列表（只包含请求的一页）和命中总数"""
+    prompt_ids: List[int]
+    total: int
+
+
+class _IndexedDoc(NamedTuple):
+    is_r18: int
+    tags: Set[str]
+    created_at: Optional[object]
+    weights: Dict[str, float]
+
+
+class PromptSearchIndex:
+    """
+    已通过审核的Prompt的内存倒排索引
+    本进程内的变更增量更新；其他进程的变更收不到，由定时全量重建兜底
+    """
+
+    def __init__(self, index_content: bool = False, refresh_interval: float = 300.0):
+        self.index_content = index_content
+        self.refresh_interval = refresh_interval
+        self.ready = False
+        # 重建期间收到的增量变更，重建完成后重新应用
+        self._replay: Optional[List[Tuple[Optional[PromptSnapshot], Optional[PromptSnapshot]]]] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.rebuilds = 0
+        self._docs: Dict[int, _IndexedDoc] = {}
+        # token -> {prompt_id: 字段加权词频}
+        self._postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        # 英文词表（有序），用于前缀匹配
+        self._latin_vocab: List[str] = []
+        # 英文词的 (真后缀, 词) 有序数组，用于匹配单词中间的子串
+        self._latin_suffixes: List[Tuple[str, str]] = []
+        # 全量重建期间先追加，重建结束后统一排序
+        self._bulk_loading = False
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _doc_weights(self, snapshot: PromptSnapshot) -> Dict[str, float]:
+        fields = {
+            "title": snapshot.title,
+            "description": snapshot.description or "",
+            "tags": " ".join(snapshot.tags),
+        }
+        if self.index_content:
+            fields["content"] = snapshot.content
+
+        weights: Dict[str, float] = defaultdict(float)
+        for field, text in fields.items():
+            for token, count in Counter(tokenize(text)).items():
+                # 词频取对数，避免长文本里的重复词主导排序
+                weights[token] += FIELD_WEIGHTS[field] * (1.0 + math.log(count))
+        return weights
+
+    def upsert(self, snapshot: PromptSnapshot):
+        """添加或更新一个Prompt；未通过审核的Prompt会被移出索引"""
+        if not snapshot.is_public:
+            self.remove(snapshot.id)
+            return
+
+        self.remove(snapshot.id)
+        weights = self._doc_weights(snapshot)
+        for token, weight in weights.items():
+            posting = self._postings[token]
+            if not posting and _is_latin(token):
+                self._add_latin(token)
+            posting[snapshot.id] = weight
+        self._docs[snapshot.id] = _IndexedDoc(
+            is_r18=snapshot.is_r18,
+            tags=set(snapshot.tags),
+            created_at=snapshot.created_at,
+            weights=weights,
+        )
+
+    def remove(self, prompt_id: int):
+        """从索引中移除一个Prompt（不存在时忽略）"""
+        doc = self._docs.pop(prompt_id, None)
+        if doc is None:
+            return
+        for token in doc.weights:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(prompt_id, None)
+            if not posting:
+                del self._postings[token]
+                if _is_latin(token):
+                    self._remove_latin(token)
+
+    @staticmethod
+    def _suffixes(token: str) -> List[Tuple[str, str]]:
+        return [(token[i:], token) for i in range(1, len(token) - MIN_INFIX_LENGTH + 1)]
+
+    def _add_latin(self, token: str):
+        if self._bulk_loading:
+            self._latin_vocab.append(token)
+            self._latin_suffixes.extend(self._suffixes(token))
+            return
+        bisect.insort(self._latin_vocab, token)
+        for entry in self._suffixes(token):
+            bisect.insort(self._latin_suffixes, entry)
+
+    def _remove_latin(self, token: str):
+        pos = bisect.bisect_left(self._latin_vocab, token)
+        if pos < len(self._latin_vocab) and self._latin_vocab[pos] == token:
+            del self._latin_vocab[pos]
+        for entry in self._suffixes(token):
+            pos = bisect.bisect_left(self._latin_suffixes, entry)
+            if pos < len(self._latin_suffixes) and self._latin_suffixes[pos] == entry:
+                del self._latin_suffixes[pos]
+
+    def apply_change(self, before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+        """Prompt变更后增量更新索引"""
+        if self._replay is not None:
+            self._replay.append((before, after))
+        if after is None:
+            self.remove(before.id)
+        else:
+            self.upsert(after)
+
+    def _expand(self, token: str) -> Dict[str, float]:
+        """英文词展开为以它开头或包含它的词（值为得分系数），CJK词精确匹配"""
+        if not _is_latin(token):
+            return {token: 1.0} if token in self._postings else {}
+        start = bisect.bisect_left(self._latin_vocab, token)
+        expanded = {}
+        for vocab_token in self._latin_vocab[start:]:
+            if not vocab_token.startswith(token):
+                break
+            expanded[vocab_token] = 1.0
+        if len(token) >= MIN_INFIX_LENGTH:
+            start = bisect.bisect_left(self._latin_suffixes, (token,))
+            for suffix, vocab_token in self._latin_suffixes[start:]:
+                if not suffix.startswith(token):
+                    break
+                expanded.setdefault(vocab_token, INFIX_MATCH_WEIGHT)
+        return expanded
+
+    def _term_scores(self, token: str) -> Dict[int, float]:
+        """单个查询词在各文档上的得分，展开的多个词取最大值"""
+        scores: Dict[int, float] = {}
+        for vocab_token, factor in self._expand(token).items():
+            posting = self._postings[vocab_token]
+            idf = math.log(1.0 + len(self._docs) / len(posting))
+            for prompt_id, weight in posting.items():
+                score = weight * idf * factor
+                if score > scores.get(prompt_id, 0.0):
+                    scores[prompt_id] = score
+        return scores
+
+    def search(
+        self,
+        query: str,
+        is_r18: Optional[int] = None,
+        tag: Optional[str] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort: str = SORT_RELEVANCE,
+        after: Optional[Tuple[datetime, int]] = None,
+    ) -> Optional[SearchResult]:
+        """
+        检索Prompt，所有查询词都需命中
+        按上传时间排序时直接在索引中排序分页，after为 (上传时间, id) 时只返回排在它之后的结果（游标分页）；
+        调用方只需按本页的ID查询数据库。
+        索引未就绪或查询中没有可索引的词时返回None，由调用方回退到数据库模糊查询
+        """
+        if not self.ready:
+            return None
+        tokens = tokenize_query(query)
+        if not tokens:
+            return None
+
+        # 先处理命中文档最少的词，尽早缩小候选集
+        term_scores = sorted((self._term_scores(token) for token in tokens), key=len)
+        candidates = term_scores[0]
+        totals = dict(candidates)
+        for scores in term_scores[1:]:
+            if not totals:
+                break
+            totals = {pid: total + scores[pid] for pid, total in totals.items() if pid in scores}
+
+        hits = []
+        for prompt_id, score in totals.items():
+            doc = self._docs[prompt_id]
+            if is_r18 is not None and doc.is_r18 != is_r18:
+                continue
+            if tag and tag not in doc.tags:
+                continue
+            hits.append((score, doc.created_at, prompt_id))
+
+        total = len(hits)
+        if sort == SORT_RELEVANCE:
+            # 相关度相同时新的排在前面
+            hits.sort(key=lambda hit: (hit[0], hit[1] is not None, hit[1] or 0, hit[2]), reverse=True)
+        else:
+            # 与数据库的 ORDER BY created_at, id 一致，没有上传时间的排在最后
+            newest = sort == SORT_NEWEST
+            if newest:
+                time_key = lambda created_at, prompt_id: (created_at is not None, created_at or datetime.min, prompt_id)
+            else:
+                time_key = lambda created_at, prompt_id: (created_at is None, created_at or datetime.min, prompt_id)
+            hits.sort(key=lambda hit: time_key(hit[1], hit[2]), reverse=newest)
+            if after is not None:
+                anchor = time_key(*after)
+                if newest:
+                    hits = [hit for hit in hits if time_key(hit[1], hit[2]) < anchor]
+                else:
+                    hits = [hit for hit in hits if time_key(hit[1], hit[2]) > anchor]
+        ranked = [prompt_id for _, _, prompt_id in hits]
+        end = None if limit is None else offset + limit
+        return SearchResult(prompt_ids=ranked[offset:end], total=total)
+
+    async def rebuild(self, db: AsyncSession):
+        """从数据库全量重建索引，在启动时和定时刷新时调用"""
+        self._replay = []
+        try:
+            result = await db.execute(
+                select(models.Prompt)
+                .options(selectinload(models.Prompt.tags))
+                .filter(models.Prompt.status == 1)
+            )
+            prompts = result.scalars().all()
+        finally:
+            replay, self._replay = self._replay, None
+
+        self._docs.clear()
+        self._postings.clear()
+        self._latin_vocab.clear()
+        self._latin_suffixes.clear()
+        self._bulk_loading = True
+        try:
+            for prompt in prompts:
+                self.upsert(snapshot_prompt(prompt))
+        finally:
+            self._bulk_loading = False
+            self._latin_vocab.sort()
+            self._latin_suffixes.sort()
+        # 查询期间本进程提交的变更不一定包含在查询结果中，按原顺序重新应用一次
+        for before, after in replay:
+            self.apply_change(before, after)
+        self.ready = True
+        self.rebuilds += 1
+        logger.info(f"Prompt检索索引构建完成，共 {len(self._docs)} 条")
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                async with get_db_session() as db:
+                    await self.rebuild(db)
+            except Exception as e:
+                logger.error(f"定时重建检索索引失败: {e}")
+
+    def start(self):
+        """启动定时重建，在应用启动时调用"""
+        if self.refresh_interval > 0 and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_periodically())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+
+# 全局索引实例
+search_index = PromptSearchIndex(index_content=SEARCH_INDEX_CONTENT, refresh_interval=SEARCH_INDEX_REFRESH_INTERVAL)
+
+
+@subscribe_prompt_changes
+def _sync_search_index(before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+    search_index.apply_change(before, after)
@@ -0,0 +1,269 @@
+"""
+标签目录模块
+在内存中维护每个标签下已通过审核的Prompt数量（总数、非R18、R18），
+启动时用一条分组查询构建，之后随本进程内的Prompt审核和编辑增量调整，并定时重建以兜底其他进程的修改；
+GET /tags/ 直接从内存生成响应，并缓存序列化结果供ETag协商。
+另外维护一个按规范化标签名排序的数组，用二分查找定位前缀区间，供标签自动补全使用；
+匹配很多的短前缀按使用次数排好序的数组扫描，该数组不随每次计数变化重排，最多每隔 RANKING_MAX_AGE 秒重排一次
+"""
+
+import asyncio
+import bisect
+import hashlib
+import heapq
+import logging
+import time
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..core.config import TAG_CATALOG_REFRESH_INTERVAL
+from ..core.database import get_db_session
+from ..models import models
+from .prompt_events import PromptSnapshot, subscribe_prompt_changes
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(name: str) -> str:
+    """自动补全使用的规范化形式：不区分大小写和全角/半角（中日韩文字保持原样）"""
+    return unicodedata.normalize("NFKC", name).casefold()
+
+
+class TagStats(NamedTuple):
+    id: int
+    name: str
+    prompt_count: int
+    non_r18_count: int
+    r18_count: int
+
+
+# 自动补全的排序键：使用次数多的在前，相同时短的标签名优先，更接近用户正在输入的内容
+_RANKINGS = {
+    None: lambda stats: (-stats.prompt_count, len(stats.name), stats.name),
+    0: lambda stats: (-stats.non_r18_count, -stats.prompt_count, len(stats.name), stats.name),
+    1: lambda stats: (-stats.r18_count, -stats.prompt_count, len(stats.name), stats.name),
+}
+
+
+def _suggestible(stats: TagStats, is_r18: Optional[int]) -> bool:
+    """非R18分区不补全只被R18 Prompt使用过的标签"""
+    return not (is_r18 == 0 and stats.non_r18_count == 0 and stats.r18_count > 0)
+
+
+class TagCatalog:
+    """标签目录，按标签名索引"""
+
+    # 序列化结果和补全结果缓存的最大条目数，前缀的组合较多，超出后整体清空
+    MAX_CACHED_BODIES = 256
+    # 前缀匹配的标签超过该数量时改为按使用次数顺序扫描
+    DENSE_PREFIX_MATCHES = 256
+    # 重建查询期间目录发生变化时，隔多久（秒）再试一次
+    REFRESH_RETRY_DELAY = 1.0
+    # 按使用次数排好序的数组最多使用多久（秒），期间的计数变化只影响扫描到的标签的最终排序
+    RANKING_MAX_AGE = 30.0
+
+    def __init__(self, refresh_interval: float = 300.0):
+        self.refresh_interval = refresh_interval
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.rebuilds = 0
+        self._tags: Dict[str, TagStats] = {}
+        # (规范化标签名, 标签名) 的有序数组，前缀相同的标签在数组中连续
+        self._sorted_names: List[Tuple[str, str]] = []
+        self._bodies: Dict[Tuple[Optional[int], Optional[str]], Tuple[bytes, str]] = {}
+        self._suggestions: Dict[Tuple[str, int, Optional[int]], List[TagStats]] = {}
+        # is_r18 → (排序时间, [(规范化标签名, 标签名)])
+        self._ranked_cache: Dict[Optional[int], Tuple[float, List[Tuple[str, str]]]] = {}
+        self.ready = False
+        # 每次目录变化都会递增，用于判断缓存的响应是否过期
+        self.version = 0
+
+    def __len__(self):
+        return len(self._tags)
+
+    def _changed(self):
+        self.version += 1
+        self._bodies.clear()
+        self._suggestions.clear()
+
+    def register(self, tag_id: int, name: str):
+        """登记新建的标签，已存在时不做修改"""
+        if name not in self._tags:
+            self._tags[name] = TagStats(tag_id, name, 0, 0, 0)
+            bisect.insort(self._sorted_names, (_normalize(name), name))
+            self._changed()
+
+    def _adjust(self, snapshot: PromptSnapshot, sign: int):
+        for name in snapshot.tags:
+            stats = self._tags.get(name)
+            if stats is None:
+                # 尚未登记ID的标签等下次重建时再补齐
+                continue
+            self._tags[name] = stats._replace(
+                prompt_count=max(stats.prompt_count + sign, 0),
+                non_r18_count=max(stats.non_r18_count + (sign if not snapshot.is_r18 else 0), 0),
+                r18_count=max(stats.r18_count + (sign if snapshot.is_r18 else 0), 0),
+            )
+
+    def apply_change(self, before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+        """根据Prompt变更调整计数，只统计已通过审核的Prompt"""
+        was_public = before is not None and before.is_public
+        is_public = after is not None and after.is_public
+        if not was_public and not is_public:
+            return
+        if was_public:
+            self._adjust(before, -1)
+        if is_public:
+            self._adjust(after, 1)
+        self._changed()
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """二分查找以prefix开头的标签在有序数组中的区间"""
+        start = bisect.bisect_left(self._sorted_names, (prefix,))
+        end = bisect.bisect_left(self._sorted_names, (prefix + "\U0010ffff",), lo=start)
+        return start, end
+
+    def _with_prefix(self, prefix: str) -> List[TagStats]:
+        start, end = self._prefix_range(_normalize(prefix))
+        return [self._tags[name] for _, name in self._sorted_names[start:end]]
+
+    def _ranked(self, is_r18: Optional[int]) -> List[Tuple[str, str]]:
+        """
+        按使用次数排好序的全部标签名，最多每隔 RANKING_MAX_AGE 秒重新排序一次，
+        避免写入频繁时每次补全都要重排全部标签；期间新登记的标签使用次数很少，等下次排序时再加入
+        """
+        now = time.monotonic()
+        cached = self._ranked_cache.get(is_r18)
+        if cached is not None and now - cached[0] < self.RANKING_MAX_AGE:
+            return cached[1]
+        rank = _RANKINGS.get(is_r18, _RANKINGS[None])
+        ranked = sorted(self._sorted_names, key=lambda item: rank(self._tags[item[1]]))
+        self._ranked_cache[is_r18] = (now, ranked)
+        return ranked
+
+    def list(self, top: Optional[int] = None, prefix: Optional[str] = None) -> List[TagStats]:
+        """
+        列出标签：默认按ID排序返回全部标签；
+        指定top时只返回使用次数最多的前top个，指定prefix时只返回以其开头的标签（不区分大小写）
+        """
+        tags = self._with_prefix(prefix) if prefix else self._tags.values()
+        if top is not None:
+            return sorted(tags, key=lambda stats: (-stats.prompt_count, stats.name))[:top]
+        return sorted(tags, key=lambda stats: stats.id)
+
+    def suggest(self, prefix: str, limit: int = 10, is_r18: Optional[int] = None) -> List[TagStats]:
+        """
+        标签自动补全：返回以prefix开头、使用次数最多的limit个标签
+        is_r18为0/1时按对应分区下的使用次数排序
+        """
+        prefix = _normalize(prefix.strip())
+        if not prefix:
+            return []
+        cache_key = (prefix, limit, is_r18)
+        cached = self._suggestions.get(cache_key)
+        if cached is not None:
+            return cached
+
+        rank = _RANKINGS.get(is_r18, _RANKINGS[None])
+        start, end = self._prefix_range(prefix)
+        if end - start <= self.DENSE_PREFIX_MATCHES:
+            matched = (self._tags[name] for _, name in self._sorted_names[start:end])
+            result = heapq.nsmallest(limit, (stats for stats in matched if _suggestible(stats, is_r18)), key=rank)
+        else:
+            # 匹配的标签很多（通常是一两个字符的前缀），按使用次数顺序扫描，凑够limit个即可停止
+            result = []
+            for key, name in self._ranked(is_r18):
+                stats = self._tags.get(name)
+                if stats is not None and key.startswith(prefix) and _suggestible(stats, is_r18):
+                    result.append(stats)
+                    if len(result) >= limit:
+                        break
+            # 排序后计数可能已经变化，按当前计数整理扫描到的标签
+            result.sort(key=rank)
+
+        if len(self._suggestions) >= self.MAX_CACHED_BODIES:
+            self._suggestions.clear()
+        self._suggestions[cache_key] = result
+        return result
+
+    def render(self, top: Optional[int], prefix: Optional[str], serialize) -> Tuple[bytes, str]:
+        """返回 (响应字节, ETag)，同一版本内相同参数只序列化一次"""
+        key = (top, _normalize(prefix) if prefix else None)
+        cached = self._bodies.get(key)
+        if cached is None:
+            body = serialize(self.list(top=top, prefix=prefix))
+            cached = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+            if len(self._bodies) >= self.MAX_CACHED_BODIES:
+                self._bodies.clear()
+            self._bodies[key] = cached
+        return cached
+
+    async def rebuild(self, db: AsyncSession) -> bool:
+        """
+        用一条分组查询全量重建目录，在启动时和定时刷新时调用
+        查询期间本进程调整过计数时无法判断查询结果是否已包含这些调整，放弃本次重建并返回False
+        """
+        version = self.version
+        approved = models.Prompt.status == 1
+        result = await db.execute(
+            select(
+                models.Tag.id,
+                models.Tag.name,
+                func.count(case((approved, models.Prompt.id))),
+                func.count(case((approved & (models.Prompt.is_r18 == 0), models.Prompt.id))),
+                func.count(case((approved & (models.Prompt.is_r18 == 1), models.Prompt.id))),
+            )
+            .select_from(models.Tag)
+            .outerjoin(models.prompt_tag, models.prompt_tag.c.tag_id == models.Tag.id)
+            .outerjoin(models.Prompt, models.Prompt.id == models.prompt_tag.c.prompt_id)
+            .group_by(models.Tag.id, models.Tag.name)
+        )
+        rows = result.fetchall()
+        if self.ready and self.version != version:
+            return False
+        self._tags = {row[1]: TagStats(*row) for row in rows}
+        self._sorted_names = sorted((_normalize(name), name) for name in self._tags)
+        self.ready = True
+        self.rebuilds += 1
+        self._ranked_cache.clear()
+        self._changed()
+        logger.info(f"标签目录构建完成，共 {len(self._tags)} 个标签")
+        return True
+
+    async def _refresh_periodically(self):
+        delay = self.refresh_interval
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.refresh_interval
+            try:
+                async with get_db_session() as db:
+                    if not await self.rebuild(db):
+                        delay = self.REFRESH_RETRY_DELAY
+            except Exception as e:
+                logger.error(f"定时重建标签目录失败: {e}")
+
+    def start(self):
+        """启动定时重建，在应用启动时调用"""
+        if self.refresh_interval > 0 and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_periodically())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+
+# 全局目录实例
+tag_catalog = TagCatalog(refresh_interval=TAG_CATALOG_REFRESH_INTERVAL)
+
+
+@subscribe_prompt_changes
+def _adjust_tag_counts(before: Optional[PromptSnapshot], after: Optional[PromptSnapshot]):
+    tag_catalog.apply_change(before, after)
@@ -0,0 +1,146 @@
+"""
+标签解析模块
+把一组标签名批量解析为Tag对象：先查进程内的 标签名→ID 缓存，未命中的用一条 IN 查询补齐，
+仍不存在的标签用一条可容忍冲突的多行INSERT创建，不再逐个标签查询和flush
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.future import select
+
+from ..core.config import TAG_CACHE_SIZE
+from ..core.database import engine, get_db_session
+from ..models import models
+from .tag_catalog import tag_catalog
+
+_tags_table = models.Tag.__table__
+
+
+def _match_rows(rows: Iterable[Tuple[int, str]], names: Iterable[str]) -> Dict[str, Tuple[int, str]]:
+    """
+    把查询结果对应回请求的标签名
+    MySQL默认排序规则不区分大小写，"AI" 可能查到已有的 "ai"，此时沿用库中的写法
+    """
+    exact: Dict[str, Tuple[int, str]] = {}
+    folded: Dict[str, Tuple[int, str]] = {}
+    for tag_id, name in rows:
+        exact[name] = (tag_id, name)
+        folded.setdefault(name.casefold(), (tag_id, name))
+    matched = {}
+    for name in names:
+        entry = exact.get(name) or folded.get(name.casefold())
+        if entry is not None:
+            matched[name] = entry
+    return matched
+
+
+class TagResolver:
+    """标签名→(ID, 库中标签名) 的LRU缓存，标签只增不删，缓存无需失效"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, name: str, entry: Tuple[int, str]):
+        self._entries[name] = entry
+        self._entries.move_to_end(name)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def resolve(self, db: AsyncSession, names: Iterable[str]) -> List[models.Tag]:
+        """
+        解析标签名，返回挂在db会话上的Tag对象（顺序与names一致，已去重、忽略空标签名）
+        不存在的标签会在独立的事务中创建并立即提交，即使调用方随后回滚，缓存中的ID也始终有效
+        """
+        names = list(dict.fromkeys(name for name in names if name))
+        resolved: Dict[str, Tuple[int, str]] = {}
+        missing = []
+        for name in names:
+            entry = self._entries.get(name)
+            if entry is None:
+                missing.append(name)
+            else:
+                self._entries.move_to_end(name)
+                resolved[name] = entry
+        self.hits += len(resolved)
+        self.misses += len(missing)
+
+        if missing:
+            result = await db.execute(
+                select(models.Tag.id, models.Tag.name).filter(models.Tag.name.in_(missing))
+            )
+            resolved.update(_match_rows(result.fetchall(), missing))
+            missing = [name for name in missing if name not in resolved]
+
+        if missing:
+            resolved.update(await self._create(missing))
+
+        tags = []
+        seen_ids = set()
+        for name in names:
+            entry = resolved.get(name)
+            if entry is None:
+                continue
+            self._remember(name, entry)
+            tag_catalog.register(*entry)
+            # 不区分大小写时不同写法可能对应同一个标签
+            if entry[0] in seen_ids:
+                continue
+            seen_ids.add(entry[0])
+            tag_id, stored_name = entry
+            # 会话中已有该标签（例如随Prompt预加载的标签）时直接使用，
+            # 对它执行merge会把反向的prompts集合标记为已修改，导致重复插入关联行
+            tag = db.identity_map.get(identity_key(models.Tag, tag_id))
+            if tag is not None:
+                tags.append(tag)
+                continue
+            # 已知ID时直接并入会话，不再发起查询
+            tag = models.Tag(id=tag_id, name=stored_name)
+            make_transient_to_detached(tag)
+            tags.append(await db.merge(tag, load=False))
+        return tags
+
+    @staticmethod
+    async def _create(names: List[str]) -> Dict[str, Tuple[int, str]]:
+        """一条多行INSERT创建标签，并发请求已经创建的标签会被忽略"""
+        rows = [{"name": name} for name in names]
+        dialect = engine.dialect.name
+        async with get_db_session() as session:
+            if dialect == "mysql":
+                stmt = mysql.insert(_tags_table).values(rows)
+                stmt = stmt.on_duplicate_key_update(id=_tags_table.c.id)
+                await session.execute(stmt)
+            elif dialect == "sqlite":
+                stmt = sqlite.insert(_tags_table).values(rows)
+                await session.execute(stmt.on_conflict_do_nothing(index_elements=["name"]))
+            else:
+                for row in rows:
+                    try:
+                        async with session.begin_nested():
+                            await session.execute(_tags_table.insert().values(**row))
+                    except IntegrityError:
+                        pass
+            result = await session.execute(
+                select(models.Tag.id, models.Tag.name).filter(models.Tag.name.in_(names))
+            )
+            created = _match_rows(result.fetchall(), names)
+            await session.commit()
+        return created
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# 全局解析器实例
+tag_resolver = TagResolver(max_entries=TAG_CACHE_SIZE)
@@ -0,0 +1,155 @@
+"""
+未读数量汇总模块
+原先 /messages/unread-count 和 /messages/summary 每次都要加载用户参与的全部会话，在Python中累加未读数，
+摘要还要再对通知表做一次count查询。这里为每个用户维护一组未读计数（私信总数、各类型通知的未读数），
+保存在 user_unread_counts 表中，与引起变化的写操作在同一事务中原子增减，多进程部署下同样准确；
+读取未读数只需按主键取出该用户的几行
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, func, literal, true, union_all
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from ..core.database import engine
+from ..models import models
+
+_counts_table = models.UserUnreadCount.__table__
+
+MESSAGE_CATEGORY = "message"
+NOTIFICATION_PREFIX = "notification:"
+
+
+def notification_category(notification_type: str) -> str:
+    return NOTIFICATION_PREFIX + notification_type
+
+
+def _upsert(rows_or_select, from_select: bool = False):
+    """插入计数行，已存在时累加，利用 (user_id, category) 主键做原子upsert"""
+    dialect = engine.dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(_counts_table)
+        stmt = stmt.from_select(["user_id", "category", "count"], rows_or_select) if from_select else stmt.values(rows_or_select)
+        return stmt.on_duplicate_key_update(count=_counts_table.c.count + stmt.inserted.count)
+    if dialect == "sqlite":
+        stmt = sqlite.insert(_counts_table)
+        stmt = stmt.from_select(["user_id", "category", "count"], rows_or_select) if from_select else stmt.values(rows_or_select)
+        return stmt.on_conflict_do_update(
+            index_elements=["user_id", "category"],
+            set_={"count": _counts_table.c.count + stmt.excluded.count},
+        )
+    return None
+
+
+async def add(db: AsyncSession, user_ids: Iterable[int], category: str, delta: int = 1):
+    """调整一组用户某一类的未读数，减少时不低于0；在调用方的事务中执行"""
+    user_ids = list(user_ids)
+    if not user_ids or delta == 0:
+        return
+    if delta < 0:
+        await db.execute(
+            _counts_table.update()
+            .where(_counts_table.c.user_id.in_(user_ids), _counts_table.c.category == category)
+            .values(count=case((_counts_table.c.count > -delta, _counts_table.c.count + delta), else_=0))
+        )
+        return
+    stmt = _upsert([{"user_id": user_id, "category": category, "count": delta} for user_id in user_ids])
+    if stmt is not None:
+        await db.execute(stmt)
+        return
+    for user_id in user_ids:
+        result = await db.execute(
+            _counts_table.update()
+            .where(_counts_table.c.user_id == user_id, _counts_table.c.category == category)
+            .values(count=_counts_table.c.count + delta)
+        )
+        if result.rowcount == 0:
+            await db.execute(_counts_table.insert().values(user_id=user_id, category=category, count=delta))
+
+
+async def add_for_all_users(db: AsyncSession, category: str):
+    """所有用户某一类的未读数加1（广播通知），一条 INSERT ... SELECT 完成"""
+    stmt = _upsert(
+        select(models.User.id, literal(category), literal(1)).where(true()),
+        from_select=True,
+    )
+    if stmt is not None:
+        await db.execute(stmt)
+        return
+    result = await db.execute(select(models.User.id))
+    await add(db, result.scalars().all(), category)
+
+
+async def get_counts(db: AsyncSession, user_id: int) -> Dict[str, int]:
+    """用户各类的未读数，主键前缀查询"""
+    result = await db.execute(
+        select(_counts_table.c.category, _counts_table.c.count).where(_counts_table.c.user_id == user_id)
+    )
+    return {category: count for category, count in result.all() if count}
+
+
+def split_counts(counts: Dict[str, int]) -> Tuple[int, Dict[str, int]]:
+    """拆分为 (私信未读数, {通知类型: 未读数})"""
+    notification_counts = {
+        category[len(NOTIFICATION_PREFIX):]: count
+        for category, count in counts.items()
+        if category.startswith(NOTIFICATION_PREFIX)
+    }
+    return counts.get(MESSAGE_CATEGORY, 0), notification_counts
+
+
+async def message_count(db: AsyncSession, user_id: int) -> int:
+    count = await db.scalar(
+        select(_counts_table.c.count).where(
+            _counts_table.c.user_id == user_id,
+            _counts_table.c.category == MESSAGE_CATEGORY,
+        )
+    )
+    return count or 0
+
+
+async def notification_count(db: AsyncSession, user_id: int, notification_type: Optional[str] = None) -> int:
+    """用户的通知未读数，可以只统计某一类型"""
+    query = select(func.coalesce(func.sum(_counts_table.c.count), 0)).where(_counts_table.c.user_id == user_id)
+    if notification_type:
+        query = query.where(_counts_table.c.category == notification_category(notification_type))
+    else:
+        query = query.where(_counts_table.c.category.like(NOTIFICATION_PREFIX + "%"))
+    return int(await db.scalar(query) or 0)
+
+
+async def backfill_if_empty(db: AsyncSession):
+    """计数表为空时（首次部署）按会话和通知表统计一次未读数"""
+    if await db.scalar(select(_counts_table.c.user_id).limit(1)) is not None:
+        return
+    threads = models.MessageThread
+    per_thread = union_all(
+        select(threads.user1_id.label("user_id"), threads.user1_unread_count.label("unread")),
+        select(threads.user2_id, threads.user2_unread_count),
+    ).subquery()
+    notifications = models.Notification
+    columns = ["user_id", "category", "count"]
+    try:
+        await db.execute(_counts_table.insert().from_select(
+            columns,
+            select(per_thread.c.user_id, literal(MESSAGE_CATEGORY), func.sum(per_thread.c.unread))
+            .group_by(per_thread.c.user_id)
+            .having(func.sum(per_thread.c.unread) > 0),
+        ))
+        await db.execute(_counts_table.insert().from_select(
+            columns,
+            select(
+                notifications.user_id,
+                literal(NOTIFICATION_PREFIX) + notifications.notification_type,
+                func.count(notifications.id),
+            )
+            .where(notifications.is_read == 0)
+            .group_by(notifications.user_id, notifications.notification_type),
+        ))
+        await db.commit()
+    except IntegrityError:
+        # 其他进程同时完成了统计
+        await db.rollback()
@@ -0,0 +1,164 @@
+"""
+浏览量写回缓冲模块
+Prompt详情的浏览量先在内存中按Prompt和日期累加，再定时或在积压超过阈值时
+批量写回数据库（prompts.views 原子自增 + daily_views upsert），
+详情接口本身不再开启写事务，也不会在 daily_views 的同一行上串行等待
+"""
+
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.future import select
+
+from ..core.config import VIEW_FLUSH_INTERVAL, VIEW_FLUSH_THRESHOLD
+from ..core.database import engine, get_db_session
+from ..models import models
+
+logger = logging.getLogger(__name__)
+
+_prompts_table = models.Prompt.__table__
+_daily_views_table = models.DailyViews.__table__
+
+
+class ViewCounterBuffer:
+    """浏览量写回缓冲区"""
+
+    def __init__(self, flush_interval: float = 5.0, flush_threshold: int = 500):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._prompt_views: Dict[int, int] = defaultdict(int)
+        self._daily_views: Dict[datetime.date, int] = defaultdict(int)
+        self._pending = 0
+        self._flush_lock = asyncio.Lock()
+        self._loop_task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._threshold_tasks = set()
+        self.flushed_views = 0
+        self.failed_flushes = 0
+
+    def record(self, prompt_id: int, count: int = 1):
+        """记录浏览，积压超过阈值时在后台触发一次写回"""
+        self._prompt_views[prompt_id] += count
+        self._daily_views[datetime.date.today()] += count
+        self._pending += count
+        if self._pending >= self.flush_threshold and not self._flush_lock.locked():
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._threshold_tasks.add(task)
+            task.add_done_callback(self._threshold_tasks.discard)
+
+    def pending_views(self, prompt_id: int) -> int:
+        """尚未写回数据库的该Prompt浏览量"""
+        return self._prompt_views.get(prompt_id, 0)
+
+    def pending_daily_views(self, day: datetime.date) -> int:
+        """尚未写回数据库的某日浏览量"""
+        return self._daily_views.get(day, 0)
+
+    def pending_total(self) -> int:
+        return self._pending
+
+    async def flush(self):
+        """把缓冲的浏览量批量写回数据库，失败时计数会放回缓冲区等待下次写回"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            prompt_views, self._prompt_views = self._prompt_views, defaultdict(int)
+            daily_views, self._daily_views = self._daily_views, defaultdict(int)
+            pending, self._pending = self._pending, 0
+
+            try:
+                async with get_db_session() as db:
+                    # 一条UPDATE语句批量执行，views = views + n 保证多进程下也不会丢失更新
+                    await db.execute(
+                        update(_prompts_table)
+                        .where(_prompts_table.c.id == bindparam("prompt_id"))
+                        .values(views=_prompts_table.c.views + bindparam("delta")),
+                        [{"prompt_id": prompt_id, "delta": delta} for prompt_id, delta in prompt_views.items()],
+                    )
+                    for day, delta in daily_views.items():
+                        await self._upsert_daily_views(db, day, delta)
+                    await db.commit()
+                self.flushed_views += pending
+            except asyncio.CancelledError:
+                # 写回途中被取消时把计数放回缓冲区，交给下一次写回
+                self._requeue(prompt_views, daily_views, pending)
+                raise
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"写回浏览量失败，将在下次重试: {e}")
+                self._requeue(prompt_views, daily_views, pending)
+
+    def _requeue(self, prompt_views: Dict[int, int], daily_views: Dict[datetime.date, int], pending: int):
+        for prompt_id, delta in prompt_views.items():
+            self._prompt_views[prompt_id] += delta
+        for day, delta in daily_views.items():
+            self._daily_views[day] += delta
+        self._pending += pending
+
+    @staticmethod
+    async def _upsert_daily_views(db, day: datetime.date, delta: int):
+        """按日期累加浏览量，利用 _date_uc 唯一约束做原子upsert"""
+        dialect = engine.dialect.name
+        if dialect == "mysql":
+            stmt = mysql.insert(_daily_views_table).values(date=day, views=delta)
+            stmt = stmt.on_duplicate_key_update(views=_daily_views_table.c.views + stmt.inserted.views)
+        elif dialect == "sqlite":
+            stmt = sqlite.insert(_daily_views_table).values(date=day, views=delta)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["date"],
+                set_={"views": _daily_views_table.c.views + stmt.excluded.views},
+            )
+        else:
+            result = await db.execute(select(models.DailyViews).filter(models.DailyViews.date == day))
+            daily = result.scalar_one_or_none()
+            if daily:
+                daily.views += delta
+            else:
+                db.add(models.DailyViews(date=day, views=delta))
+            return
+        await db.execute(stmt)
+
+    async def _flush_periodically(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        """启动定时写回任务，在应用启动时调用"""
+        if self._loop_task is None or self._loop_task.done():
+            self._stopping.clear()
+            self._loop_task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    async def stop(self):
+        """停止定时任务并写回剩余计数，在应用关闭时调用
+        不取消定时任务，而是通知它退出并等待正在进行的写回完成，避免计数在写回中途丢失"""
+        if self._loop_task is not None:
+            self._stopping.set()
+            try:
+                await self._loop_task
+            except Exception as e:
+                logger.error(f"浏览量定时写回任务异常退出: {e}")
+            self._loop_task = None
+        if self._threshold_tasks:
+            await asyncio.gather(*list(self._threshold_tasks), return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending_views": self._pending,
+            "pending_prompts": len(self._prompt_views),
+            "flushed_views": self.flushed_views,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+# 全局缓冲区实例
+view_counter = ViewCounterBuffer(flush_interval=VIEW_FLUSH_INTERVAL, flush_threshold=VIEW_FLUSH_THRESHOLD)
@@ -9,6 +9,7 @@ from app.api.unified_chat import unified_chat_router  # 导入统一聊天路由
 from app.api.user_profile import user_profile_router  # 导入用户主页路由
 from app.api.private_messages import private_message_router  # 导入私信路由
 from app.api.notifications import notification_router  # 导入通知路由
+from app.api.push import push_router  # 导入推送路由
 import pathlib # 新增导入
 from app.core.config import GITHUB_CLIENT_ID, GITHUB_REDIRECT_URI # 导入GitHub OAuth配置
 
@@ -50,6 +51,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # 分页接口通过响应头返回下一页游标
 )
 
 app.include_router(crud_router, prefix="/api/v1", tags=["prompts"])
@@ -59,6 +61,7 @@ app.include_router(unified_chat_router, prefix="/api/v1", tags=["unified-chat"])
 app.include_router(user_profile_router, prefix="/api/v1", tags=["user-profile"])  # 添加用户主页路由
 app.include_router(private_message_router, prefix="/api/v1/messages", tags=["private-messages"])  # 添加私信路由
 app.include_router(notification_router, prefix="/api/v1/messages", tags=["notifications"])  # 添加通知路由
+app.include_router(push_router, prefix="/api/v1/push", tags=["push"])  # 添加推送路由
 
 @app.get("/admin-login")
 async def admin_login():
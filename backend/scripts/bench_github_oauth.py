@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+GitHub OAuth回调延迟压测
+在本地启动一个模拟的GitHub服务（支持HTTP/1.1长连接，新连接额外等待一段时间以模拟TLS握手），
+分别用“每一步新建客户端、串行请求”的旧方式和共享连接池、并发请求的新方式
+完成 换取令牌 → 获取用户信息 → 获取邮箱 的流程，比较平均和P95耗时
+
+用法: python scripts/bench_github_oauth.py [--rounds 50] [--handshake-ms 60] [--latency-ms 30]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+class FakeGitHubServer:
+    """模拟GitHub的OAuth和用户接口"""
+
+    def __init__(self, handshake_delay: float, latency: float):
+        self.handshake_delay = handshake_delay
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _route(self, method: str, path: str):
+        if method == "POST" and path.startswith("/login/oauth/access_token"):
+            return {"access_token": "fake-token", "token_type": "bearer", "scope": "read:user,user:email"}
+        if path.startswith("/user/emails"):
+            return [{"email": "octocat@example.com", "primary": True, "verified": True}]
+        if path.startswith("/user"):
+            return {"id": 1, "login": "octocat", "avatar_url": None, "name": "Octocat", "email": None}
+        return None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        # 新连接需要额外等待，模拟TCP+TLS握手
+        await asyncio.sleep(self.handshake_delay)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length:
+                    await reader.readexactly(length)
+
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                payload = self._route(method, path)
+                body = json.dumps(payload).encode()
+                status_line = "200 OK" if payload is not None else "404 Not Found"
+                writer.write(
+                    f"HTTP/1.1 {status_line}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def legacy_flow(base_url: str):
+    """旧实现：每一步新建客户端，邮箱在用户信息之后串行请求"""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{base_url}/login/oauth/access_token", data={"code": "x"},
+                                     headers={"Accept": "application/json"})
+        token = response.json()["access_token"]
+    async with httpx.AsyncClient() as client:
+        headers = {"Authorization": f"token {token}", "Accept": "application/json"}
+        user = (await client.get(f"{base_url}/user", headers=headers)).json()
+        if not user.get("email"):
+            await client.get(f"{base_url}/user/emails", headers=headers)
+
+
+async def pooled_flow():
+    """新实现：共享连接池，用户信息和邮箱并发请求"""
+    from app.core.github_auth import GitHubOAuth
+
+    token = (await GitHubOAuth.exchange_code("x"))["access_token"]
+    await GitHubOAuth.get_user_info(token)
+
+
+async def measure(name: str, flow, rounds: int, server: FakeGitHubServer):
+    connections_before = server.connections
+    durations = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await flow()
+        durations.append((time.perf_counter() - started) * 1000)
+    durations.sort()
+    p95 = durations[max(int(len(durations) * 0.95) - 1, 0)]
+    print(f"{name:<8} 平均 {statistics.mean(durations):7.1f} ms   P95 {p95:7.1f} ms   "
+          f"新建连接 {server.connections - connections_before}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="GitHub OAuth回调延迟压测")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--handshake-ms", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    server = FakeGitHubServer(args.handshake_ms / 1000, args.latency_ms / 1000)
+    await server.start()
+    base_url = f"http://127.0.0.1:{server.port}"
+
+    # 把GitHub地址指向模拟服务，github_auth在每次请求时读取这两个配置
+    from app.core import config
+    config.GITHUB_OAUTH_URL = base_url
+    config.GITHUB_API_URL = base_url
+    from app.core.github_auth import GitHubOAuth
+
+    print(f"模拟GitHub服务: {base_url}  握手 {args.handshake_ms} ms  单次请求 {args.latency_ms} ms")
+    try:
+        await measure("旧实现", lambda: legacy_flow(base_url), args.rounds, server)
+        await measure("连接池", pooled_flow, args.rounds, server)
+    finally:
+        await GitHubOAuth.aclose()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    os.chdir(project_root)
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Kimi调用延迟压测
+启动 mock_openai_server 中的模拟服务，分别用“每轮对话新建aiohttp会话”的旧方式
+和共享连接池的 OpenAICompatibleProvider 并发发起请求，比较平均、P95耗时和新建连接数，
+最后输出提供方记录的指标
+
+用法: python scripts/bench_llm_provider.py [--rounds 20] [--concurrency 10] [--handshake-ms 60] [--latency-ms 100]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from mock_openai_server import MockOpenAIServer  # noqa: E402
+
+MESSAGES = [
+    {"role": "system", "content": "你是一个乐于助人的助手"},
+    {"role": "user", "content": "你好"},
+]
+
+
+async def legacy_call(url: str):
+    """旧实现：每轮对话新建一个会话"""
+    async with aiohttp.ClientSession() as session:
+        headers = {"Content-Type": "application/json", "Authorization": "Bearer test"}
+        payload = {"model": "moonshot-v1-8k", "messages": MESSAGES, "temperature": 0.7, "stream": False}
+        async with session.post(url, headers=headers, json=payload) as response:
+            result = await response.json()
+            return result["choices"][0]["message"]["content"]
+
+
+async def measure(name: str, call, rounds: int, concurrency: int, server: MockOpenAIServer):
+    connections_before = server.connections
+    durations = []
+
+    async def timed():
+        started = time.perf_counter()
+        await call()
+        durations.append((time.perf_counter() - started) * 1000)
+
+    for _ in range(rounds):
+        await asyncio.gather(*(timed() for _ in range(concurrency)))
+    durations.sort()
+    p95 = durations[max(int(len(durations) * 0.95) - 1, 0)]
+    print(f"{name:<8} 平均 {statistics.mean(durations):7.1f} ms   P95 {p95:7.1f} ms   "
+          f"新建连接 {server.connections - connections_before}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Kimi调用延迟压测")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--handshake-ms", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.handshake_ms / 1000, args.latency_ms / 1000)
+    await server.start()
+
+    from app.services.llm_providers import OpenAICompatibleProvider
+
+    provider = OpenAICompatibleProvider("kimi", "Kimi", api_url=server.url, api_key="test", model="moonshot-v1-8k")
+    print(f"模拟服务: {server.url}  握手 {args.handshake_ms} ms  单次请求 {args.latency_ms} ms  "
+          f"并发 {args.concurrency}")
+    try:
+        await measure("旧实现", lambda: legacy_call(server.url), args.rounds, args.concurrency, server)
+        await measure("连接池", lambda: provider.complete(MESSAGES), args.rounds, args.concurrency, server)
+        print(json.dumps(provider.stats(), ensure_ascii=False, indent=2))
+    finally:
+        await provider.aclose()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    os.chdir(project_root)
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+模拟的OpenAI兼容聊天服务（Kimi接口）
+支持 POST /v1/chat/completions 的普通和流式（SSE）响应，HTTP/1.1长连接，
+新连接额外等待一段时间以模拟TLS握手。可以单独运行供本地调试，也可以在压测脚本中导入使用
+
+用法: python scripts/mock_openai_server.py [--port 8001] [--handshake-ms 60] [--latency-ms 200]
+然后设置 KIMI_API_URL=http://127.0.0.1:8001/v1/chat/completions 和任意 KIMI_API_KEY 启动后端
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List
+
+
+class MockOpenAIServer:
+    """模拟的 /v1/chat/completions 接口，回复内容为最后一条用户消息的回显"""
+
+    def __init__(self, handshake_delay: float = 0.06, latency: float = 0.2,
+                 chunk_delay: float = 0.02, chunks: int = 8):
+        self.handshake_delay = handshake_delay
+        # 收到请求到返回（首段）内容的等待时间
+        self.latency = latency
+        # 流式响应中相邻两段之间的间隔
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1/chat/completions"
+
+    async def start(self, port: int = 0):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _reply_parts(self, messages: List[Dict[str, str]]) -> List[str]:
+        last = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        text = f"收到：{last}"
+        size = max(len(text) // self.chunks, 1)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    @staticmethod
+    def _completion(model: str, content: str) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        }
+
+    @staticmethod
+    def _chunk(model: str, delta: Dict[str, str], finish_reason=None) -> bytes:
+        payload = {
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+    @staticmethod
+    def _write_chunked(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    async def _respond(self, writer: asyncio.StreamWriter, status_line: str, body: bytes):
+        writer.write(
+            f"HTTP/1.1 {status_line}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        # 新连接需要额外等待，模拟TCP+TLS握手
+        await asyncio.sleep(self.handshake_delay)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, value = line.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+
+                self.requests += 1
+                if method != "POST" or not path.startswith("/v1/chat/completions"):
+                    await self._respond(writer, "404 Not Found", b'{"error": "not found"}')
+                    continue
+                if not headers.get("authorization", "").startswith("Bearer "):
+                    await self._respond(writer, "401 Unauthorized", b'{"error": "missing api key"}')
+                    continue
+
+                request = json.loads(body or b"{}")
+                model = request.get("model", "mock")
+                parts = self._reply_parts(request.get("messages", []))
+                await asyncio.sleep(self.latency)
+
+                if not request.get("stream"):
+                    payload = json.dumps(self._completion(model, "".join(parts)), ensure_ascii=False).encode()
+                    await self._respond(writer, "200 OK", payload)
+                else:
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                        b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+                    )
+                    self._write_chunked(writer, self._chunk(model, {"role": "assistant"}))
+                    for index, part in enumerate(parts):
+                        if index:
+                            await asyncio.sleep(self.chunk_delay)
+                        self._write_chunked(writer, self._chunk(model, {"content": part}))
+                        await writer.drain()
+                    self._write_chunked(writer, self._chunk(model, {}, "stop"))
+                    self._write_chunked(writer, b"data: [DONE]\n\n")
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="模拟的OpenAI兼容聊天服务")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--handshake-ms", type=float, default=60)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--chunk-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.handshake_ms / 1000, args.latency_ms / 1000, args.chunk_ms / 1000)
+    await server.start(args.port)
+    print(f"模拟OpenAI兼容服务已启动: {server.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
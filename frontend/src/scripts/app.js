@@ -688,6 +688,7 @@ function renderPrompts(prompts) {
     });
       // 一次性将所有卡片添加到DOM中，减少重绘次数
     promptGrid.appendChild(fragment);
+    loadReactionStates(prompts.map(prompt => prompt.id));
     
     // 如果没有显示任何提示卡片，显示提示信息
     if (promptGrid.children.length === 0) {
@@ -773,6 +774,47 @@ function showLoading(show) {
     loading.style.display = show ? 'block' : 'none';
 }
 
+// 浏览量上报：打开过的Prompt先放入队列，稍后批量上报，页面隐藏时用sendBeacon发送剩余部分
+const VIEW_BEACON_DELAY = 3000;
+const pendingPromptViews = new Set();
+let viewBeaconTimer = null;
+
+function queuePromptView(id) {
+    pendingPromptViews.add(id);
+    if (!viewBeaconTimer) {
+        viewBeaconTimer = setTimeout(flushPromptViews, VIEW_BEACON_DELAY);
+    }
+}
+
+function flushPromptViews() {
+    clearTimeout(viewBeaconTimer);
+    viewBeaconTimer = null;
+    if (pendingPromptViews.size === 0) {
+        return;
+    }
+    
+    const payload = JSON.stringify({ prompt_ids: Array.from(pendingPromptViews) });
+    pendingPromptViews.clear();
+    
+    const url = `${API_BASE_URL}/prompts/views`;
+    const blob = new Blob([payload], { type: 'application/json' });
+    if (!(navigator.sendBeacon && navigator.sendBeacon(url, blob))) {
+        fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: payload,
+            keepalive: true
+        }).catch(error => console.error('上报浏览量失败:', error));
+    }
+}
+
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+        flushPromptViews();
+    }
+});
+window.addEventListener('pagehide', flushPromptViews);
+
 // 打开Prompt详情模态窗口
 async function openPromptDetails(id) {
     try {
@@ -833,7 +875,12 @@ async function openPromptDetails(id) {
         
         document.getElementById('likes-count').textContent = prompt.likes;
         document.getElementById('dislikes-count').textContent = prompt.dislikes;
-        document.getElementById('views-count').textContent = prompt.views || 0;
+        document.getElementById('like-btn').classList.remove('active');
+        document.getElementById('dislike-btn').classList.remove('active');
+        loadReactionStates([prompt.id]);
+        // 本次浏览通过上报接口异步计入，这里先把它算进显示的浏览量
+        queuePromptView(prompt.id);
+        document.getElementById('views-count').textContent = (prompt.views || 0) + 1;
           // 渲染标签
         const tagsContainer = document.getElementById('modal-tags');
         tagsContainer.innerHTML = '';
@@ -1079,39 +1126,27 @@ async function likePrompt(id, buttonElement) {
         // 给按钮添加涟漪效果
         createRippleEffect(buttonElement);
         
-        const response = await fetch(`${API_BASE_URL}/prompts/${id}/like`, {
-            method: 'PUT'
-        });
-          if (!response.ok) {
-            throw new Error('点赞失败');
+        const token = localStorage.getItem('promptmarket_token');
+        if (!token) {
+            showToast('请先登录后再点赞', 'error');
+            return;
         }
         
-        const result = await response.json();
-        
-        // 如果是在详情页中点赞，更新点赞数
-        if (currentPromptId === id) {
-            const likesCount = document.getElementById('likes-count');
-            // 添加数字增加动画
-            const oldValue = parseInt(likesCount.textContent);
-            const newValue = result.likes;
-            if (newValue > oldValue) {
-                likesCount.classList.add('number-change');
-                setTimeout(() => likesCount.classList.remove('number-change'), 500);
-            }
-            likesCount.textContent = newValue;
-        } else {
-            // 只更新当前卡片的点赞数，避免整页刷新
-            const card = buttonElement.closest('.prompt-card');
-            if (card) {
-                const likeCountElement = card.querySelector('.card-stats span:nth-child(2)');
-                if (likeCountElement) {
-                    // 添加数字增加动画
-                    likeCountElement.classList.add('number-change');
-                    setTimeout(() => likeCountElement.classList.remove('number-change'), 500);
-                    likeCountElement.innerHTML = `<i class="fas fa-thumbs-up"></i> ${result.likes}`;
-                }
+        // 已点赞时再次点击视为取消点赞
+        const alreadyLiked = buttonElement.classList.contains('active');
+        const response = await fetch(
+            alreadyLiked ? `${API_BASE_URL}/prompts/${id}/reaction` : `${API_BASE_URL}/prompts/${id}/like`,
+            {
+                method: alreadyLiked ? 'DELETE' : 'PUT',
+                headers: { 'Authorization': `Bearer ${token}` }
             }
+        );
+        if (!response.ok) {
+            throw new Error('点赞失败');
         }
+        
+        const result = await response.json();
+        applyReactionResult(id, result);
     } catch (error) {
         console.error('点赞失败:', error);
         // 使用更友好的错误提示，避免alert阻塞UI
@@ -1124,6 +1159,62 @@ async function likePrompt(id, buttonElement) {
     }
 }
 
+// 把点赞/点踩接口的返回结果同步到卡片和详情弹窗
+function applyReactionResult(id, result) {
+    const updateCount = (element, html) => {
+        if (!element) return;
+        element.classList.add('number-change');
+        setTimeout(() => element.classList.remove('number-change'), 500);
+        element.innerHTML = html;
+    };
+    
+    document.querySelectorAll(`.like-button[data-id="${id}"]`).forEach(btn => {
+        const card = btn.closest('.prompt-card');
+        if (card) {
+            updateCount(card.querySelector('.likes-count'), `<i class="fas fa-thumbs-up"></i> ${result.likes}`);
+            updateCount(card.querySelector('.dislikes-count'), `<i class="fas fa-thumbs-down"></i> ${result.dislikes}`);
+        }
+    });
+    
+    if (currentPromptId === id) {
+        updateCount(document.getElementById('likes-count'), result.likes);
+        updateCount(document.getElementById('dislikes-count'), result.dislikes);
+    }
+    
+    markReactionState(id, result.reaction);
+}
+
+// 根据当前用户的表态高亮点赞/点踩按钮（1 点赞，-1 点踩，null 未表态）
+function markReactionState(id, reaction) {
+    document.querySelectorAll(`.like-button[data-id="${id}"]`).forEach(btn => {
+        btn.classList.toggle('active', reaction === 1);
+    });
+    document.querySelectorAll(`.dislike-button[data-id="${id}"]`).forEach(btn => {
+        btn.classList.toggle('active', reaction === -1);
+    });
+    if (currentPromptId === id) {
+        document.getElementById('like-btn').classList.toggle('active', reaction === 1);
+        document.getElementById('dislike-btn').classList.toggle('active', reaction === -1);
+    }
+}
+
+// 一次请求获取当前用户对一批Prompt的表态
+async function loadReactionStates(promptIds) {
+    const token = localStorage.getItem('promptmarket_token');
+    if (!token || promptIds.length === 0) return;
+    
+    try {
+        const response = await fetch(`${API_BASE_URL}/prompts/reactions?ids=${promptIds.join(',')}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) return;
+        const reactions = await response.json();
+        promptIds.forEach(id => markReactionState(id, reactions[id] ?? null));
+    } catch (error) {
+        console.error('获取点赞状态失败:', error);
+    }
+}
+
 // 显示通知消息
 function showToast(message, type = 'info') {
     const toast = document.createElement('div');
@@ -1309,6 +1400,45 @@ tagsInput.addEventListener('keydown', (e) => {
     }
 });
 
+// 标签自动补全：输入停顿后按前缀请求热门标签，填充到datalist
+const tagSuggestions = document.getElementById('tag-suggestions');
+const TAG_SUGGEST_DELAY = 150;
+let tagSuggestTimer = null;
+let tagSuggestController = null;
+
+tagsInput.addEventListener('input', () => {
+    clearTimeout(tagSuggestTimer);
+    const prefix = tagsInput.value.trim();
+    if (!prefix) {
+        tagSuggestions.innerHTML = '';
+        return;
+    }
+    tagSuggestTimer = setTimeout(async () => {
+        // 取消上一次尚未返回的请求，避免旧结果覆盖新结果
+        if (tagSuggestController) tagSuggestController.abort();
+        tagSuggestController = new AbortController();
+        try {
+            const response = await fetch(
+                `${API_BASE_URL}/tags/suggest?q=${encodeURIComponent(prefix)}&limit=8`,
+                { signal: tagSuggestController.signal }
+            );
+            if (!response.ok) return;
+            const tags = await response.json();
+            tagSuggestions.innerHTML = '';
+            tags.filter(tag => !currentTags.includes(tag.name)).forEach(tag => {
+                const option = document.createElement('option');
+                option.value = tag.name;
+                option.label = `${tag.prompt_count} 个Prompt`;
+                tagSuggestions.appendChild(option);
+            });
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('获取标签建议失败:', error);
+            }
+        }
+    }, TAG_SUGGEST_DELAY);
+});
+
 // 渲染标签
 function renderTags() {
     tagsContainer.innerHTML = '';
@@ -1591,12 +1721,21 @@ async function dislikePrompt(id, button) {
         // 添加涟漪效果
         createRippleEffect(button);
 
-        const response = await fetch(`${API_BASE_URL}/prompts/${id}/dislike`, {
-            method: 'PUT',
-            headers: {
-                'Content-Type': 'application/json'
+        const token = localStorage.getItem('promptmarket_token');
+        if (!token) {
+            showToast('请先登录后再点踩', 'error');
+            return;
+        }
+
+        // 已点踩时再次点击视为取消点踩
+        const alreadyDisliked = button.classList.contains('active');
+        const response = await fetch(
+            alreadyDisliked ? `${API_BASE_URL}/prompts/${id}/reaction` : `${API_BASE_URL}/prompts/${id}/dislike`,
+            {
+                method: alreadyDisliked ? 'DELETE' : 'PUT',
+                headers: { 'Authorization': `Bearer ${token}` }
             }
-        });
+        );
 
         if (!response.ok) {
             const errorData = await response.json();
@@ -1604,26 +1743,7 @@ async function dislikePrompt(id, button) {
         }
 
         const result = await response.json();
-
-        // 更新卡片上的点踩数
-        const card = button.closest('.prompt-card');
-        if (card) {
-            const dislikesCountElement = card.querySelector('.dislikes-count');
-            if (dislikesCountElement) {
-                // 添加数字变化动画
-                dislikesCountElement.classList.add('number-change');
-                setTimeout(() => dislikesCountElement.classList.remove('number-change'), 500);
-                dislikesCountElement.innerHTML = `<i class="fas fa-thumbs-down"></i> ${result.dislikes}`;
-            }
-        }
-
-        // 更新模态框中的点踩数 (如果模态框打开且是当前prompt)
-        if (modal.classList.contains('show') && currentPromptId === id) {
-            const modalDislikesCount = document.getElementById('dislikes-count');
-            modalDislikesCount.classList.add('number-change');
-            setTimeout(() => modalDislikesCount.classList.remove('number-change'), 500);
-            modalDislikesCount.textContent = result.dislikes;
-        }
+        applyReactionResult(id, result);
 
     } catch (error) {
         console.error('点踩失败:', error);
@@ -1849,6 +1969,7 @@ document.addEventListener('DOMContentLoaded', initializeColorScheme);
 // 站内信功能
 let unreadMessageCount = 0;
 let messageCheckInterval = null;
+let pushChannel = null; // 服务端推送连接
 
 /**
  * 初始化站内信功能
@@ -1869,16 +1990,44 @@ function initMessagesFeature() {
 
 /**
  * 启动未读消息检查
+ * 登录后获取一次未读数，之后由服务端推送变化；推送连接断开重连后重新获取一次
  */
 function startUnreadMessageCheck() {
-    // 如果用户已登录，开始定期检查未读消息
     const token = localStorage.getItem('promptmarket_token');
     if (token) {
-        // 立即检查一次
+        stopPushChannel();
+        clearInterval(messageCheckInterval);
         checkUnreadMessages();
         
-        // 每30秒检查一次未读消息
-        messageCheckInterval = setInterval(checkUnreadMessages, 30000);
+        if (typeof createPushChannel === 'function' && 'WebSocket' in window) {
+            pushChannel = createPushChannel(API_BASE_URL, token, {
+                onOpen: checkUnreadMessages,
+                onEvent: handlePushEvent,
+                onUnauthorized: stopUnreadMessageCheck
+            });
+        } else {
+            // 不支持WebSocket时退回到定时轮询
+            messageCheckInterval = setInterval(checkUnreadMessages, 30000);
+        }
+    }
+}
+
+/**
+ * 处理服务端推送的事件
+ */
+function handlePushEvent(event) {
+    if (event.type === 'unread') {
+        updateUnreadMessageBadge(event.private_message_count || 0);
+    }
+}
+
+/**
+ * 关闭推送连接
+ */
+function stopPushChannel() {
+    if (pushChannel) {
+        pushChannel.close();
+        pushChannel = null;
     }
 }
 
@@ -1890,6 +2039,7 @@ function stopUnreadMessageCheck() {
         clearInterval(messageCheckInterval);
         messageCheckInterval = null;
     }
+    stopPushChannel();
     // 重置未读消息计数
     updateUnreadMessageBadge(0);
 }
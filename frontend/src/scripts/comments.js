@@ -22,13 +22,14 @@ async function loadComments(promptId) {
         });
         
         // 获取评论数据
-        const response = await fetch(`${API_BASE_URL}/prompts/${promptId}/comments/`);
+        const response = await fetch(`${API_BASE_URL}/prompts/${promptId}/comments/?normalized=true`);
         
         if (!response.ok) {
             throw new Error('获取评论失败');
         }
         
-        const comments = await response.json();
+        const data = await response.json();
+        const comments = attachUsers(data.comments, data.users, { user: 'user_id' });
         
         // 更新评论计数
         document.getElementById('comments-count').textContent = `(${comments.length})`;
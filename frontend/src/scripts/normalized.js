@@ -0,0 +1,26 @@
+// 规范化响应：请求时带上 normalized=true，列表项只包含用户ID，引用到的用户集中在响应的 users 中（键为用户ID）
+
+/**
+ * 把 users 中的用户对象挂回到列表项上，返回与原先内嵌格式相同的列表，现有的渲染代码无需改动
+ * fields 为 {属性名: ID字段名}，例如 {sender: 'sender_id', receiver: 'receiver_id'}
+ * 多个列表项引用同一个用户时共享同一个对象
+ */
+function attachUsers(items, users, fields) {
+    users = users || {};
+    return (items || []).map(item => {
+        const result = { ...item };
+        Object.entries(fields).forEach(([property, idField]) => {
+            const userId = item[idField];
+            result[property] = userId == null ? null : (users[userId] || null);
+        });
+        return result;
+    });
+}
+
+// 根据 users 查找单个用户，找不到时返回null
+function lookupUser(users, userId) {
+    if (!users || userId == null) {
+        return null;
+    }
+    return users[userId] || null;
+}
@@ -18,7 +18,11 @@ let notifications = [];
 let currentChatUserId = null;
 let currentNotificationId = null;
 let messages = [];
+let olderMessagesCursor = null; // 加载更早消息使用的before参数，为空表示没有更早的消息
+let loadingOlderMessages = false;
 let unreadCount = 0;
+let pushConnected = false; // 推送连接是否正常，正常时未读数由服务端推送
+const MESSAGE_PAGE_SIZE = 50;
 let currentTab = 'private-messages';
 
 // DOM元素
@@ -95,6 +99,9 @@ async function initializePrivateMessages() {
         
         // 绑定事件监听器
         bindEventListeners();
+        
+        // 建立推送连接
+        startPushChannel();
           // 检查URL参数是否指定了特定用户聊天
         const urlParams = new URLSearchParams(window.location.search);
         const userId = urlParams.get('user');
@@ -324,30 +331,54 @@ async function openChatByUsername(username) {
     }
 }
 
+// 获取一页消息，before为空时获取最新的一页
+async function fetchMessagePage(userId, before = null) {
+    const token = localStorage.getItem('promptmarket_token');
+    const params = new URLSearchParams({ limit: MESSAGE_PAGE_SIZE, normalized: 'true' });
+    if (before) {
+        params.set('before', before);
+    }
+    const response = await fetch(`${API_BASE_URL}/messages/conversation/${userId}?${params}`, {
+        headers: {
+            'Authorization': `Bearer ${token}`
+        }
+    });
+    
+    if (response.status === 404) {
+        // 新对话，没有消息
+        return { items: [], nextCursor: null };
+    }
+    if (!response.ok) {
+        throw new Error('获取消息失败');
+    }
+    const data = await response.json();
+    return {
+        items: attachUsers(data.messages, data.users, { sender: 'sender_id', receiver: 'receiver_id' }),
+        nextCursor: response.headers.get('X-Next-Cursor')
+    };
+}
+
 // 加载消息
 async function loadMessages(userId) {
     try {
-        const token = localStorage.getItem('promptmarket_token');
-        const response = await fetch(`${API_BASE_URL}/messages/conversation/${userId}`, {
-            headers: {
-                'Authorization': `Bearer ${token}`
-            }
-        });
-        
-        if (response.ok) {
-            messages = await response.json();
-        } else if (response.status === 404) {
-            // 新对话，没有消息
-            messages = [];
-        } else {
-            throw new Error('获取消息失败');
-        }
+        const page = await fetchMessagePage(userId);
+        messages = page.items;
+        olderMessagesCursor = page.nextCursor;
         
         renderMessages();
         
-        // 重新加载对话列表以更新未读计数
-        await loadConversations();
-        await loadUnreadCount();
+        if (pushConnected) {
+            // 未读数由服务端推送，只需更新本地对话列表中的未读标记
+            const conversation = conversations.find(c => c.other_user.id === userId);
+            if (conversation && conversation.unread_count > 0) {
+                conversation.unread_count = 0;
+                renderConversations();
+            }
+        } else {
+            // 重新加载对话列表以更新未读计数
+            await loadConversations();
+            await loadUnreadCount();
+        }
         
     } catch (error) {
         console.error('加载消息失败:', error);
@@ -355,6 +386,31 @@ async function loadMessages(userId) {
     }
 }
 
+// 滚动到顶部时加载更早的消息，并保持当前可见的位置不变
+async function loadOlderMessages() {
+    if (!olderMessagesCursor || loadingOlderMessages || !currentChatUserId) {
+        return;
+    }
+    loadingOlderMessages = true;
+    const userId = currentChatUserId;
+    try {
+        const page = await fetchMessagePage(userId, olderMessagesCursor);
+        if (userId !== currentChatUserId) {
+            return;
+        }
+        const previousHeight = messagesContainer.scrollHeight;
+        messages = page.items.concat(messages);
+        olderMessagesCursor = page.nextCursor;
+        renderMessages();
+        messagesContainer.scrollTop = messagesContainer.scrollHeight - previousHeight;
+    } catch (error) {
+        console.error('加载更早的消息失败:', error);
+        showToast('加载更早的消息失败', 'error');
+    } finally {
+        loadingOlderMessages = false;
+    }
+}
+
 // 渲染消息
 function renderMessages() {
     messagesContainer.innerHTML = '';
@@ -419,13 +475,8 @@ async function sendMessage() {
         messageInput.value = '';
         updateCharCount();
         
-        // 添加新消息到列表
-        messages.push(newMessage);
-        renderMessages();
-        scrollToBottom();
-        
-        // 重新加载对话列表
-        await loadConversations();
+        // 添加新消息到聊天和对话列表
+        applyMessage(newMessage);
         
     } catch (error) {
         console.error('发送消息失败:', error);
@@ -435,6 +486,89 @@ async function sendMessage() {
     }
 }
 
+// 建立推送连接：新消息、未读数和通知由服务端推送，不再在每次操作后重新拉取
+function startPushChannel() {
+    const token = localStorage.getItem('promptmarket_token');
+    if (!token || typeof createPushChannel !== 'function') {
+        return;
+    }
+    let openedBefore = false;
+    createPushChannel(API_BASE_URL, token, {
+        onOpen: () => {
+            pushConnected = true;
+            // 重连后补齐断开期间可能错过的变化
+            if (openedBefore) {
+                loadConversations();
+                loadMessageSummary();
+            }
+            openedBefore = true;
+        },
+        onClose: () => {
+            pushConnected = false;
+        },
+        onEvent: handlePushEvent
+    });
+}
+
+// 处理服务端推送的事件
+function handlePushEvent(event) {
+    if (event.type === 'message') {
+        applyMessage(event.message, event.thread_id);
+    } else if (event.type === 'unread') {
+        updateMessageCounts(event);
+    } else if (event.type === 'notification') {
+        loadNotifications();
+        loadMessageSummary();
+    }
+}
+
+// 把一条新消息合并到当前聊天和对话列表中，自己发送的消息和推送收到的消息都经过这里
+function applyMessage(message, threadId = null) {
+    const isSent = message.sender_id === currentUser.id;
+    const otherUser = isSent ? message.receiver : message.sender;
+    const isOpenChat = otherUser.id === currentChatUserId;
+    
+    if (isOpenChat && !messages.some(m => m.id === message.id)) {
+        messages.push(message);
+        renderMessages();
+        scrollToBottom();
+        if (!isSent) {
+            markConversationRead(otherUser.id);
+        }
+    }
+    
+    let conversation = conversations.find(c => c.other_user.id === otherUser.id);
+    if (conversation) {
+        conversations = conversations.filter(c => c !== conversation);
+    } else {
+        conversation = { thread_id: threadId, other_user: otherUser, unread_count: 0 };
+    }
+    conversation.latest_message = message.content.slice(0, 100);
+    conversation.last_message_at = message.created_at;
+    if (!isSent && !isOpenChat) {
+        conversation.unread_count += 1;
+    }
+    conversations.unshift(conversation);
+    renderConversations();
+    if (currentChatUserId) {
+        updateConversationSelection(currentChatUserId);
+    }
+}
+
+// 正在查看的对话收到新消息时标记为已读：获取最新的一条消息即可推进已读位置
+async function markConversationRead(userId) {
+    try {
+        const token = localStorage.getItem('promptmarket_token');
+        await fetch(`${API_BASE_URL}/messages/conversation/${userId}?limit=1`, {
+            headers: {
+                'Authorization': `Bearer ${token}`
+            }
+        });
+    } catch (error) {
+        console.error('标记消息已读失败:', error);
+    }
+}
+
 // 加载未读消息计数
 async function loadUnreadCount() {
     try {
@@ -504,6 +638,13 @@ function bindEventListeners() {
     // 发送消息
     sendMessageBtn.addEventListener('click', sendMessage);
     
+    // 滚动到顶部时加载更早的消息
+    messagesContainer.addEventListener('scroll', () => {
+        if (messagesContainer.scrollTop < 50) {
+            loadOlderMessages();
+        }
+    });
+    
     // 输入框事件
     messageInput.addEventListener('input', () => {
         updateCharCount();
@@ -656,7 +797,7 @@ function switchTab(tabName) {
 async function loadNotifications() {
     try {
         const token = localStorage.getItem('promptmarket_token');
-        const response = await fetch(`${API_BASE_URL}/messages/notifications?page=1&per_page=50`, {
+        const response = await fetch(`${API_BASE_URL}/messages/notifications?page=1&per_page=50&normalized=true`, {
             headers: {
                 'Authorization': `Bearer ${token}`
             }
@@ -667,7 +808,15 @@ async function loadNotifications() {
         }
         
         const data = await response.json();
-        notifications = data.notifications || [];
+        notifications = attachUsers(data.notifications, data.users, { sender: 'sender_id' });
+        notifications.forEach(notification => {
+            if (notification.related_prompt) {
+                notification.related_prompt = {
+                    ...notification.related_prompt,
+                    owner: lookupUser(data.users, notification.related_prompt.user_id)
+                };
+            }
+        });
         
         renderNotifications();
         
@@ -0,0 +1,98 @@
+// 服务端推送通道：通过WebSocket接收新私信、未读数变化和新通知，代替定时轮询
+
+/**
+ * 建立推送连接，断开后自动重连
+ * handlers.onEvent(event)  收到事件（心跳除外）
+ * handlers.onOpen()        连接建立（包括重连）时调用，断开期间可能错过事件，应在这里重新获取一次最新状态
+ * handlers.onClose()       连接断开时调用，之后会自动重连
+ * 返回对象的 close() 关闭连接并停止重连
+ */
+function createPushChannel(apiBaseUrl, token, handlers = {}) {
+    const url = `${apiBaseUrl.replace(/^http/, 'ws')}/push/ws?token=${encodeURIComponent(token)}`;
+    // 服务端空闲时每25秒发送一次心跳，超过这个时间没有收到任何消息视为连接已失效
+    const IDLE_TIMEOUT = 60000;
+    const MAX_RETRY_DELAY = 60000;
+
+    let socket = null;
+    let closed = false;
+    let retryDelay = 1000;
+    let retryTimer = null;
+    let idleTimer = null;
+
+    function resetIdleTimer() {
+        clearTimeout(idleTimer);
+        idleTimer = setTimeout(() => {
+            if (socket) {
+                socket.close();
+            }
+        }, IDLE_TIMEOUT);
+    }
+
+    function scheduleReconnect() {
+        if (closed) {
+            return;
+        }
+        // 加入随机抖动，避免服务重启后所有客户端同时重连
+        const delay = retryDelay / 2 + Math.random() * retryDelay / 2;
+        retryDelay = Math.min(retryDelay * 2, MAX_RETRY_DELAY);
+        retryTimer = setTimeout(connect, delay);
+    }
+
+    function connect() {
+        if (closed || !('WebSocket' in window)) {
+            return;
+        }
+        socket = new WebSocket(url);
+
+        socket.onopen = () => {
+            retryDelay = 1000;
+            resetIdleTimer();
+            if (handlers.onOpen) {
+                handlers.onOpen();
+            }
+        };
+
+        socket.onmessage = (message) => {
+            resetIdleTimer();
+            let event;
+            try {
+                event = JSON.parse(message.data);
+            } catch (error) {
+                return;
+            }
+            if (event.type !== 'ping' && handlers.onEvent) {
+                handlers.onEvent(event);
+            }
+        };
+
+        socket.onclose = (event) => {
+            clearTimeout(idleTimer);
+            socket = null;
+            if (handlers.onClose) {
+                handlers.onClose();
+            }
+            // 1008: 令牌无效，重连也不会成功
+            if (event.code === 1008) {
+                closed = true;
+                if (handlers.onUnauthorized) {
+                    handlers.onUnauthorized();
+                }
+                return;
+            }
+            scheduleReconnect();
+        };
+    }
+
+    connect();
+
+    return {
+        close() {
+            closed = true;
+            clearTimeout(retryTimer);
+            clearTimeout(idleTimer);
+            if (socket) {
+                socket.close();
+            }
+        }
+    };
+}
@@ -274,8 +274,8 @@ async function sendUnifiedMessage() {
             requestData.session_id = currentSessionId;
         }
         
-        // 发送请求到后端
-        const response = await fetch(`${API_BASE_URL}/unified-chat`, {
+        // 发送请求到后端，使用流式接口边生成边显示
+        const response = await fetch(`${API_BASE_URL}/unified-chat/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -290,13 +290,7 @@ async function sendUnifiedMessage() {
             throw new Error(errorData.detail || '请求失败');
         }
         
-        // 解析响应数据
-        const data = await response.json();
-        
-        // 更新会话ID
-        currentSessionId = data.session_id;        // 添加AI回复到聊天窗口
-        const modelDisplayName = getModelDisplayName(data.model_type);
-        addUnifiedMessage(data.message, 'ai', modelDisplayName);
+        await renderUnifiedStream(response);
           } catch (error) {
         console.error('发送消息失败:', error);
         
@@ -309,6 +303,64 @@ async function sendUnifiedMessage() {
     }
 }
 
+// 读取流式接口返回的Server-Sent Events，逐段追加到同一条AI消息中
+async function renderUnifiedStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let messageElement = null;
+    let textElement = null;
+    
+    const handleEvent = (eventName, data) => {
+        if (eventName === 'meta') {
+            // 更新会话ID
+            currentSessionId = data.session_id;
+            messageElement = addUnifiedMessage('', 'ai', getModelDisplayName(data.model_type));
+            textElement = messageElement.querySelector('p');
+            // 流式文本直接追加文本节点，用pre-wrap保留换行
+            textElement.style.whiteSpace = 'pre-wrap';
+            messageElement.classList.add('streaming');
+        } else if (eventName === 'delta' && textElement) {
+            textElement.appendChild(document.createTextNode(data.content));
+            const messagesContainer = document.getElementById('unified-chat-messages');
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        } else if (eventName === 'error') {
+            throw new Error(data.detail || '生成失败');
+        }
+    };
+    
+    try {
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // 事件之间以空行分隔
+            let separatorIndex;
+            while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separatorIndex);
+                buffer = buffer.slice(separatorIndex + 2);
+                
+                let eventName = 'message';
+                let dataText = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+                });
+                if (dataText) handleEvent(eventName, JSON.parse(dataText));
+            }
+        }
+    } catch (error) {
+        // 生成失败时移除不完整的回复
+        if (messageElement && !textElement.textContent) {
+            messageElement.remove();
+        }
+        throw error;
+    } finally {
+        if (messageElement) messageElement.classList.remove('streaming');
+    }
+}
+
 // 添加消息到聊天窗口
 function addUnifiedMessage(text, role, modelName = null) {
     const messagesContainer = document.getElementById('unified-chat-messages');
@@ -340,6 +392,8 @@ function addUnifiedMessage(text, role, modelName = null) {
     
     // 滚动到底部
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    
+    return messageElement;
 }
 
 // 添加系统消息